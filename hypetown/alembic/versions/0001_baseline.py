@@ -0,0 +1,222 @@
+"""Базовая схема: таблицы в том виде, в каком их создавал create_all
+
+Существующую БД, созданную create_all, помечаем без изменений:
+    alembic stamp 0001
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+archetype = postgresql.ENUM(
+    "DIRECTOR", "STREAMER", "PRODUCER", "MAGNATE", "BLOGGER", "JOURNALIST",
+    name="archetype",
+    create_type=False,
+)
+building_type = postgresql.ENUM(
+    "CINEMA_STUDIO", "SERIES_LOT", "GAME_STUDIO", "CYBER_ARENA", "RECORDING",
+    "CONCERT_HALL", "SPORTS_ARENA", "TV_STUDIO", "PODCAST_STUDIO",
+    name="buildingtype",
+    create_type=False,
+)
+resource = postgresql.ENUM(
+    "FILM", "SERIES", "GAME", "STREAM", "TRACK", "CONCERT", "MATCH", "BROADCAST", "PODCAST",
+    name="resource",
+    create_type=False,
+)
+match_type = postgresql.ENUM("BATTLE", "QUIZ", name="matchtype", create_type=False)
+guild_role = postgresql.ENUM("LEADER", "OFFICER", "MEMBER", name="guildrole", create_type=False)
+clicker_upgrade_type = postgresql.ENUM(
+    "SMARTPHONE", "CAMERA", "LAPTOP", "STUDIO", "PRODUCTION", "MEDIA_CORP",
+    "VIRAL_ALGO", "GOLD_BUTTON",
+    name="clickerupgradetype",
+    create_type=False,
+)
+
+
+def _player_fk(column: str = "player_id", **kwargs) -> sa.Column:
+    return sa.Column(column, sa.Integer(), sa.ForeignKey("players.id"), **kwargs)
+
+
+# Типы создаются явно: resource используют две таблицы
+ENUM_TYPES = (archetype, building_type, resource, match_type, guild_role, clicker_upgrade_type)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    for enum_type in ENUM_TYPES:
+        enum_type.create(bind, checkfirst=True)
+
+    op.create_table(
+        "players",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("tg_id", sa.BigInteger(), nullable=False),
+        sa.Column("username", sa.String(64), nullable=True),
+        sa.Column("name", sa.String(32), nullable=False),
+        sa.Column("avatar", sa.String(8), nullable=False),
+        sa.Column("archetype", archetype, nullable=False),
+        sa.Column("level", sa.Integer(), nullable=False, server_default="1"),
+        sa.Column("xp", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("coins", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("stars", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("pvp_rating", sa.Integer(), nullable=False, server_default="1000"),
+        sa.Column("prestige", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("tap_power", sa.Integer(), nullable=False, server_default="1"),
+        sa.Column("passive_income", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("is_premium", sa.Boolean(), nullable=False, server_default="false"),
+        sa.Column("premium_until", sa.DateTime(), nullable=True),
+        sa.Column("model_url", sa.String(512), nullable=True),
+        sa.Column("ton_wallet", sa.String(128), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column("last_active", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index("ix_players_tg_id", "players", ["tg_id"], unique=True)
+
+    op.create_table(
+        "buildings",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        _player_fk(nullable=False),
+        sa.Column("type", building_type, nullable=False),
+        sa.Column("level", sa.Integer(), nullable=False, server_default="1"),
+        sa.Column("is_producing", sa.Boolean(), nullable=False, server_default="false"),
+        sa.Column("production_started", sa.DateTime(), nullable=True),
+        sa.Column("production_ends", sa.DateTime(), nullable=True),
+        sa.Column("last_collected", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index("ix_buildings_player_id", "buildings", ["player_id"])
+
+    op.create_table(
+        "inventory",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        _player_fk(nullable=False),
+        sa.Column("resource", resource, nullable=False),
+        sa.Column("quantity", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.create_index("ix_inventory_player_id", "inventory", ["player_id"])
+
+    op.create_table(
+        "orders",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        _player_fk(nullable=False),
+        sa.Column("npc_name", sa.String(64), nullable=False),
+        sa.Column("npc_category", sa.String(32), nullable=False),
+        sa.Column("description", sa.Text(), nullable=False),
+        sa.Column("requirements", sa.JSON(), nullable=False),
+        sa.Column("reward_coins", sa.Integer(), nullable=False),
+        sa.Column("reward_xp", sa.Integer(), nullable=False),
+        sa.Column("bonus_reward_coins", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.Column("completed_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_orders_player_id", "orders", ["player_id"])
+
+    op.create_table(
+        "market_lots",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        _player_fk("seller_id", nullable=False),
+        sa.Column("resource", resource, nullable=False),
+        sa.Column("quantity", sa.Integer(), nullable=False),
+        sa.Column("price", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        _player_fk("buyer_id", nullable=True),
+        sa.Column("sold_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_market_lots_resource", "market_lots", ["resource"])
+    op.create_index("ix_market_lots_expires_at", "market_lots", ["expires_at"])
+
+    op.create_table(
+        "pvp_matches",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        _player_fk("player1_id", nullable=False),
+        _player_fk("player2_id", nullable=False),
+        sa.Column("match_type", match_type, nullable=False),
+        sa.Column("bet", sa.Integer(), nullable=False),
+        _player_fk("winner_id", nullable=True),
+        sa.Column("rating_change", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+    )
+
+    op.create_table(
+        "guilds",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(32), nullable=False, unique=True),
+        _player_fk("leader_id", nullable=False),
+        sa.Column("level", sa.Integer(), nullable=False, server_default="1"),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+    )
+
+    op.create_table(
+        "guild_members",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("guild_id", sa.Integer(), sa.ForeignKey("guilds.id"), nullable=False),
+        _player_fk(nullable=False, unique=True),
+        sa.Column("role", guild_role, nullable=False),
+        sa.Column("joined_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index("ix_guild_members_guild_id", "guild_members", ["guild_id"])
+
+    op.create_table(
+        "clicker_upgrades",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        _player_fk(nullable=False),
+        sa.Column("upgrade_type", clicker_upgrade_type, nullable=False),
+        sa.Column("level", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.create_index("ix_clicker_upgrades_player_id", "clicker_upgrades", ["player_id"])
+
+    op.create_table(
+        "achievements",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        _player_fk(nullable=False),
+        sa.Column("achievement_type", sa.String(64), nullable=False),
+        sa.Column("unlocked_at", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index("ix_achievements_player_id", "achievements", ["player_id"])
+
+    op.create_table(
+        "daily_quests",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        _player_fk(nullable=False),
+        sa.Column("quest_type", sa.String(64), nullable=False),
+        sa.Column("progress", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("target", sa.Integer(), nullable=False),
+        sa.Column("reward_coins", sa.Integer(), nullable=False),
+        sa.Column("reward_xp", sa.Integer(), nullable=False),
+        sa.Column("completed", sa.Boolean(), nullable=False, server_default="false"),
+        sa.Column("date", sa.Date(), nullable=False),
+    )
+    op.create_index("ix_daily_quests_player_id", "daily_quests", ["player_id"])
+
+
+def downgrade() -> None:
+    for table in (
+        "daily_quests",
+        "achievements",
+        "clicker_upgrades",
+        "guild_members",
+        "guilds",
+        "pvp_matches",
+        "market_lots",
+        "orders",
+        "inventory",
+        "buildings",
+        "players",
+    ):
+        op.drop_table(table)
+    bind = op.get_bind()
+    for enum_type in reversed(ENUM_TYPES):
+        enum_type.drop(bind, checkfirst=True)
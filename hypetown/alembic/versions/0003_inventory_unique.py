@@ -0,0 +1,56 @@
+"""Инвентарь: уникальная строка на (player_id, resource), quantity >= 0
+
+Дубликаты, которые успели создать параллельные сборы, схлопываются в
+строку с минимальным id (количества суммируются).
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Схлопнуть дубликаты: сумма — в первую строку, остальные удалить
+    op.execute("""
+        WITH totals AS (
+            SELECT min(id) AS keep_id, sum(quantity) AS total
+            FROM inventory
+            GROUP BY player_id, resource
+            HAVING count(*) > 1
+        )
+        UPDATE inventory i
+        SET quantity = t.total
+        FROM totals t
+        WHERE i.id = t.keep_id
+    """)
+    op.execute("""
+        DELETE FROM inventory i
+        USING inventory keep
+        WHERE i.player_id = keep.player_id
+          AND i.resource = keep.resource
+          AND i.id > keep.id
+    """)
+    op.execute("UPDATE inventory SET quantity = 0 WHERE quantity < 0 OR quantity IS NULL")
+
+    op.create_unique_constraint(
+        "uq_inventory_player_resource", "inventory", ["player_id", "resource"]
+    )
+    op.create_check_constraint(
+        "ck_inventory_quantity_nonnegative", "inventory", sa.text("quantity >= 0")
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint("ck_inventory_quantity_nonnegative", "inventory", type_="check")
+    op.drop_constraint("uq_inventory_player_resource", "inventory", type_="unique")
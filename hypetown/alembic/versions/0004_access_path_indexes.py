@@ -0,0 +1,88 @@
+"""Индексы под горячие запросы и уникальность, на которую опирается логика
+
+- buildings(production_ends) WHERE is_producing — заполнение очереди уведомлений;
+- orders(player_id, expires_at) WHERE completed_at IS NULL — активные заказы;
+- buildings(player_id, type) UNIQUE — одно здание каждого типа;
+- clicker_upgrades(player_id, upgrade_type) UNIQUE — одна строка на апгрейд;
+- daily_quests(player_id, date, quest_type) UNIQUE — один квест типа в день.
+
+Одиночные индексы по player_id, которые покрывает префикс новых
+составных ключей (и ключа инвентаря из 0003), удаляются.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Таблица → (ключ уникальности, порядок «какую строку оставить» из дубликатов)
+_DEDUPE = {
+    "buildings": ("player_id, type", "level DESC, id"),
+    "clicker_upgrades": ("player_id, upgrade_type", "level DESC, id"),
+    "daily_quests": ("player_id, date, quest_type", "id"),
+}
+
+# Одиночные индексы по player_id, ставшие лишними
+_REDUNDANT = ("buildings", "clicker_upgrades", "daily_quests", "inventory")
+
+
+def upgrade() -> None:
+    # Убрать дубликаты перед уникальными ограничениями
+    for table, (cols, keep_order) in _DEDUPE.items():
+        op.execute(f"""
+            DELETE FROM {table}
+            WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, row_number() OVER (
+                        PARTITION BY {cols} ORDER BY {keep_order}
+                    ) AS rn
+                    FROM {table}
+                ) ranked
+                WHERE rn > 1
+            )
+        """)
+
+    op.create_unique_constraint("uq_buildings_player_type", "buildings", ["player_id", "type"])
+    op.create_unique_constraint(
+        "uq_clicker_upgrades_player_type", "clicker_upgrades", ["player_id", "upgrade_type"]
+    )
+    op.create_unique_constraint(
+        "uq_daily_quests_player_date_type", "daily_quests", ["player_id", "date", "quest_type"]
+    )
+
+    op.create_index(
+        "ix_buildings_producing_ends",
+        "buildings",
+        ["production_ends"],
+        postgresql_where=sa.text("is_producing"),
+    )
+    op.create_index(
+        "ix_orders_player_active",
+        "orders",
+        ["player_id", "expires_at"],
+        postgresql_where=sa.text("completed_at IS NULL"),
+    )
+
+    for table in _REDUNDANT:
+        op.drop_index(f"ix_{table}_player_id", table_name=table)
+
+
+def downgrade() -> None:
+    for table in _REDUNDANT:
+        op.create_index(f"ix_{table}_player_id", table, ["player_id"])
+
+    op.drop_index("ix_orders_player_active", table_name="orders")
+    op.drop_index("ix_buildings_producing_ends", table_name="buildings")
+    op.drop_constraint("uq_daily_quests_player_date_type", "daily_quests", type_="unique")
+    op.drop_constraint("uq_clicker_upgrades_player_type", "clicker_upgrades", type_="unique")
+    op.drop_constraint("uq_buildings_player_type", "buildings", type_="unique")
@@ -0,0 +1,34 @@
+"""Применённые батчи леджера тапов: ledger_flushes(batch_id)
+
+Сброс леджера записывает id батча в той же транзакции, что и монеты;
+повтор батча с уже записанным id ничего не зачисляет.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "ledger_flushes",
+        sa.Column("batch_id", sa.String(length=32), primary_key=True),
+        sa.Column("flushed_at", sa.DateTime(), server_default=sa.func.now(), nullable=False),
+    )
+    op.create_index("ix_ledger_flushes_flushed_at", "ledger_flushes", ["flushed_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ledger_flushes_flushed_at", table_name="ledger_flushes")
+    op.drop_table("ledger_flushes")
@@ -0,0 +1,101 @@
+"""Бенчмарк кодирования /api/state: размер ответа и время кодирования.
+
+Игрок максимального уровня: все здания на уровне BUILDING_TABLE_LEVELS,
+все апгрейды кликера на максимуме. Тело собирается той же функцией, что и
+в эндпоинте (game.state.build_state). Импортируются только модули без
+побочных эффектов: конфиг (.env), БД и Redis не нужны.
+
+    cd hypetown && python -m benchmarks.state_payload [--runs 2000]
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+from db.models import Building, ClickerUpgrade, Player
+from game.balance import BUILDING_TABLE_LEVELS, calc_tap_power, farm_rate, xp_for_level
+from game.constants import (
+    CLICKER_UPGRADES,
+    MAX_PLAYER_LEVEL,
+    Archetype,
+    BuildingType,
+    ClickerUpgradeType,
+)
+from game.state import SECTIONS, build_state
+from services.encoder import COMPRESS_MIN_BYTES, COMPRESSORS, ENCODERS
+
+
+def max_level_player() -> Player:
+    """Игрок со всеми зданиями и апгрейдами на максимуме (без БД)."""
+    now = datetime.utcnow()
+    player = Player(
+        id=1_000_000,
+        tg_id=7_000_000_000,
+        username="benchmark",
+        name="Benchmark Player",
+        avatar="🎬",
+        archetype=Archetype.BLOGGER,
+        level=MAX_PLAYER_LEVEL,
+        xp=xp_for_level(MAX_PLAYER_LEVEL),
+        coins=9_000_000_000_000,
+        stars=100_000,
+        pvp_rating=3_500,
+        model_url="https://res.cloudinary.com/hypetown/image/upload/v1/models/7000000000.glb",
+        ton_wallet="UQBvW8Z5huBkMJYdnfAEM5JqTNkuWX3diqYENkWsIL0XggGG",
+    )
+    player.buildings = [
+        Building(
+            id=i + 1,
+            player_id=player.id,
+            type=bt,
+            level=BUILDING_TABLE_LEVELS,
+            is_producing=True,
+            is_continuous=False,
+            last_collected=now - timedelta(hours=1),
+            production_started=now,
+            production_ends=now + timedelta(minutes=30),
+        )
+        for i, bt in enumerate(BuildingType)
+    ]
+    player.clicker_upgrades = [
+        ClickerUpgrade(player_id=player.id, upgrade_type=u, level=CLICKER_UPGRADES[u]["max_level"])
+        for u in ClickerUpgradeType
+    ]
+    player.tap_power = calc_tap_power(player.clicker_upgrades, player.archetype.value)
+    player.passive_income = sum(
+        farm_rate(b.type, b.level, player.archetype.value) for b in player.buildings
+    )
+    return player
+
+
+def _timed(fn, arg, runs: int) -> tuple[bytes, float]:
+    """Результат и среднее время вызова в микросекундах."""
+    result = fn(arg)
+    started = time.perf_counter()
+    for _ in range(runs):
+        fn(arg)
+    return result, (time.perf_counter() - started) / runs * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=2000)
+    args = parser.parse_args()
+
+    data = build_state(max_level_player(), list(SECTIONS), version=1_760_000_000_000)
+    encoders = {"json (stdlib)": lambda d: json.dumps(d).encode()}
+    encoders.update(ENCODERS)
+
+    print(f"/api/state игрока макс. уровня, {args.runs} прогонов; сжатие от {COMPRESS_MIN_BYTES} байт\n")
+    print(f"{'формат':<22} {'сжатие':<7} {'байт':>7} {'кодир., мкс':>12} {'сжатие, мкс':>12}")
+    for name, encode in encoders.items():
+        body, encode_us = _timed(encode, data, args.runs)
+        print(f"{name:<22} {'—':<7} {len(body):>7} {encode_us:>12.1f} {'—':>12}")
+        for encoding, compress in COMPRESSORS.items():
+            packed, compress_us = _timed(compress, body, args.runs)
+            print(f"{name:<22} {encoding:<7} {len(packed):>7} {encode_us:>12.1f} {compress_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
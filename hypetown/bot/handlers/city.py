@@ -6,8 +6,10 @@ from aiogram import F, Router
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 
-from db.database import async_session
-from db.repositories.player import get_player_by_tg_id
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.utils.render import renderer
+from db.models import Player
 from game.constants import BUILDINGS, CITY_LOCATIONS
 from game.farms import get_building_info
 
@@ -74,11 +76,8 @@ def location_keyboard(location_key: str, player_level: int, buildings_info: list
 # ── Хендлеры ──────────────────────────────────────────────────────────
 
 @router.callback_query(F.data == "city:central")
-async def show_city(callback: CallbackQuery) -> None:
+async def show_city(callback: CallbackQuery, player: Player | None) -> None:
     """Центральная площадь — главное меню."""
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-
     if not player:
         await callback.answer("❌ Персонаж не найден!", show_alert=True)
         return
@@ -86,9 +85,11 @@ async def show_city(callback: CallbackQuery) -> None:
     text = (
         f"🏙 <b>HYPETOWN — Центральная площадь</b>\n\n"
         f"{player.avatar} <b>{player.name}</b> | ⭐ Ур. {player.level}\n"
-        f"💰 {player.coins:,} | 💸 {player.passive_income}/мин\n\n"
+        f"💰 {player.balance:,} | 💸 {player.passive_income}/мин\n\n"
         "Выбери локацию:"
     )
+    # С экрана кликера сюда ведёт «В город» — отменить отложенную перерисовку
+    renderer.discard(callback.message)
     try:
         await callback.message.edit_text(text, reply_markup=city_main_keyboard(player.level))
     except TelegramBadRequest:
@@ -97,8 +98,12 @@ async def show_city(callback: CallbackQuery) -> None:
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("city:"))
-async def open_location(callback: CallbackQuery) -> None:
+@router.callback_query(F.data.startswith("city:"), flags={"load_plan": "farms"})
+async def open_location(
+    callback: CallbackQuery,
+    player: Player | None,
+    db_session: AsyncSession,
+) -> None:
     """Открыть конкретную локацию."""
     loc_key = callback.data.split(":", 1)[1]
 
@@ -111,9 +116,6 @@ async def open_location(callback: CallbackQuery) -> None:
         await callback.answer("❌ Локация не найдена!", show_alert=True)
         return
 
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-
     if not player:
         await callback.answer("❌ Персонаж не найден!", show_alert=True)
         return
@@ -128,7 +130,7 @@ async def open_location(callback: CallbackQuery) -> None:
     # Доска заказов → делегируем в orders handler
     if loc_key == "orders":
         from bot.handlers.orders import show_orders
-        await show_orders(callback)
+        await show_orders(callback, player, db_session)
         return
 
     # Ещё не реализованные локации → заглушка
@@ -153,7 +155,7 @@ async def open_location(callback: CallbackQuery) -> None:
 
     text = (
         f"{loc['emoji']} <b>{loc['name']}</b>\n\n"
-        f"💰 Монеты: <b>{player.coins:,}</b>\n"
+        f"💰 Монеты: <b>{player.balance:,}</b>\n"
     )
 
     if buildings_info:
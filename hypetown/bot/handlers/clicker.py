@@ -4,11 +4,12 @@ import logging
 
 from aiogram import F, Router
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from db.database import async_session
-from db.repositories.player import get_player_by_tg_id
+from bot.utils.render import renderer
+from db.database import commit
+from db.models import Player
 from game.clicker import buy_upgrade, get_upgrades_info, process_tap
-from services.redis_service import add_pending_taps, update_leaderboard
 
 logger = logging.getLogger(__name__)
 
@@ -26,39 +27,66 @@ def clicker_main_keyboard() -> InlineKeyboardMarkup:
     ])
 
 
-def upgrades_keyboard(upgrades: list[dict]) -> InlineKeyboardMarkup:
-    """Клавиатура апгрейдов кликера."""
-    buttons = []
+# Режимы покупки: сколько уровней берёт одно нажатие (None — сколько хватит монет)
+BUY_MODES: dict[str, int | None] = {"1": 1, "10": 10, "max": None}
+DEFAULT_BUY_MODE = "1"
+
+
+def parse_buy_mode(mode: str | None) -> str:
+    """Режим покупки из callback_data; неизвестный — режим по умолчанию."""
+    return mode if mode in BUY_MODES else DEFAULT_BUY_MODE
+
+
+def upgrades_keyboard(upgrades: list[dict], mode: str = DEFAULT_BUY_MODE) -> InlineKeyboardMarkup:
+    """Клавиатура апгрейдов кликера с переключателем режима покупки."""
+    buttons = [[
+        InlineKeyboardButton(
+            text=f"• x{m} •" if m == mode else f"x{m}",
+            callback_data=f"clicker:upgrades:{m}",
+        )
+        for m in BUY_MODES
+    ]]
     for upg in upgrades:
+        progress = f"[{upg['level']}/{upg['max_level']}]"
         if upg["maxed"]:
-            text = f"✅ {upg['name']} [{upg['level']}/{upg['max_level']}] MAX"
-        elif upg["affordable"]:
-            text = f"💰 {upg['name']} [{upg['level']}/{upg['max_level']}] — {upg['cost']:,}"
+            text = f"✅ {upg['name']} {progress} MAX"
         else:
-            text = f"🔒 {upg['name']} [{upg['level']}/{upg['max_level']}] — {upg['cost']:,}"
+            icon = "💰" if upg["affordable"] else "🔒"
+            levels = f" +{upg['buy_levels']}" if upg["buy_levels"] > 1 else ""
+            text = f"{icon} {upg['name']} {progress}{levels} — {upg['buy_cost']:,}"
         buttons.append([InlineKeyboardButton(
             text=text,
-            callback_data=f"clicker:buy:{upg['key']}",
+            callback_data=f"clicker:buy:{upg['key']}:{mode}",
         )])
     buttons.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="clicker:main")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+def upgrades_text(player: Player, upgrades: list[dict]) -> str:
+    """Текст экрана апгрейдов."""
+    text = (
+        f"⬆️ <b>Апгрейды кликера</b>\n\n"
+        f"💰 Монеты: <b>{player.balance:,}</b>\n"
+        f"👆 Текущая сила тапа: <b>{player.tap_power}</b>\n\n"
+    )
+    for upg in upgrades:
+        status = "✅ MAX" if upg["maxed"] else f"[{upg['level']}/{upg['max_level']}]"
+        text += f"• {upg['name']} {status} — {upg['bonus']}\n"
+    return text + "\nВыбери апгрейд для покупки:"
+
+
 # ── Хендлеры ──────────────────────────────────────────────────────────
 
 @router.callback_query(F.data == "clicker:main")
-async def show_clicker(callback: CallbackQuery) -> None:
+async def show_clicker(callback: CallbackQuery, player: Player | None) -> None:
     """Показать экран кликера."""
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-
     if not player:
         await callback.answer("❌ Персонаж не найден!", show_alert=True)
         return
 
     await callback.message.edit_text(
         f"🎮 <b>Кликер</b>\n\n"
-        f"💰 Монеты: <b>{player.coins:,}</b>\n"
+        f"💰 Монеты: <b>{player.balance:,}</b>\n"
         f"👆 Сила тапа: <b>{player.tap_power}</b>\n"
         f"⭐ Уровень: {player.level}\n\n"
         "Нажми «ТАП!» чтобы заработать вьюкоины!",
@@ -67,22 +95,22 @@ async def show_clicker(callback: CallbackQuery) -> None:
     await callback.answer()
 
 
-@router.callback_query(F.data == "clicker:tap")
-async def handle_tap(callback: CallbackQuery) -> None:
-    """Обработка тапа из бота."""
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-        if not player:
-            await callback.answer("❌ Персонаж не найден!", show_alert=True)
-            return
-
-        result = await process_tap(session, player, tap_count=1)
+@router.callback_query(F.data == "clicker:tap", flags={"pending_coins": False})
+async def handle_tap(callback: CallbackQuery, player: Player | None) -> None:
+    """Обработка тапа из бота: один вызов Redis (лимит, леджер, лидерборд)."""
+    if not player:
+        await callback.answer("❌ Персонаж не найден!", show_alert=True)
+        return
 
-    # Батчинг в Redis + лидерборд
-    await add_pending_taps(callback.from_user.id, 1)
-    await update_leaderboard(callback.from_user.id, result["total_coins"])
+    result = await process_tap(player, tap_count=1)
+    if not result["taps"]:
+        await callback.answer("⏳ Слишком быстро!")
+        return
 
-    await callback.message.edit_text(
+    # Ответ на callback — сразу; перерисовка экрана — не чаще render_interval
+    await callback.answer(f"+{result['earned']} 💰")
+    await renderer.submit(
+        callback.message,
         f"🎮 <b>Кликер</b>\n\n"
         f"💰 Монеты: <b>{result['total_coins']:,}</b>\n"
         f"👆 Сила тапа: <b>{result['tap_power']}</b>\n"
@@ -90,79 +118,67 @@ async def handle_tap(callback: CallbackQuery) -> None:
         "Нажми «ТАП!» ещё раз!",
         reply_markup=clicker_main_keyboard(),
     )
-    await callback.answer(f"+{result['earned']} 💰")
 
 
-@router.callback_query(F.data == "clicker:upgrades")
-async def show_upgrades(callback: CallbackQuery) -> None:
-    """Показать список апгрейдов."""
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-
+@router.callback_query(F.data.startswith("clicker:upgrades"), flags={"load_plan": "clicker"})
+async def show_upgrades(callback: CallbackQuery, player: Player | None) -> None:
+    """Показать список апгрейдов (clicker:upgrades[:<режим>])."""
     if not player:
         await callback.answer("❌ Персонаж не найден!", show_alert=True)
         return
 
-    upgrades = get_upgrades_info(player)
-
-    text = (
-        f"⬆️ <b>Апгрейды кликера</b>\n\n"
-        f"💰 Монеты: <b>{player.coins:,}</b>\n"
-        f"👆 Текущая сила тапа: <b>{player.tap_power}</b>\n\n"
-    )
-    for upg in upgrades:
-        status = "✅ MAX" if upg["maxed"] else f"[{upg['level']}/{upg['max_level']}]"
-        text += f"• {upg['name']} {status} — {upg['bonus']}\n"
+    parts = callback.data.split(":")
+    mode = parse_buy_mode(parts[2] if len(parts) > 2 else None)
 
+    upgrades = get_upgrades_info(player, BUY_MODES[mode])
+    # Уходим с экрана кликера — отложенная перерисовка тапа больше не нужна
+    renderer.discard(callback.message)
     await callback.message.edit_text(
-        text + "\nВыбери апгрейд для покупки:",
-        reply_markup=upgrades_keyboard(upgrades),
+        upgrades_text(player, upgrades),
+        reply_markup=upgrades_keyboard(upgrades, mode),
     )
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("clicker:buy:"))
-async def handle_buy_upgrade(callback: CallbackQuery) -> None:
-    """Покупка апгрейда."""
-    upgrade_key = callback.data.split(":", 2)[2]
+@router.callback_query(F.data.startswith("clicker:buy:"), flags={"load_plan": "clicker"})
+async def handle_buy_upgrade(
+    callback: CallbackQuery,
+    player: Player | None,
+    db_session: AsyncSession,
+) -> None:
+    """Покупка апгрейда (clicker:buy:<key>[:<режим>])."""
+    parts = callback.data.split(":")
+    upgrade_key = parts[2]
+    mode = parse_buy_mode(parts[3] if len(parts) > 3 else None)
 
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-        if not player:
-            await callback.answer("❌ Персонаж не найден!", show_alert=True)
-            return
+    if not player:
+        await callback.answer("❌ Персонаж не найден!", show_alert=True)
+        return
 
-        result = await buy_upgrade(session, player, upgrade_key)
+    result = await buy_upgrade(db_session, player, upgrade_key, BUY_MODES[mode])
 
     if not result["ok"]:
         error_msgs = {
             "unknown_upgrade": "Неизвестный апгрейд!",
             "max_level": "Достигнут максимальный уровень!",
             "not_enough_coins": f"Не хватает монет! Нужно: {result.get('cost', 0):,}",
+            "conflict": "Апгрейд уже куплен в другом окне — попробуй ещё раз",
         }
         await callback.answer(f"❌ {error_msgs.get(result['error'], 'Ошибка')}", show_alert=True)
         return
 
+    # Зафиксировать покупку до ответа: ошибка отрисовки не откатит её
+    await commit(db_session)
+
     await callback.answer(
-        f"✅ Апгрейд! Ур. {result['new_level']} | Сила тапа: {result['new_tap_power']}",
+        f"✅ Апгрейд +{result['levels']}! Ур. {result['new_level']} | "
+        f"Сила тапа: {result['new_tap_power']}",
         show_alert=True,
     )
 
-    # Обновить экран апгрейдов
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-        upgrades = get_upgrades_info(player)
-
-    text = (
-        f"⬆️ <b>Апгрейды кликера</b>\n\n"
-        f"💰 Монеты: <b>{player.coins:,}</b>\n"
-        f"👆 Текущая сила тапа: <b>{player.tap_power}</b>\n\n"
-    )
-    for upg in upgrades:
-        status = "✅ MAX" if upg["maxed"] else f"[{upg['level']}/{upg['max_level']}]"
-        text += f"• {upg['name']} {status} — {upg['bonus']}\n"
-
+    # Обновить экран апгрейдов — player уже содержит новое состояние
+    upgrades = get_upgrades_info(player, BUY_MODES[mode])
     await callback.message.edit_text(
-        text + "\nВыбери апгрейд для покупки:",
-        reply_markup=upgrades_keyboard(upgrades),
+        upgrades_text(player, upgrades),
+        reply_markup=upgrades_keyboard(upgrades, mode),
     )
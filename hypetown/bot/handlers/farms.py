@@ -5,13 +5,18 @@ import logging
 from aiogram import F, Router
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 
-from db.database import async_session
-from db.repositories.player import get_player_by_tg_id
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.database import commit
+from db.models import Player
 from game.farms import (
     buy_building,
+    collect_all,
     collect_production,
     get_available_buildings,
     get_building_info,
+    set_continuous,
+    start_all,
     start_production,
     upgrade_building,
 )
@@ -33,13 +38,66 @@ def _fmt_time(seconds: int) -> str:
     return f"{m}м {s:02d}с"
 
 
+def buildings_list_text(player: Player, buildings_info: list[dict]) -> str:
+    """Текст списка зданий игрока."""
+    if not buildings_info:
+        return (
+            "🏗 <b>Твои здания</b>\n\n"
+            "У тебя пока нет зданий.\n"
+            "Купи первое здание, чтобы начать производство!"
+        )
+    return (
+        f"🏗 <b>Твои здания</b> ({len(buildings_info)})\n"
+        f"💰 Монеты: <b>{player.balance:,}</b>\n"
+        f"💸 Пассивный доход: {player.passive_income}/мин\n"
+    )
+
+
+def _continuous_status(info: dict) -> str:
+    """Статус склада здания в непрерывном режиме."""
+    stored = f"📦 {info['stored_cycles']}/{info['storage_cap']}"
+    if info["stored_cycles"] >= info["storage_cap"]:
+        return f"{stored} склад полон"
+    return f"{stored}, след. через {_fmt_time(info['remaining_sec'])}"
+
+
+def building_detail_text(info: dict) -> str:
+    """Текст карточки здания."""
+    if info["continuous"]:
+        status = f"🔁 Непрерывно: {_continuous_status(info)}"
+    else:
+        status = "✅ Готово к сбору!" if info["ready"] else (
+            f"⏳ Производство: {_fmt_time(info['remaining_sec'])}" if info["is_producing"]
+            else "💤 Простаивает"
+        )
+    return (
+        f"{info['emoji']} <b>{info['name']}</b> (ур. {info['level']})\n"
+        f"{'━' * 20}\n"
+        f"💰 Доход: {info['income']:,} за цикл\n"
+        f"⏱ Время: {_fmt_time(info['prod_time_sec'])}\n"
+        f"⬆️ Апгрейд: {info['upgrade_cost']:,} 💰\n"
+        f"{'━' * 20}\n"
+        f"Статус: {status}\n"
+    )
+
+
+def _find_building(player: Player, building_id: int):
+    """Найти здание игрока по id (None, если не найдено)."""
+    for b in player.buildings:
+        if b.id == building_id:
+            return b
+    return None
+
+
 # ── Клавиатуры ────────────────────────────────────────────────────────
 
 def buildings_list_keyboard(buildings_info: list[dict]) -> InlineKeyboardMarkup:
     """Клавиатура списка зданий игрока."""
     buttons = []
     for b in buildings_info:
-        if b["ready"]:
+        if b["continuous"]:
+            status = f"🔁 {_continuous_status(b)}"
+        elif b["ready"]:
             status = "✅ ГОТОВО"
         elif b["is_producing"]:
             status = f"⏳ {_fmt_time(b['remaining_sec'])}"
@@ -50,6 +108,18 @@ def buildings_list_keyboard(buildings_info: list[dict]) -> InlineKeyboardMarkup:
             text=text,
             callback_data=f"farm:view:{b['id']}",
         )])
+
+    # Массовые действия — одним нажатием и одной транзакцией
+    ready = sum(1 for b in buildings_info if b["ready"])
+    idle = sum(1 for b in buildings_info if not b["is_producing"] and not b["continuous"])
+    bulk = []
+    if ready > 1:
+        bulk.append(InlineKeyboardButton(text=f"📦 Собрать всё ({ready})", callback_data="farm:collect_all"))
+    if idle > 1:
+        bulk.append(InlineKeyboardButton(text=f"▶️ Запустить всё ({idle})", callback_data="farm:start_all"))
+    if bulk:
+        buttons.append(bulk)
+
     buttons.append([InlineKeyboardButton(text="🏗 Купить здание", callback_data="farm:shop")])
     buttons.append([InlineKeyboardButton(text="⬅️ В город", callback_data="city:central")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
@@ -59,11 +129,12 @@ def building_detail_keyboard(b: dict) -> InlineKeyboardMarkup:
     """Клавиатура конкретного здания."""
     buttons = []
     if b["ready"]:
+        cycles = b["stored_cycles"] if b["continuous"] else 1
         buttons.append([InlineKeyboardButton(
-            text=f"📦 Собрать (+{b['income']:,} 💰)",
+            text=f"📦 Собрать (+{b['income'] * cycles:,} 💰)",
             callback_data=f"farm:collect:{b['id']}",
         )])
-    elif not b["is_producing"]:
+    elif not b["is_producing"] and not b["continuous"]:
         buttons.append([InlineKeyboardButton(
             text=f"▶️ Запустить ({_fmt_time(b['prod_time_sec'])})",
             callback_data=f"farm:start:{b['id']}",
@@ -73,6 +144,10 @@ def building_detail_keyboard(b: dict) -> InlineKeyboardMarkup:
             text=f"⬆️ Улучшить ({b['upgrade_cost']:,} 💰)",
             callback_data=f"farm:upgrade:{b['id']}",
         )])
+        buttons.append([InlineKeyboardButton(
+            text="🔁 Непрерывный режим: ВКЛ" if b["continuous"] else "🔁 Непрерывный режим: ВЫКЛ",
+            callback_data=f"farm:continuous:{b['id']}",
+        )])
     buttons.append([InlineKeyboardButton(text="⬅️ Мои здания", callback_data="farm:list")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
@@ -96,137 +171,103 @@ def shop_keyboard(available: list[dict]) -> InlineKeyboardMarkup:
 
 
 # ── Хендлеры ──────────────────────────────────────────────────────────
+# Всем экранам ферм нужны здания игрока → план загрузки "farms".
+
+FARMS_PLAN = {"load_plan": "farms"}
 
-@router.callback_query(F.data == "farm:list")
-async def show_buildings(callback: CallbackQuery) -> None:
-    """Показать список зданий игрока."""
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
 
+@router.callback_query(F.data == "farm:list", flags=FARMS_PLAN)
+async def show_buildings(callback: CallbackQuery, player: Player | None) -> None:
+    """Показать список зданий игрока."""
     if not player:
         await callback.answer("❌ Персонаж не найден!", show_alert=True)
         return
 
     buildings_info = [get_building_info(b, player.archetype.value) for b in player.buildings]
-
-    if not buildings_info:
-        text = (
-            "🏗 <b>Твои здания</b>\n\n"
-            "У тебя пока нет зданий.\n"
-            "Купи первое здание, чтобы начать производство!"
-        )
-    else:
-        text = f"🏗 <b>Твои здания</b> ({len(buildings_info)})\n"
-        text += f"💰 Монеты: <b>{player.coins:,}</b>\n"
-        text += f"💸 Пассивный доход: {player.passive_income}/мин\n\n"
-
     await callback.message.edit_text(
-        text,
+        buildings_list_text(player, buildings_info),
         reply_markup=buildings_list_keyboard(buildings_info),
     )
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("farm:view:"))
-async def view_building(callback: CallbackQuery) -> None:
+@router.callback_query(F.data.startswith("farm:view:"), flags=FARMS_PLAN)
+async def view_building(callback: CallbackQuery, player: Player | None) -> None:
     """Детали конкретного здания."""
     building_id = int(callback.data.split(":")[2])
 
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-
     if not player:
         await callback.answer("❌ Персонаж не найден!", show_alert=True)
         return
 
-    building = None
-    for b in player.buildings:
-        if b.id == building_id:
-            building = b
-            break
-
+    building = _find_building(player, building_id)
     if not building:
         await callback.answer("❌ Здание не найдено!", show_alert=True)
         return
 
     info = get_building_info(building, player.archetype.value)
-    status = "✅ Готово к сбору!" if info["ready"] else (
-        f"⏳ Производство: {_fmt_time(info['remaining_sec'])}" if info["is_producing"]
-        else "💤 Простаивает"
-    )
-
-    text = (
-        f"{info['emoji']} <b>{info['name']}</b> (ур. {info['level']})\n"
-        f"{'━' * 20}\n"
-        f"💰 Доход: {info['income']:,} за цикл\n"
-        f"⏱ Время: {_fmt_time(info['prod_time_sec'])}\n"
-        f"⬆️ Апгрейд: {info['upgrade_cost']:,} 💰\n"
-        f"{'━' * 20}\n"
-        f"Статус: {status}\n"
-    )
-
-    await callback.message.edit_text(text, reply_markup=building_detail_keyboard(info))
+    await callback.message.edit_text(building_detail_text(info), reply_markup=building_detail_keyboard(info))
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("farm:start:"))
-async def handle_start_production(callback: CallbackQuery) -> None:
+@router.callback_query(F.data.startswith("farm:start:"), flags=FARMS_PLAN)
+async def handle_start_production(
+    callback: CallbackQuery,
+    player: Player | None,
+    db_session: AsyncSession,
+) -> None:
     """Запустить производство."""
     building_id = int(callback.data.split(":")[2])
 
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-        if not player:
-            await callback.answer("❌ Персонаж не найден!", show_alert=True)
-            return
-        result = await start_production(session, player, building_id)
+    if not player:
+        await callback.answer("❌ Персонаж не найден!", show_alert=True)
+        return
+    result = await start_production(db_session, player, building_id)
 
     if not result["ok"]:
         msgs = {
             "building_not_found": "Здание не найдено!",
             "already_producing": "Уже производит!",
+            "continuous_mode": "Здание работает непрерывно!",
         }
         await callback.answer(f"❌ {msgs.get(result['error'], 'Ошибка')}", show_alert=True)
         return
 
+    # Зафиксировать результат до ответа: ошибка отрисовки не откатит его
+    await commit(db_session)
     await callback.answer(f"▶️ Производство запущено! Готово через {_fmt_time(result['duration_sec'])}")
 
     # Обновить вид здания
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-    for b in player.buildings:
-        if b.id == building_id:
-            info = get_building_info(b, player.archetype.value)
-            text = (
-                f"{info['emoji']} <b>{info['name']}</b> (ур. {info['level']})\n"
-                f"{'━' * 20}\n"
-                f"⏳ Производство: {_fmt_time(info['remaining_sec'])}\n"
-            )
-            await callback.message.edit_text(text, reply_markup=building_detail_keyboard(info))
-            break
-
-
-@router.callback_query(F.data.startswith("farm:collect:"))
-async def handle_collect(callback: CallbackQuery) -> None:
+    info = get_building_info(_find_building(player, building_id), player.archetype.value)
+    await callback.message.edit_text(building_detail_text(info), reply_markup=building_detail_keyboard(info))
+
+
+@router.callback_query(F.data.startswith("farm:collect:"), flags=FARMS_PLAN)
+async def handle_collect(
+    callback: CallbackQuery,
+    player: Player | None,
+    db_session: AsyncSession,
+) -> None:
     """Собрать продукцию."""
     building_id = int(callback.data.split(":")[2])
 
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-        if not player:
-            await callback.answer("❌ Персонаж не найден!", show_alert=True)
-            return
-        result = await collect_production(session, player, building_id)
+    if not player:
+        await callback.answer("❌ Персонаж не найден!", show_alert=True)
+        return
+    result = await collect_production(db_session, player, building_id)
 
     if not result["ok"]:
         msgs = {
             "building_not_found": "Здание не найдено!",
             "not_producing": "Ничего не производится!",
+            "already_collected": "Уже собрано!",
             "not_ready": f"Ещё не готово! Осталось: {_fmt_time(result.get('remaining_sec', 0))}",
         }
         await callback.answer(f"❌ {msgs.get(result['error'], 'Ошибка')}", show_alert=True)
         return
 
+    await commit(db_session)
+
     res_text = ""
     if result.get("resource") and result.get("resource_qty"):
         res_text = f" + {result['resource_qty']}x {result['resource']}"
@@ -236,66 +277,144 @@ async def handle_collect(callback: CallbackQuery) -> None:
     )
 
     # Вернуться к списку зданий
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
     buildings_info = [get_building_info(b, player.archetype.value) for b in player.buildings]
-    text = f"🏗 <b>Твои здания</b> ({len(buildings_info)})\n"
-    text += f"💰 Монеты: <b>{player.coins:,}</b>\n"
-    text += f"💸 Пассивный доход: {player.passive_income}/мин\n"
-    await callback.message.edit_text(text, reply_markup=buildings_list_keyboard(buildings_info))
+    await callback.message.edit_text(
+        buildings_list_text(player, buildings_info),
+        reply_markup=buildings_list_keyboard(buildings_info),
+    )
+
+
+@router.callback_query(F.data == "farm:collect_all", flags=FARMS_PLAN)
+async def handle_collect_all(
+    callback: CallbackQuery,
+    player: Player | None,
+    db_session: AsyncSession,
+) -> None:
+    """Собрать продукцию со всех готовых зданий."""
+    if not player:
+        await callback.answer("❌ Персонаж не найден!", show_alert=True)
+        return
+    result = await collect_all(db_session, player)
+
+    if not result["ok"]:
+        await callback.answer("❌ Нечего собирать!", show_alert=True)
+        return
+
+    await commit(db_session)
 
+    res_text = "".join(f" + {qty}x {res}" for res, qty in result["resources"].items())
+    await callback.answer(
+        f"📦 Собрано с {result['collected']} зданий: +{result['income']:,} 💰{res_text}\n"
+        f"Всего: {result['total_coins']:,}",
+        show_alert=True,
+    )
 
-@router.callback_query(F.data.startswith("farm:upgrade:"))
-async def handle_upgrade(callback: CallbackQuery) -> None:
+    buildings_info = [get_building_info(b, player.archetype.value) for b in player.buildings]
+    await callback.message.edit_text(
+        buildings_list_text(player, buildings_info),
+        reply_markup=buildings_list_keyboard(buildings_info),
+    )
+
+
+@router.callback_query(F.data == "farm:start_all", flags=FARMS_PLAN)
+async def handle_start_all(
+    callback: CallbackQuery,
+    player: Player | None,
+    db_session: AsyncSession,
+) -> None:
+    """Запустить производство во всех простаивающих зданиях."""
+    if not player:
+        await callback.answer("❌ Персонаж не найден!", show_alert=True)
+        return
+    result = await start_all(db_session, player)
+
+    if not result["ok"]:
+        await callback.answer("❌ Все здания уже работают!", show_alert=True)
+        return
+
+    await commit(db_session)
+    await callback.answer(f"▶️ Запущено зданий: {result['started']}")
+
+    buildings_info = [get_building_info(b, player.archetype.value) for b in player.buildings]
+    await callback.message.edit_text(
+        buildings_list_text(player, buildings_info),
+        reply_markup=buildings_list_keyboard(buildings_info),
+    )
+
+
+@router.callback_query(F.data.startswith("farm:upgrade:"), flags=FARMS_PLAN)
+async def handle_upgrade(
+    callback: CallbackQuery,
+    player: Player | None,
+    db_session: AsyncSession,
+) -> None:
     """Улучшить здание."""
     building_id = int(callback.data.split(":")[2])
 
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-        if not player:
-            await callback.answer("❌ Персонаж не найден!", show_alert=True)
-            return
-        result = await upgrade_building(session, player, building_id)
+    if not player:
+        await callback.answer("❌ Персонаж не найден!", show_alert=True)
+        return
+    result = await upgrade_building(db_session, player, building_id)
 
     if not result["ok"]:
         msgs = {
             "building_not_found": "Здание не найдено!",
             "cant_upgrade_while_producing": "Нельзя улучшать во время производства!",
+            "collect_first": "Сначала собери продукцию со склада!",
             "not_enough_coins": f"Не хватает монет! Нужно: {result.get('cost', 0):,}",
         }
         await callback.answer(f"❌ {msgs.get(result['error'], 'Ошибка')}", show_alert=True)
         return
 
+    await commit(db_session)
     await callback.answer(
         f"⬆️ Улучшено до ур. {result['new_level']}! Доход: {result['new_income']:,}",
         show_alert=True,
     )
 
     # Обновить вид
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-    for b in player.buildings:
-        if b.id == building_id:
-            info = get_building_info(b, player.archetype.value)
-            text = (
-                f"{info['emoji']} <b>{info['name']}</b> (ур. {info['level']})\n"
-                f"{'━' * 20}\n"
-                f"💰 Доход: {info['income']:,} за цикл\n"
-                f"⏱ Время: {_fmt_time(info['prod_time_sec'])}\n"
-                f"⬆️ Апгрейд: {info['upgrade_cost']:,} 💰\n"
-                f"{'━' * 20}\n"
-                f"Статус: 💤 Простаивает\n"
-            )
-            await callback.message.edit_text(text, reply_markup=building_detail_keyboard(info))
-            break
-
-
-@router.callback_query(F.data == "farm:shop")
-async def show_shop(callback: CallbackQuery) -> None:
-    """Магазин зданий."""
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
+    info = get_building_info(_find_building(player, building_id), player.archetype.value)
+    await callback.message.edit_text(building_detail_text(info), reply_markup=building_detail_keyboard(info))
+
+
+@router.callback_query(F.data.startswith("farm:continuous:"), flags=FARMS_PLAN)
+async def handle_toggle_continuous(
+    callback: CallbackQuery,
+    player: Player | None,
+    db_session: AsyncSession,
+) -> None:
+    """Переключить непрерывный режим производства."""
+    building_id = int(callback.data.split(":")[2])
+
+    if not player:
+        await callback.answer("❌ Персонаж не найден!", show_alert=True)
+        return
+    building = _find_building(player, building_id)
+    if not building:
+        await callback.answer("❌ Здание не найдено!", show_alert=True)
+        return
+    result = await set_continuous(db_session, player, building_id, not building.is_continuous)
+
+    if not result["ok"]:
+        msgs = {
+            "already_producing": "Дождись конца текущего цикла!",
+            "collect_first": "Сначала собери продукцию со склада!",
+        }
+        await callback.answer(f"❌ {msgs.get(result['error'], 'Ошибка')}", show_alert=True)
+        return
+
+    await commit(db_session)
+    await callback.answer(
+        "🔁 Непрерывный режим включён" if result["continuous"] else "⏹ Непрерывный режим выключен"
+    )
+
+    info = get_building_info(building, player.archetype.value)
+    await callback.message.edit_text(building_detail_text(info), reply_markup=building_detail_keyboard(info))
 
+
+@router.callback_query(F.data == "farm:shop", flags=FARMS_PLAN)
+async def show_shop(callback: CallbackQuery, player: Player | None) -> None:
+    """Магазин зданий."""
     if not player:
         await callback.answer("❌ Персонаж не найден!", show_alert=True)
         return
@@ -303,7 +422,7 @@ async def show_shop(callback: CallbackQuery) -> None:
     available = get_available_buildings(player)
     text = (
         f"🏗 <b>Магазин зданий</b>\n\n"
-        f"💰 Монеты: <b>{player.coins:,}</b>\n"
+        f"💰 Монеты: <b>{player.balance:,}</b>\n"
         f"⭐ Уровень: {player.level}\n\n"
     )
     if not available:
@@ -313,17 +432,19 @@ async def show_shop(callback: CallbackQuery) -> None:
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("farm:buy:"))
-async def handle_buy_building(callback: CallbackQuery) -> None:
+@router.callback_query(F.data.startswith("farm:buy:"), flags=FARMS_PLAN)
+async def handle_buy_building(
+    callback: CallbackQuery,
+    player: Player | None,
+    db_session: AsyncSession,
+) -> None:
     """Купить здание."""
     building_type = callback.data.split(":", 2)[2]
 
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-        if not player:
-            await callback.answer("❌ Персонаж не найден!", show_alert=True)
-            return
-        result = await buy_building(session, player, building_type)
+    if not player:
+        await callback.answer("❌ Персонаж не найден!", show_alert=True)
+        return
+    result = await buy_building(db_session, player, building_type)
 
     if not result["ok"]:
         msgs = {
@@ -335,13 +456,12 @@ async def handle_buy_building(callback: CallbackQuery) -> None:
         await callback.answer(f"❌ {msgs.get(result['error'], 'Ошибка')}", show_alert=True)
         return
 
+    await commit(db_session)
     await callback.answer(f"🏗 Здание куплено за {result['cost']:,} 💰!", show_alert=True)
 
     # Показать список зданий
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
     buildings_info = [get_building_info(b, player.archetype.value) for b in player.buildings]
-    text = f"🏗 <b>Твои здания</b> ({len(buildings_info)})\n"
-    text += f"💰 Монеты: <b>{player.coins:,}</b>\n"
-    text += f"💸 Пассивный доход: {player.passive_income}/мин\n"
-    await callback.message.edit_text(text, reply_markup=buildings_list_keyboard(buildings_info))
+    await callback.message.edit_text(
+        buildings_list_text(player, buildings_info),
+        reply_markup=buildings_list_keyboard(buildings_info),
+    )
@@ -1,19 +1,40 @@
 """TMA API: HTTP-эндпоинты для Telegram Mini App (Unity WebGL).
 
 Запускается как aiohttp web-сервер параллельно с ботом.
-Unity клиент шлёт запросы с initData в заголовке Authorization.
+Unity клиент шлёт запросы с initData в заголовке Authorization
+(/ws — в параметре initData: браузерный WebSocket не шлёт заголовки).
 """
 
+import asyncio
 import json
 import logging
-from datetime import datetime
+import math
+from typing import Awaitable, Callable
 
-from aiohttp import web
+from aiohttp import WSMsgType, web
 from aiohttp.web import Request, Response
-
-from db.database import async_session
-from db.repositories.player import get_player_by_tg_id
-from game.constants import ARCHETYPES, BUILDINGS
+from sqlalchemy.exc import SQLAlchemyError
+
+from config import config
+
+from db.database import async_session, commit, savepoint
+from db.repositories.player import LOAD_PLANS, get_player_by_tg_id
+from game.constants import MAX_BATCH_ACTIONS, MAX_TAPS_PER_BATCH
+from game.clicker import (
+    buy_upgrade,
+    process_tap,
+    process_tap_cached,
+    restore_settled_coins,
+    settled_coins_snapshot,
+)
+from game.farms import collect_all, collect_production, start_all, start_production
+from game.quests import check_and_complete_order
+from game.state import SECTIONS, build_state
+from services.encoder import ENCODERS, JSON, encode
+from services.rate_limit import limiter
+from services.realtime import hub
+from services.redis_service import get_pending_coins, get_state_versions
+from services.state_sync import changed_since, mark_changed
 from services.tma_auth import validate_init_data
 
 logger = logging.getLogger(__name__)
@@ -21,69 +42,122 @@ logger = logging.getLogger(__name__)
 routes = web.RouteTableDef()
 
 
-def _get_tg_id(request: Request) -> int | None:
-    """Извлечь и валидировать tg_id из initData в заголовке Authorization."""
+def _respond(
+    request: Request,
+    data,
+    status: int = 200,
+    headers: dict[str, str] | None = None,
+) -> Response:
+    """Ответ в формате и со сжатием, о которых договорились с клиентом (services.encoder)."""
+    body, response_headers = encode(
+        data,
+        request.headers.get("Accept", ""),
+        request.headers.get("Accept-Encoding", ""),
+    )
+    if headers:
+        response_headers.update(headers)
+    return web.Response(body=body, status=status, headers=response_headers)
+
+
+# ── Middleware: авторизация и лимиты ─────────────────────────────────
+
+@web.middleware
+async def auth_middleware(request: Request, handler) -> Response:
+    """Проверить initData из заголовка Authorization один раз на запрос.
+
+    Хендлеры получают request["tg_id"] и request["tma_user"]; без валидной
+    initData — 401.
+    """
     init_data = request.headers.get("Authorization", "")
-    if not init_data:
-        return None
-    data = validate_init_data(init_data)
-    if not data or not data.get("user"):
-        return None
-    return data["user"].get("id")
+    if not init_data and request.path == "/ws":
+        init_data = request.query.get("initData", "")
+    data = validate_init_data(init_data) if init_data else None
+    tg_id = data["user"].get("id") if data and data.get("user") else None
+    if not tg_id:
+        return _respond(request, {"error": "unauthorized"}, status=401)
+
+    request["tg_id"] = tg_id
+    request["tma_user"] = data["user"]
+    return await handler(request)
+
+
+# Путь → действие со своим лимитом; прочие эндпоинты — "api"
+API_ACTIONS: dict[str, str] = {
+    "/api/tap": "tap",
+}
+
+
+@web.middleware
+async def rate_limit_middleware(request: Request, handler) -> Response:
+    """Лимит запросов к TMA API по игроку и действию (общий лимитер с ботом)."""
+    action = API_ACTIONS.get(request.path, "api")
+    retry_after = await limiter.hit(action, request["tg_id"])
+    if retry_after:
+        return _respond(
+            request,
+            {"error": "rate_limited", "retry_after": round(retry_after, 1)},
+            status=429,
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+    return await handler(request)
 
 
 # ── Game State ────────────────────────────────────────────────────────
 
+# Раздел состояния → связи Player, нужные для него
+SECTION_RELATIONS: dict[str, str] = {
+    "buildings": "buildings",
+    "upgrades": "clicker_upgrades",
+}
+
+
+def _relations_plan(relations: set[str]) -> str:
+    """Наименьший план загрузки игрока (LOAD_PLANS), покрывающий связи."""
+    return min(
+        (plan for plan, loaded in LOAD_PLANS.items() if relations <= set(loaded)),
+        key=lambda plan: len(LOAD_PLANS[plan]),
+    )
+
+
+def _state_plan(sections: list[str]) -> str:
+    """План загрузки игрока (LOAD_PLANS) под запрошенные разделы."""
+    return _relations_plan({SECTION_RELATIONS[s] for s in sections if s in SECTION_RELATIONS})
+
+
 @routes.get("/api/state")
 async def get_game_state(request: Request) -> Response:
-    """Получить полное состояние игрока для Unity — монеты, здания, апгрейды."""
-    tg_id = _get_tg_id(request)
-    if not tg_id:
-        return web.json_response({"error": "unauthorized"}, status=401)
+    """Состояние игрока для Unity — монеты, здания, апгрейды.
+
+    Ответ несёт версию состояния (и ETag). If-None-Match с текущей
+    версией — 304 без обращения к БД; ?since=<версия> — только разделы,
+    изменённые после неё ("full": false), или 304, если изменений нет.
+    Версия читается до загрузки из БД: изменение между ними клиент
+    получит повторно, но не потеряет.
+    """
+    tg_id = request["tg_id"]
+
+    versions = await get_state_versions(tg_id)
+    version = versions["v"]
+    etag = f'"{version}"'
+    if request.headers.get("If-None-Match") == etag:
+        return web.Response(status=304, headers={"ETag": etag})
+
+    since = request.query.get("since", "")
+    if since.isdigit():
+        sections = changed_since(versions, int(since))
+        if not sections:
+            return web.Response(status=304, headers={"ETag": etag})
+    else:
+        sections = list(SECTIONS)
 
     async with async_session() as session:
-        player = await get_player_by_tg_id(session, tg_id)
+        player = await get_player_by_tg_id(session, tg_id, plan=_state_plan(sections))
 
     if not player:
-        return web.json_response({"error": "player_not_found"}, status=404)
-
-    arch = ARCHETYPES.get(player.archetype.value, {})
-    buildings_data = []
-    for b in player.buildings:
-        bld_info = BUILDINGS.get(b.type.value, {})
-        buildings_data.append({
-            "id": b.id,
-            "type": b.type.value,
-            "name": bld_info.get("name", ""),
-            "level": b.level,
-            "is_producing": b.is_producing,
-            "production_ends": b.production_ends.isoformat() if b.production_ends else None,
-        })
-
-    return web.json_response({
-        "player": {
-            "id": player.id,
-            "tg_id": player.tg_id,
-            "name": player.name,
-            "avatar": player.avatar,
-            "archetype": player.archetype.value,
-            "archetype_emoji": arch.get("emoji", ""),
-            "level": player.level,
-            "xp": player.xp,
-            "coins": player.coins,
-            "stars": player.stars,
-            "tap_power": player.tap_power,
-            "passive_income": player.passive_income,
-            "pvp_rating": player.pvp_rating,
-            "model_url": player.model_url,
-            "ton_wallet": player.ton_wallet,
-        },
-        "buildings": buildings_data,
-        "upgrades": [
-            {"type": u.upgrade_type.value, "level": u.level}
-            for u in player.clicker_upgrades
-        ],
-    })
+        return _respond(request, {"error": "player_not_found"}, status=404)
+
+    pending = await get_pending_coins(tg_id) if "player" in sections else 0
+    return _respond(request, build_state(player, sections, version, pending), headers={"ETag": etag})
 
 
 # ── Tap (клик из Unity) ──────────────────────────────────────────────
@@ -91,28 +165,196 @@ async def get_game_state(request: Request) -> Response:
 @routes.post("/api/tap")
 async def handle_tap(request: Request) -> Response:
     """Обработка тапов из Unity Mini App. Принимает количество тапов за батч."""
-    tg_id = _get_tg_id(request)
-    if not tg_id:
-        return web.json_response({"error": "unauthorized"}, status=401)
+    tg_id = request["tg_id"]
 
     body = await request.json()
-    tap_count = min(body.get("taps", 1), 50)  # Макс 50 тапов за батч
-
+    tap_count = int(body.get("taps", 1))  # Лимиты батча и темпа — в process_tap
+
+    # Один вызов Redis: лимит темпа, леджер, лидерборд. В players.coins
+    # (и last_active) монеты переносит фоновый сброс леджера. Игрок
+    # грузится из БД только при промахе кэша силы тапа
+    result = await process_tap_cached(tg_id, tap_count)
+    if result is None:
+        async with async_session() as session:
+            player = await get_player_by_tg_id(session, tg_id, plan="core")
+        if not player:
+            return _respond(request, {"error": "player_not_found"}, status=404)
+        result = await process_tap(player, tap_count)
+    return _respond(request, result)
+
+
+# ── WebSocket: поток тапов и push-события ────────────────────────────
+#
+# Одно соединение на игрока вместо POST на каждый батч: initData
+# проверяется один раз при рукопожатии. Клиент шлёт кадры
+# {"t": "tap", "n": <тапов>}; сервер копит их и раз в
+# config.ws_tap_flush_interval применяет одним process_tap, отвечая
+# {"t": "coins", ...}. События игрока из любого воркера ("state",
+# "farm_ready", "order") приходят через services.realtime.hub.
+
+WS_HEARTBEAT = 30.0
+
+
+def _ws_dumps(event: dict) -> str:
+    return ENCODERS[JSON](event).decode()
+
+
+class _TapStream:
+    """Тапы одного соединения: копятся и уходят в Redis раз в интервал."""
+
+    def __init__(self, ws: web.WebSocketResponse, player):
+        self.ws = ws
+        self.player = player
+        self.taps = 0
+
+    def add(self, count: int) -> None:
+        # Сверх MAX_TAPS_PER_BATCH за интервал process_tap всё равно отрежет
+        self.taps = min(self.taps + max(0, count), MAX_TAPS_PER_BATCH)
+
+    async def flush(self) -> dict | None:
+        """Применить накопленные тапы. None — нечего применять."""
+        if not self.taps:
+            return None
+        taps, self.taps = self.taps, 0
+        return await process_tap(self.player, taps)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(config.ws_tap_flush_interval)
+            result = await self.flush()
+            if result is not None:
+                await self.ws.send_str(_ws_dumps({"t": "coins", **result}))
+
+    async def reload(self) -> None:
+        """Перечитать игрока: баланс и сила тапа изменились вне соединения."""
+        async with async_session() as session:
+            player = await get_player_by_tg_id(session, self.player.tg_id)
+        if player is not None:
+            self.player = player
+
+
+async def _push_events(ws: web.WebSocketResponse, queue: asyncio.Queue, stream: _TapStream) -> None:
+    """Переслать клиенту события игрока из pub/sub."""
+    while True:
+        event = await queue.get()
+        if event.get("t") == "state" and "player" in event.get("sections", ()):
+            await stream.reload()
+            event["coins"] = stream.player.coins + await get_pending_coins(stream.player.tg_id)
+        await ws.send_str(_ws_dumps(event))
+
+
+@routes.get("/ws")
+async def websocket(request: Request) -> web.StreamResponse:
+    """WebSocket Mini App: тапы от клиента, события состояния к клиенту."""
+    tg_id = request["tg_id"]
     async with async_session() as session:
         player = await get_player_by_tg_id(session, tg_id)
+    if not player:
+        return _respond(request, {"error": "player_not_found"}, status=404)
+
+    ws = web.WebSocketResponse(heartbeat=WS_HEARTBEAT)
+    await ws.prepare(request)
+
+    queue = await hub.connect(tg_id)
+    stream = _TapStream(ws, player)
+    tasks = [
+        asyncio.create_task(stream.run()),
+        asyncio.create_task(_push_events(ws, queue, stream)),
+    ]
+    try:
+        versions = await get_state_versions(tg_id)
+        await ws.send_str(_ws_dumps({"t": "hello", "version": versions["v"]}))
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            try:
+                frame = json.loads(msg.data)
+                if frame.get("t") == "tap":
+                    stream.add(int(frame.get("n", 1)))
+            except (ValueError, TypeError, AttributeError):
+                continue
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await hub.disconnect(tg_id, queue)
+        # Тапы, накопленные до закрытия, не теряются
+        await stream.flush()
+    return ws
+
+
+# ── Апгрейды кликера ─────────────────────────────────────────────────
+
+def _parse_count(raw) -> int | None:
+    """Количество уровней апгрейда: число или "max" (None)."""
+    return None if raw == "max" else int(raw)
+
+
+@routes.post("/api/upgrade")
+async def handle_upgrade(request: Request) -> Response:
+    """Купить апгрейд кликера: {"upgrade": key, "count": N | "max"}.
+
+    Любое количество уровней — один запрос и одна транзакция.
+    """
+    tg_id = request["tg_id"]
+
+    body = await request.json()
+    upgrade_key = body.get("upgrade", "")
+    try:
+        count = _parse_count(body.get("count", 1))
+    except (TypeError, ValueError):
+        return _respond(request, {"error": "invalid_count"}, status=400)
+
+    async with async_session() as session:
+        player = await get_player_by_tg_id(session, tg_id, plan="clicker")
         if not player:
-            return web.json_response({"error": "player_not_found"}, status=404)
+            return _respond(request, {"error": "player_not_found"}, status=404)
+
+        try:
+            result = await buy_upgrade(session, player, upgrade_key, count)
+            await commit(session)
+        except Exception:
+            await restore_settled_coins(session)
+            raise
+
+    if result["ok"]:
+        result["coins"] = player.coins
+    return _respond(request, result)
+
 
-        earned = player.tap_power * tap_count
-        player.coins += earned
-        player.last_active = datetime.utcnow()
-        await session.commit()
+# ── Фермы: массовые действия ─────────────────────────────────────────
 
-        return web.json_response({
-            "earned": earned,
-            "total_coins": player.coins,
-            "tap_power": player.tap_power,
-        })
+async def _farms_bulk_action(request: Request, action) -> Response:
+    """Выполнить collect_all/start_all в одной транзакции."""
+    tg_id = request["tg_id"]
+
+    async with async_session() as session:
+        player = await get_player_by_tg_id(session, tg_id, plan="farms")
+        if not player:
+            return _respond(request, {"error": "player_not_found"}, status=404)
+        # total_coins в ответе учитывает несброшенные тапы
+        player.pending_coins = await get_pending_coins(tg_id)
+
+        try:
+            result = await action(session, player)
+            await commit(session)
+        except Exception:
+            await restore_settled_coins(session)
+            raise
+
+    return _respond(request, result)
+
+
+@routes.post("/api/farms/collect_all")
+async def handle_collect_all(request: Request) -> Response:
+    """Собрать продукцию со всех готовых зданий."""
+    return await _farms_bulk_action(request, collect_all)
+
+
+@routes.post("/api/farms/start_all")
+async def handle_start_all(request: Request) -> Response:
+    """Запустить производство во всех простаивающих зданиях."""
+    return await _farms_bulk_action(request, start_all)
 
 
 # ── 3D Model URL ─────────────────────────────────────────────────────
@@ -120,24 +362,30 @@ async def handle_tap(request: Request) -> Response:
 @routes.post("/api/model")
 async def update_model_url(request: Request) -> Response:
     """Обновить URL 3D-модели персонажа (GLB из TripoSR/Cloudinary)."""
-    tg_id = _get_tg_id(request)
-    if not tg_id:
-        return web.json_response({"error": "unauthorized"}, status=401)
+    tg_id = request["tg_id"]
 
     body = await request.json()
-    model_url = body.get("model_url", "")
-    if not model_url or len(model_url) > 512:
-        return web.json_response({"error": "invalid_model_url"}, status=400)
-
     async with async_session() as session:
         player = await get_player_by_tg_id(session, tg_id)
         if not player:
-            return web.json_response({"error": "player_not_found"}, status=404)
+            return _respond(request, {"error": "player_not_found"}, status=404)
 
-        player.model_url = model_url
-        await session.commit()
+        result = await _set_model_url(session, player, body)
+        if not result["ok"]:
+            return _respond(request, result, status=400)
+        await commit(session)
 
-        return web.json_response({"ok": True, "model_url": model_url})
+        return _respond(request, result)
+
+
+async def _set_model_url(session, player, params: dict) -> dict:
+    model_url = params.get("model_url", "")
+    if not isinstance(model_url, str) or not model_url or len(model_url) > 512:
+        return {"ok": False, "error": "invalid_model_url"}
+
+    player.model_url = model_url
+    mark_changed(session, player.tg_id, "player")
+    return {"ok": True, "model_url": model_url}
 
 
 # ── TON Wallet ────────────────────────────────────────────────────────
@@ -145,30 +393,246 @@ async def update_model_url(request: Request) -> Response:
 @routes.post("/api/wallet/connect")
 async def connect_wallet(request: Request) -> Response:
     """Привязать TON-кошелёк к профилю игрока."""
-    tg_id = _get_tg_id(request)
-    if not tg_id:
-        return web.json_response({"error": "unauthorized"}, status=401)
+    tg_id = request["tg_id"]
 
     body = await request.json()
-    wallet_address = body.get("address", "")
-    if not wallet_address:
-        return web.json_response({"error": "missing_address"}, status=400)
-
     async with async_session() as session:
         player = await get_player_by_tg_id(session, tg_id)
         if not player:
-            return web.json_response({"error": "player_not_found"}, status=404)
+            return _respond(request, {"error": "player_not_found"}, status=404)
+
+        result = await _connect_wallet(session, player, body)
+        if not result["ok"]:
+            return _respond(request, result, status=400)
+        await commit(session)
+
+        return _respond(request, result)
 
-        player.ton_wallet = wallet_address
-        await session.commit()
 
-        return web.json_response({"ok": True, "wallet": wallet_address})
+async def _connect_wallet(session, player, params: dict) -> dict:
+    wallet_address = params.get("address", "")
+    if not isinstance(wallet_address, str) or not wallet_address:
+        return {"ok": False, "error": "missing_address"}
+
+    player.ton_wallet = wallet_address
+    mark_changed(session, player.tg_id, "player")
+    return {"ok": True, "wallet": wallet_address}
+
+
+# ── Batch: несколько действий за один запрос ─────────────────────────
+#
+# {"mode": "atomic" | "best_effort", "actions": [{"type": ..., ...}, ...]}
+# Одна проверка initData, одна загрузка игрока (план — по связям, нужным
+# действиям), одна транзакция. Действия выполняются по порядку, ответ —
+# результат каждого в "results".
+#
+# atomic (по умолчанию) — всё или ничего: первый отказ откатывает
+# транзакцию, оставшиеся действия получают "aborted".
+# best_effort — каждое действие в своём savepoint: отказ откатывает только
+# его, остальное коммитится.
+#
+# Тапы ("tap", {"taps": N}) идут в леджер Redis, как /api/tap, и откатом
+# транзакции не отменяются.
+
+BATCH_MODES = ("atomic", "best_effort")
+
+
+async def _batch_upgrade(session, player, params: dict) -> dict:
+    try:
+        count = _parse_count(params.get("count", 1))
+    except (TypeError, ValueError):
+        return {"ok": False, "error": "invalid_count"}
+    return await buy_upgrade(session, player, params.get("upgrade", ""), count)
+
+
+def _int_param(params: dict, name: str) -> int | None:
+    value = params.get(name)
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+async def _batch_start(session, player, params: dict) -> dict:
+    building_id = _int_param(params, "building_id")
+    if building_id is None:
+        return {"ok": False, "error": "invalid_building_id"}
+    result = await start_production(session, player, building_id)
+    if result["ok"]:
+        result["production_ends"] = result["production_ends"].isoformat()
+    return result
+
+
+async def _batch_collect(session, player, params: dict) -> dict:
+    building_id = _int_param(params, "building_id")
+    if building_id is None:
+        return {"ok": False, "error": "invalid_building_id"}
+    return await collect_production(session, player, building_id)
+
+
+async def _batch_collect_all(session, player, params: dict) -> dict:
+    return await collect_all(session, player)
+
+
+async def _batch_start_all(session, player, params: dict) -> dict:
+    return await start_all(session, player)
+
+
+async def _batch_complete_order(session, player, params: dict) -> dict:
+    order_id = _int_param(params, "order_id")
+    if order_id is None:
+        return {"ok": False, "error": "invalid_order_id"}
+    return await check_and_complete_order(session, player, order_id)
+
+
+# Тип действия → (связь Player, нужная действию, или None; функция)
+BATCH_ACTIONS: dict[str, tuple[str | None, Callable[..., Awaitable[dict]]]] = {
+    "upgrade": ("clicker_upgrades", _batch_upgrade),
+    "start": ("buildings", _batch_start),
+    "collect": ("buildings", _batch_collect),
+    "start_all": ("buildings", _batch_start_all),
+    "collect_all": ("buildings", _batch_collect_all),
+    "complete_order": (None, _batch_complete_order),
+    "model": (None, _set_model_url),
+    "wallet": (None, _connect_wallet),
+}
+
+BATCH_TAP = "tap"
+
+
+class _ActionFailed(Exception):
+    """Внутренний сигнал отката savepoint действия в best_effort."""
+
+    def __init__(self, result: dict):
+        super().__init__(result.get("error"))
+        self.result = result
+
+
+async def _batch_tap(player, params: dict) -> dict:
+    try:
+        tap_count = max(0, int(params.get("taps", 1)))
+    except (TypeError, ValueError):
+        return {"ok": False, "error": "invalid_count"}
+    result = await process_tap(player, tap_count)
+    player.pending_coins = result["total_coins"] - player.coins
+    return {"ok": True, **result}
+
+
+async def _run_isolated(session, player, action, params: dict, plan: str) -> dict:
+    """Выполнить действие в savepoint; при отказе откатить только его.
+
+    plan — план загрузки, с которым batch загрузил игрока.
+    """
+    # После отката атрибуты player просрочены — tg_id берём заранее
+    tg_id = player.tg_id
+    snapshot = settled_coins_snapshot(session)
+    try:
+        async with savepoint(session, keep=("settled_coins",)):
+            result = await action(session, player, params)
+            if not result["ok"]:
+                raise _ActionFailed(result)
+        return result
+    except _ActionFailed as failed:
+        result = failed.result
+    except SQLAlchemyError:
+        logger.exception("Ошибка действия %s в batch", params.get("type"))
+        result = {"ok": False, "error": "internal_error"}
+
+    # Откат savepoint просрочил изменённые объекты: перечитать игрока со
+    # связями тем же планом (lazy="raise" не даст дочитать их неявно).
+    # Из identity map вернётся тот же объект player
+    await restore_settled_coins(session, snapshot)
+    await get_player_by_tg_id(session, tg_id, plan=plan, reload=True)
+    player.pending_coins = await get_pending_coins(tg_id)
+    return result
+
+
+def _validate_batch(body) -> str | None:
+    """Код ошибки для некорректного тела batch или None."""
+    if not isinstance(body, dict):
+        return "invalid_batch"
+    if body.get("mode", "atomic") not in BATCH_MODES:
+        return "invalid_mode"
+    actions = body.get("actions")
+    if not isinstance(actions, list) or not actions:
+        return "invalid_batch"
+    if len(actions) > MAX_BATCH_ACTIONS:
+        return "too_many_actions"
+    for action in actions:
+        if not isinstance(action, dict):
+            return "invalid_batch"
+        if action.get("type") != BATCH_TAP and action.get("type") not in BATCH_ACTIONS:
+            return "unknown_action"
+    return None
+
+
+@routes.post("/api/batch")
+async def handle_batch(request: Request) -> Response:
+    """Выполнить упорядоченный список действий в одной транзакции.
+
+    Ответ: {"ok": все действия успешны, "mode", "committed", "results",
+    "coins": баланс после batch}.
+    """
+    tg_id = request["tg_id"]
+
+    body = await request.json()
+    error = _validate_batch(body)
+    if error:
+        return _respond(request, {"error": error}, status=400)
+    mode = body.get("mode", "atomic")
+    actions = body["actions"]
+    atomic = mode == "atomic"
+
+    plan = _relations_plan({
+        BATCH_ACTIONS[a["type"]][0] for a in actions if a["type"] != BATCH_TAP
+    } - {None})
+
+    async with async_session() as session:
+        player = await get_player_by_tg_id(session, tg_id, plan=plan)
+        if not player:
+            return _respond(request, {"error": "player_not_found"}, status=404)
+        player.pending_coins = await get_pending_coins(tg_id)
+        loaded_coins = player.coins
+
+        results = []
+        failed = False
+        try:
+            for params in actions:
+                if failed:
+                    results.append({"ok": False, "error": "aborted"})
+                    continue
+                if params["type"] == BATCH_TAP:
+                    result = await _batch_tap(player, params)
+                elif atomic:
+                    result = await BATCH_ACTIONS[params["type"]][1](session, player, params)
+                else:
+                    result = await _run_isolated(
+                        session, player, BATCH_ACTIONS[params["type"]][1], params, plan,
+                    )
+                results.append(result)
+                failed = atomic and not result["ok"]
+
+            if failed:
+                # Транзакция откатится при выходе из контекста
+                await restore_settled_coins(session)
+                coins = loaded_coins + await get_pending_coins(tg_id)
+            else:
+                await commit(session)
+                coins = player.balance
+        except Exception:
+            await restore_settled_coins(session)
+            raise
+
+    return _respond(request, {
+        "ok": all(r["ok"] for r in results),
+        "mode": mode,
+        "committed": not failed,
+        "results": results,
+        "coins": coins,
+    })
 
 
 # ── Фабрика приложения ───────────────────────────────────────────────
 
 def create_webapp() -> web.Application:
     """Создать aiohttp приложение для TMA API."""
-    app = web.Application()
+    app = web.Application(middlewares=[auth_middleware, rate_limit_middleware])
     app.add_routes(routes)
     return app
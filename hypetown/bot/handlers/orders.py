@@ -6,9 +6,11 @@ from datetime import datetime
 from aiogram import F, Router
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 
-from db.database import async_session
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.database import commit
+from db.models import Player
 from db.repositories.inventory import get_inventory
-from db.repositories.player import get_player_by_tg_id
 from game.quests import (
     check_and_complete_order,
     format_requirements,
@@ -38,6 +40,17 @@ NPC_CATEGORY_EMOJI = {
 }
 
 
+def orders_board_text(player: Player, orders: list) -> str:
+    """Текст доски заказов."""
+    return (
+        f"📋 <b>Доска заказов</b>\n\n"
+        f"💰 Монеты: <b>{player.balance:,}</b>\n"
+        f"Активных заказов: {len(orders)}/3\n\n"
+        "Выполняй заказы от знаменитостей за вьюкоины и опыт!\n"
+        "⚡ Бонус +50% за выполнение в первые 30 мин."
+    )
+
+
 # ── Клавиатуры ────────────────────────────────────────────────────────
 
 def orders_list_keyboard(orders: list) -> InlineKeyboardMarkup:
@@ -76,46 +89,46 @@ def order_detail_keyboard(order_id: int, can_complete: bool) -> InlineKeyboardMa
 # ── Хендлеры ──────────────────────────────────────────────────────────
 
 @router.callback_query(F.data == "order:list")
-async def show_orders(callback: CallbackQuery) -> None:
+async def show_orders(
+    callback: CallbackQuery,
+    player: Player | None,
+    db_session: AsyncSession,
+) -> None:
     """Показать доску заказов."""
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-        if not player:
-            await callback.answer("❌ Персонаж не найден!", show_alert=True)
-            return
+    if not player:
+        await callback.answer("❌ Персонаж не найден!", show_alert=True)
+        return
 
-        orders = await get_active_orders(session, player.id)
+    orders = await get_active_orders(db_session, player.id)
 
-        # Если заказов мало — догенерировать
-        if len(orders) < 3:
-            new = await generate_orders(session, player)
-            orders = await get_active_orders(session, player.id)
+    # Если заказов мало — догенерировать (новые истекают позже всех,
+    # поэтому порядок по expires_at сохраняется без повторного запроса)
+    if len(orders) < 3:
+        orders += await generate_orders(db_session, player)
+        await commit(db_session)
 
-    text = (
-        f"📋 <b>Доска заказов</b>\n\n"
-        f"💰 Монеты: <b>{player.coins:,}</b>\n"
-        f"Активных заказов: {len(orders)}/3\n\n"
-        "Выполняй заказы от знаменитостей за вьюкоины и опыт!\n"
-        "⚡ Бонус +50% за выполнение в первые 30 мин."
+    await callback.message.edit_text(
+        orders_board_text(player, orders),
+        reply_markup=orders_list_keyboard(orders),
     )
-
-    await callback.message.edit_text(text, reply_markup=orders_list_keyboard(orders))
     await callback.answer()
 
 
 @router.callback_query(F.data.startswith("order:view:"))
-async def view_order(callback: CallbackQuery) -> None:
+async def view_order(
+    callback: CallbackQuery,
+    player: Player | None,
+    db_session: AsyncSession,
+) -> None:
     """Детали конкретного заказа."""
     order_id = int(callback.data.split(":")[2])
 
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-        if not player:
-            await callback.answer("❌ Персонаж не найден!", show_alert=True)
-            return
+    if not player:
+        await callback.answer("❌ Персонаж не найден!", show_alert=True)
+        return
 
-        orders = await get_active_orders(session, player.id)
-        inventory = await get_inventory(session, player.id)
+    orders = await get_active_orders(db_session, player.id)
+    inventory = await get_inventory(db_session, player.id)
 
     order = None
     for o in orders:
@@ -166,17 +179,19 @@ async def view_order(callback: CallbackQuery) -> None:
 
 
 @router.callback_query(F.data.startswith("order:complete:"))
-async def complete_order(callback: CallbackQuery) -> None:
+async def complete_order(
+    callback: CallbackQuery,
+    player: Player | None,
+    db_session: AsyncSession,
+) -> None:
     """Выполнить заказ."""
     order_id = int(callback.data.split(":")[2])
 
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-        if not player:
-            await callback.answer("❌ Персонаж не найден!", show_alert=True)
-            return
+    if not player:
+        await callback.answer("❌ Персонаж не найден!", show_alert=True)
+        return
 
-        result = await check_and_complete_order(session, player, order_id)
+    result = await check_and_complete_order(db_session, player, order_id)
 
     if not result["ok"]:
         msgs = {
@@ -188,6 +203,9 @@ async def complete_order(callback: CallbackQuery) -> None:
         await callback.answer(f"❌ {msgs.get(result['error'], 'Ошибка')}", show_alert=True)
         return
 
+    # Зафиксировать выполнение до ответа: ошибка отрисовки не откатит его
+    await commit(db_session)
+
     # Формируем сообщение об успехе
     text = (
         f"🎉 <b>Заказ выполнен!</b>\n\n"
@@ -211,33 +229,33 @@ async def complete_order(callback: CallbackQuery) -> None:
 
 
 @router.callback_query(F.data == "order:refresh")
-async def refresh_orders(callback: CallbackQuery) -> None:
+async def refresh_orders(
+    callback: CallbackQuery,
+    player: Player | None,
+    db_session: AsyncSession,
+) -> None:
     """Обновить / догенерировать заказы."""
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-        if not player:
-            await callback.answer("❌ Персонаж не найден!", show_alert=True)
-            return
+    if not player:
+        await callback.answer("❌ Персонаж не найден!", show_alert=True)
+        return
 
-        new = await generate_orders(session, player)
-        orders = await get_active_orders(session, player.id)
+    orders = await get_active_orders(db_session, player.id)
+    new = await generate_orders(db_session, player)
+    orders += new
+    await commit(db_session)
 
     if new:
         await callback.answer(f"📋 Новых заказов: {len(new)}")
     else:
         await callback.answer("Все слоты заняты — выполни текущие заказы")
 
-    text = (
-        f"📋 <b>Доска заказов</b>\n\n"
-        f"💰 Монеты: <b>{player.coins:,}</b>\n"
-        f"Активных заказов: {len(orders)}/3\n\n"
-        "Выполняй заказы от знаменитостей за вьюкоины и опыт!\n"
-        "⚡ Бонус +50% за выполнение в первые 30 мин."
+    await callback.message.edit_text(
+        orders_board_text(player, orders),
+        reply_markup=orders_list_keyboard(orders),
     )
-    await callback.message.edit_text(text, reply_markup=orders_list_keyboard(orders))
 
 
-@router.callback_query(F.data == "order:noop")
+@router.callback_query(F.data == "order:noop", flags={"load_plan": None})
 async def noop(callback: CallbackQuery) -> None:
     """Заглушка для неактивных кнопок."""
     await callback.answer("❌ Не хватает ресурсов! Запусти производство на фермах.", show_alert=True)
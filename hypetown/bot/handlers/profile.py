@@ -1,15 +1,18 @@
 """Хендлер профиля игрока: /profile и callback."""
 
+import html
 import logging
 
 from aiogram import F, Router
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.types import CallbackQuery, Message
 
-from bot.keyboards.inline import profile_keyboard
-from db.database import async_session
-from db.repositories.player import get_player_by_tg_id
-from game.constants import ARCHETYPES
+from bot.keyboards.inline import leaderboard_keyboard, profile_keyboard
+from db.models import Player
+from game.constants import ARCHETYPES, LEADERBOARD_PERIODIC, LEADERBOARD_PERIODS, LEADERBOARDS
+from game.balance import level_for_xp
+from services.leaderboard import get_board
 
 logger = logging.getLogger(__name__)
 
@@ -25,7 +28,7 @@ def format_profile(player) -> str:
         f"🎯 Архетип: {arch.get('emoji', '')} {arch.get('name', '')}\n"
         f"⭐ Уровень: {player.level}\n"
         f"✨ Опыт: {player.xp:,}\n"
-        f"💰 Вьюкоины: {player.coins:,}\n"
+        f"💰 Вьюкоины: {player.balance:,}\n"
         f"⭐ Звёзды: {player.stars}\n"
         f"{'━' * 20}\n"
         f"👆 Сила тапа: {player.tap_power}\n"
@@ -36,11 +39,8 @@ def format_profile(player) -> str:
 
 
 @router.message(Command("profile"))
-async def cmd_profile(message: Message) -> None:
+async def cmd_profile(message: Message, player: Player | None) -> None:
     """Команда /profile — показать профиль."""
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, message.from_user.id)
-
     if not player:
         await message.answer("❌ Сначала создай персонажа: /start")
         return
@@ -52,11 +52,8 @@ async def cmd_profile(message: Message) -> None:
 
 
 @router.callback_query(F.data == "profile:main")
-async def show_profile(callback: CallbackQuery) -> None:
+async def show_profile(callback: CallbackQuery, player: Player | None) -> None:
     """Показать профиль через callback."""
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, callback.from_user.id)
-
     if not player:
         await callback.answer("❌ Персонаж не найден!", show_alert=True)
         return
@@ -66,3 +63,72 @@ async def show_profile(callback: CallbackQuery) -> None:
         reply_markup=profile_keyboard(),
     )
     await callback.answer()
+
+
+# ── Лидерборд ────────────────────────────────────────────────────────
+
+MEDALS = {1: "🥇", 2: "🥈", 3: "🥉"}
+
+
+def _format_score(board: str, period: str, score: int) -> str:
+    """Счёт в единицах рейтинга."""
+    if board == "level":
+        return f"ур. {level_for_xp(score)}" if period == "all" else f"+{score:,} XP"
+    if board == "coins":
+        return f"{score:,} 💰"
+    if board == "passive_income":
+        return f"{score:,}/мин"
+    return f"{score:,}"
+
+
+def format_leaderboard(board: str, period: str, data: dict, tg_id: int) -> str:
+    """Текст рейтинга: топ, затем соседи игрока, если он за пределами топа."""
+
+    def line(e: dict) -> str:
+        place = MEDALS.get(e["rank"], f"{e['rank']}.")
+        text = f"{place} {e['avatar']} {html.escape(e['name'])} — {_format_score(board, period, e['score'])}"
+        return f"<b>{text}</b>" if e["tg_id"] == tg_id else text
+
+    lines = [
+        f"📊 <b>{LEADERBOARDS[board]}</b> · {LEADERBOARD_PERIODS[period]}",
+        "━" * 20,
+    ]
+    if not data["top"]:
+        lines.append("Пока никого нет — стань первым!")
+    lines.extend(line(e) for e in data["top"])
+    if data["around"]:
+        if data["around"][0]["rank"] > len(data["top"]) + 1:
+            lines.append("…")
+        lines.extend(line(e) for e in data["around"])
+    lines.append("━" * 20)
+    if data["me"]:
+        lines.append(f"Твоё место: {data['me']['rank']} из {data['total']}")
+    else:
+        lines.append("Тебя пока нет в этом рейтинге")
+    return "\n".join(lines)
+
+
+@router.callback_query(F.data == "profile:leaderboard", flags={"load_plan": None})
+@router.callback_query(F.data.startswith("lb:"), flags={"load_plan": None})
+async def show_leaderboard(callback: CallbackQuery) -> None:
+    """Рейтинг: lb:<рейтинг>:<период>; данные — один вызов Redis, без БД."""
+    board, period = "coins", "all"
+    if callback.data.startswith("lb:"):
+        _, board, period = callback.data.split(":")
+    if board not in LEADERBOARDS or period not in LEADERBOARD_PERIODS:
+        await callback.answer()
+        return
+    if board not in LEADERBOARD_PERIODIC:
+        period = "all"
+
+    tg_id = callback.from_user.id
+    data = await get_board(board, period, tg_id)
+    try:
+        await callback.message.edit_text(
+            format_leaderboard(board, period, data, tg_id),
+            reply_markup=leaderboard_keyboard(board, period),
+        )
+    except TelegramBadRequest:
+        # Рейтинг не изменился — игнорируем
+        pass
+    await callback.answer()
@@ -6,11 +6,13 @@ from aiogram import F, Router
 from aiogram.filters import CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.keyboards.inline import archetype_keyboard, avatar_keyboard, city_keyboard
 from bot.states.onboarding import OnboardingStates
-from db.database import async_session
-from db.repositories.player import create_player, get_player_by_tg_id
+from db.database import commit
+from db.models import Player
+from db.repositories.player import create_player
 from game.constants import ARCHETYPES, Archetype
 
 logger = logging.getLogger(__name__)
@@ -19,18 +21,15 @@ router = Router(name="start")
 
 
 @router.message(CommandStart())
-async def cmd_start(message: Message, state: FSMContext) -> None:
+async def cmd_start(message: Message, state: FSMContext, player: Player | None) -> None:
     """Обработка /start — проверка существующего игрока или начало онбординга."""
-    async with async_session() as session:
-        player = await get_player_by_tg_id(session, message.from_user.id)
-
     if player:
         # Игрок уже есть — показываем город
         arch = ARCHETYPES.get(player.archetype.value, {})
         await message.answer(
             f"С возвращением, {player.avatar} <b>{player.name}</b>!\n"
             f"Архетип: {arch.get('emoji', '')} {arch.get('name', '')}\n"
-            f"Уровень: {player.level} | Монеты: {player.coins:,}\n\n"
+            f"Уровень: {player.level} | Монеты: {player.balance:,}\n\n"
             "🏙 <b>Добро пожаловать в HYPETOWN!</b>",
             reply_markup=city_keyboard(player.level),
         )
@@ -46,7 +45,7 @@ async def cmd_start(message: Message, state: FSMContext) -> None:
     )
 
 
-@router.message(OnboardingStates.waiting_for_name)
+@router.message(OnboardingStates.waiting_for_name, flags={"load_plan": None})
 async def process_name(message: Message, state: FSMContext) -> None:
     """Обработка ввода имени персонажа."""
     name = message.text.strip()
@@ -72,7 +71,11 @@ async def process_name(message: Message, state: FSMContext) -> None:
     )
 
 
-@router.callback_query(OnboardingStates.waiting_for_avatar, F.data.startswith("avatar:"))
+@router.callback_query(
+    OnboardingStates.waiting_for_avatar,
+    F.data.startswith("avatar:"),
+    flags={"load_plan": None},
+)
 async def process_avatar(callback: CallbackQuery, state: FSMContext) -> None:
     """Обработка выбора аватара."""
     avatar = callback.data.split(":", 1)[1]
@@ -88,8 +91,16 @@ async def process_avatar(callback: CallbackQuery, state: FSMContext) -> None:
     await callback.answer()
 
 
-@router.callback_query(OnboardingStates.waiting_for_archetype, F.data.startswith("archetype:"))
-async def process_archetype(callback: CallbackQuery, state: FSMContext) -> None:
+@router.callback_query(
+    OnboardingStates.waiting_for_archetype,
+    F.data.startswith("archetype:"),
+    flags={"load_plan": None},
+)
+async def process_archetype(
+    callback: CallbackQuery,
+    state: FSMContext,
+    db_session: AsyncSession,
+) -> None:
     """Обработка выбора архетипа — создание персонажа."""
     archetype_key = callback.data.split(":", 1)[1]
 
@@ -100,15 +111,16 @@ async def process_archetype(callback: CallbackQuery, state: FSMContext) -> None:
     data = await state.get_data()
     arch_data = ARCHETYPES[archetype_key]
 
-    async with async_session() as session:
-        player = await create_player(
-            session=session,
-            tg_id=callback.from_user.id,
-            username=callback.from_user.username,
-            name=data["name"],
-            avatar=data["avatar"],
-            archetype=Archetype(archetype_key),
-        )
+    player = await create_player(
+        session=db_session,
+        tg_id=callback.from_user.id,
+        username=callback.from_user.username,
+        name=data["name"],
+        avatar=data["avatar"],
+        archetype=Archetype(archetype_key),
+    )
+    # Персонаж создан до ответа: ошибка отрисовки не откатит его
+    await commit(db_session)
 
     await state.clear()
 
@@ -117,7 +129,7 @@ async def process_archetype(callback: CallbackQuery, state: FSMContext) -> None:
         f"{player.avatar} <b>{player.name}</b>\n"
         f"Архетип: {arch_data['emoji']} {arch_data['name']}\n"
         f"Бонус: +{int(arch_data['bonus'] * 100)}% к {arch_data['bonus_type']}\n"
-        f"Монеты: {player.coins:,} 💰\n\n"
+        f"Монеты: {player.balance:,} 💰\n\n"
         "🏙 <b>Добро пожаловать в HYPETOWN!</b>\n"
         "Исследуй город и начни строить свою медиаимперию!",
         reply_markup=city_keyboard(player.level),
@@ -2,7 +2,13 @@
 
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
-from game.constants import ARCHETYPES, CITY_LOCATIONS
+from game.constants import (
+    ARCHETYPES,
+    CITY_LOCATIONS,
+    LEADERBOARD_PERIODIC,
+    LEADERBOARD_PERIODS,
+    LEADERBOARDS,
+)
 
 
 # ── Онбординг ─────────────────────────────────────────────────────────
@@ -59,6 +65,30 @@ def profile_keyboard() -> InlineKeyboardMarkup:
     ])
 
 
+def leaderboard_keyboard(board: str, period: str) -> InlineKeyboardMarkup:
+    """Переключатели рейтинга и периода; текущие отмечены точкой."""
+    buttons = []
+    row = []
+    for key, title in LEADERBOARDS.items():
+        text = f"• {title} •" if key == board else title
+        row.append(InlineKeyboardButton(text=text, callback_data=f"lb:{key}:all"))
+        if len(row) == 2:
+            buttons.append(row)
+            row = []
+    if row:
+        buttons.append(row)
+    if board in LEADERBOARD_PERIODIC:
+        buttons.append([
+            InlineKeyboardButton(
+                text=f"• {title} •" if key == period else title,
+                callback_data=f"lb:{board}:{key}",
+            )
+            for key, title in LEADERBOARD_PERIODS.items()
+        ])
+    buttons.append([InlineKeyboardButton(text="👤 Профиль", callback_data="profile:main")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
 # ── Общие ─────────────────────────────────────────────────────────────
 
 def back_to_city_keyboard() -> InlineKeyboardMarkup:
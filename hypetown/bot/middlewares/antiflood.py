@@ -1,26 +1,34 @@
-"""Antiflood middleware: защита от спама через Redis sliding window."""
+"""Antiflood middleware: лимиты апдейтов по действиям (GCRA, services.rate_limit)."""
 
 import logging
 from typing import Any, Awaitable, Callable
 
 from aiogram import BaseMiddleware
-from aiogram.types import TelegramObject
+from aiogram.types import TelegramObject, Update
 
-from services.redis_service import check_rate_limit
+from services.rate_limit import RateLimiter, limiter
 
 logger = logging.getLogger(__name__)
 
-# Лимиты: количество запросов / окно в секундах
-DEFAULT_LIMIT = 30
-DEFAULT_WINDOW = 60
+# callback_data → действие со своим лимитом; прочие апдейты — "nav"
+CALLBACK_ACTIONS: dict[str, str] = {
+    "clicker:tap": "tap",
+}
+DEFAULT_ACTION = "nav"
+
+
+def classify(event: TelegramObject) -> str:
+    """Действие апдейта для выбора лимита."""
+    if isinstance(event, Update) and event.callback_query is not None:
+        return CALLBACK_ACTIONS.get(event.callback_query.data or "", DEFAULT_ACTION)
+    return DEFAULT_ACTION
 
 
 class AntifloodMiddleware(BaseMiddleware):
-    """Rate limiter: не более DEFAULT_LIMIT запросов в DEFAULT_WINDOW секунд."""
+    """Rate limiter: лимит на игрока и действие (см. RATE_LIMITS)."""
 
-    def __init__(self, limit: int = DEFAULT_LIMIT, window: int = DEFAULT_WINDOW):
-        self.limit = limit
-        self.window = window
+    def __init__(self, rate_limiter: RateLimiter = limiter):
+        self.limiter = rate_limiter
 
     async def __call__(
         self,
@@ -32,9 +40,10 @@ class AntifloodMiddleware(BaseMiddleware):
         if user is None:
             return await handler(event, data)
 
-        allowed = await check_rate_limit(user.id, self.limit, self.window)
-        if not allowed:
-            logger.warning("Rate limit: tg_id=%d", user.id)
+        action = classify(event)
+        retry_after = await self.limiter.hit(action, user.id)
+        if retry_after:
+            logger.warning("Rate limit: tg_id=%d action=%s retry=%.1fс", user.id, action, retry_after)
             # Не отвечаем — просто дропаем
             return None
 
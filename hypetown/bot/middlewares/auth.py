@@ -1,20 +1,38 @@
-"""Middleware авторизации: загрузка игрока в контекст каждого запроса."""
+"""Middleware авторизации: единица работы (сессия + игрок) на каждый апдейт."""
 
 import logging
 from typing import Any, Awaitable, Callable
 
 from aiogram import BaseMiddleware
-from aiogram.types import TelegramObject, Update
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import TelegramObject
 
-from db.database import async_session
-from db.repositories.player import get_player_by_tg_id
+from db.database import async_session, commit
+from db.repositories.player import DEFAULT_PLAN, get_player_by_tg_id
+from game.clicker import restore_settled_coins
+from services.redis_service import get_pending_coins
 
 logger = logging.getLogger(__name__)
 
 
 class AuthMiddleware(BaseMiddleware):
-    """Загружает объект Player из БД и кладёт в data['player'].
-    Если игрок не найден — player=None (онбординг обработает)."""
+    """Открывает одну сессию на апдейт, загружает Player и делает один commit в конце.
+
+    Хендлер получает через инъекцию:
+      - player: Player | None — None, если игрок не найден (онбординг обработает);
+      - db_session: AsyncSession — та же сессия, в которой загружен player.
+
+    Какие связи Player грузить, хендлер объявляет флагом
+    flags={"load_plan": "farms"} (см. LOAD_PLANS); load_plan=None — игрок
+    хендлеру не нужен и не загружается. Флаг pending_coins=False отключает
+    подгрузку несброшенных монет (тап получает их из своего скрипта).
+    Хендлер, который сообщает игроку об успехе, коммитит сам
+    (db.database.commit) до ответа и перерисовки: исключение Telegram при
+    edit_text иначе откатило бы уже объявленную покупку. Финальный commit
+    тогда пустой.
+    Регистрируется как inner middleware
+    (dp.message / dp.callback_query), чтобы флаги хендлера были доступны.
+    """
 
     async def __call__(
         self,
@@ -27,8 +45,25 @@ class AuthMiddleware(BaseMiddleware):
         if user is None:
             return await handler(event, data)
 
+        plan = get_flag(data, "load_plan", default=DEFAULT_PLAN)
+
         async with async_session() as session:
-            player = await get_player_by_tg_id(session, user.id)
-            data["player"] = player
+            player = (
+                await get_player_by_tg_id(session, user.id, plan=plan)
+                if plan else None
+            )
+            if player is not None and get_flag(data, "pending_coins", default=True):
+                # Баланс для отображения учитывает несброшенные тапы
+                player.pending_coins = await get_pending_coins(user.id)
+
             data["db_session"] = session
-            return await handler(event, data)
+            data["player"] = player
+            try:
+                result = await handler(event, data)
+                await commit(session)
+            except Exception:
+                # Транзакция откатится при выходе из контекста — вернуть
+                # в леджер монеты, которые хендлер успел из него забрать
+                await restore_settled_coins(session)
+                raise
+            return result
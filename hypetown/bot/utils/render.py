@@ -0,0 +1,110 @@
+"""Коалесинг перерисовок: не чаще одного edit_text за интервал на сообщение.
+
+При быстрых тапах каждый callback хочет перерисовать экран кликера, а
+Telegram ограничивает частоту правок в чате. RenderCoalescer хранит для
+каждого (chat_id, message_id) только последнее состояние и отправляет
+его не чаще раза в interval секунд; правка с тем же текстом и
+клавиатурой, что уже отправлены, пропускается.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup, Message
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _RenderState:
+    """Последнее запрошенное и последнее отправленное состояние сообщения."""
+
+    message: Message
+    text: str
+    markup: InlineKeyboardMarkup | None
+    last_digest: int | None = None
+    last_sent: float = 0.0
+    task: asyncio.Task | None = None
+
+
+def _digest(text: str, markup: InlineKeyboardMarkup | None) -> int:
+    """Хеш отрисовки: текст + сериализованная клавиатура."""
+    return hash((text, markup.model_dump_json() if markup else None))
+
+
+class RenderCoalescer:
+    """Дебаунс edit_text по ключу (chat_id, message_id)."""
+
+    def __init__(self, interval: float, max_entries: int = 10_000):
+        self.interval = interval
+        self.max_entries = max_entries
+        self._states: OrderedDict[tuple[int, int], _RenderState] = OrderedDict()
+
+    async def submit(
+        self,
+        message: Message,
+        text: str,
+        reply_markup: InlineKeyboardMarkup | None = None,
+    ) -> None:
+        """Запросить перерисовку. Возвращается сразу, правка уйдёт в фоне."""
+        k = (message.chat.id, message.message_id)
+        state = self._states.get(k)
+        if state is None:
+            state = _RenderState(message=message, text=text, markup=reply_markup)
+            self._states[k] = state
+            self._evict()
+        else:
+            state.message, state.text, state.markup = message, text, reply_markup
+            self._states.move_to_end(k)
+
+        if state.task is None:
+            loop = asyncio.get_running_loop()
+            delay = max(0.0, state.last_sent + self.interval - loop.time())
+            state.task = asyncio.create_task(self._flush(state, delay))
+
+    def discard(self, message: Message) -> None:
+        """Отменить отложенную перерисовку — экран сообщения сменил другой хендлер."""
+        state = self._states.pop((message.chat.id, message.message_id), None)
+        if state is not None and state.task is not None:
+            state.task.cancel()
+
+    async def _flush(self, state: _RenderState, delay: float) -> None:
+        """Отправлять последнее состояние, пока оно отличается от отправленного."""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                digest = _digest(state.text, state.markup)
+                if digest == state.last_digest:
+                    break
+                try:
+                    await state.message.edit_text(state.text, reply_markup=state.markup)
+                except TelegramRetryAfter as e:
+                    # Упёрлись в лимит чата — ждём и шлём самое свежее состояние
+                    delay = e.retry_after
+                    continue
+                except TelegramBadRequest as e:
+                    # «message is not modified» / сообщение удалено — не повторяем
+                    logger.debug("edit_text пропущен: %s", e)
+                state.last_digest = digest
+                state.last_sent = loop.time()
+                delay = self.interval
+        finally:
+            state.task = None
+
+    def _evict(self) -> None:
+        """Удалить самые старые неактивные записи сверх max_entries."""
+        while len(self._states) > self.max_entries:
+            k, state = next(iter(self._states.items()))
+            if state.task is not None:
+                # Самая старая запись ещё отправляется — не трогаем
+                break
+            del self._states[k]
+
+
+renderer = RenderCoalescer(config.render_interval)
@@ -18,9 +18,24 @@ class Config:
     log_level: str
     # TMA / Miniapp
     webapp_url: str
+    # Макс. возраст initData (сек от auth_date)
+    tma_auth_max_age: int
     s3_bucket: str
     s3_endpoint: str
     cloudinary_url: str
+    # Write-behind леджер тапов: период сброса Redis → Postgres (сек)
+    ledger_flush_interval: int
+    # Мин. интервал между перерисовками одного сообщения (сек)
+    render_interval: float
+    # Период применения тапов, накопленных в WebSocket-соединении (сек)
+    ws_tap_flush_interval: float
+    # Период опроса очереди уведомлений о готовности ферм (сек)
+    farm_notify_interval: float
+    # Лимиты рассылки уведомлений: сообщений/с на бота, мин. интервал в чат (сек)
+    notify_rate: float
+    notify_chat_interval: float
+    # Перестроение рейтингов из БД при старте: auto (если их нет в Redis) / always / never
+    leaderboard_rebuild: str
 
     @staticmethod
     def from_env() -> "Config":
@@ -38,9 +53,17 @@ class Config:
             redis_url=os.getenv("REDIS_URL", "redis://localhost:6379/0"),
             log_level=os.getenv("LOG_LEVEL", "INFO"),
             webapp_url=os.getenv("WEBAPP_URL", ""),
+            tma_auth_max_age=int(os.getenv("TMA_AUTH_MAX_AGE", "86400")),
             s3_bucket=os.getenv("S3_BUCKET", ""),
             s3_endpoint=os.getenv("S3_ENDPOINT", ""),
             cloudinary_url=os.getenv("CLOUDINARY_URL", ""),
+            ledger_flush_interval=int(os.getenv("LEDGER_FLUSH_INTERVAL", "5")),
+            render_interval=float(os.getenv("RENDER_INTERVAL", "1.0")),
+            ws_tap_flush_interval=float(os.getenv("WS_TAP_FLUSH_INTERVAL", "0.5")),
+            farm_notify_interval=float(os.getenv("FARM_NOTIFY_INTERVAL", "2")),
+            notify_rate=float(os.getenv("NOTIFY_RATE", "30")),
+            notify_chat_interval=float(os.getenv("NOTIFY_CHAT_INTERVAL", "1.0")),
+            leaderboard_rebuild=os.getenv("LEADERBOARD_REBUILD", "auto"),
         )
 
 
@@ -1,5 +1,9 @@
 """Асинхронное подключение к PostgreSQL через SQLAlchemy 2.0."""
 
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable
+
 from sqlalchemy.ext.asyncio import (
     AsyncSession,
     async_sessionmaker,
@@ -8,6 +12,8 @@ from sqlalchemy.ext.asyncio import (
 
 from config import config
 
+logger = logging.getLogger(__name__)
+
 # Асинхронный движок PostgreSQL
 engine = create_async_engine(
     config.database_url,
@@ -22,3 +28,53 @@ async_session = async_sessionmaker(
     class_=AsyncSession,
     expire_on_commit=False,
 )
+
+
+# ── Действия после commit ────────────────────────────────────────────
+#
+# Побочные эффекты вне БД (кэш Redis и т.п.) должны применяться только
+# после успешного commit, иначе откат оставит кэш в будущем состоянии.
+
+def on_commit(session: AsyncSession, callback: Callable[..., Awaitable[Any]], *args: Any) -> None:
+    """Запланировать корутину callback(*args) на момент после commit сессии."""
+    session.info.setdefault("after_commit", []).append((callback, args))
+
+
+async def commit(session: AsyncSession) -> None:
+    """Закоммитить сессию и выполнить действия, отложенные через on_commit.
+
+    После успешного commit перенесённые из леджера монеты уже в БД: учёт
+    settled_coins сбрасывается, чтобы restore_settled_coins вызывающего
+    не вернул их в леджер повторно. Ошибка действия только логируется —
+    до отката у вызывающего она не доходит.
+    """
+    await session.commit()
+    session.info.pop("settled_coins", None)
+    for callback, args in session.info.pop("after_commit", []):
+        try:
+            await callback(*args)
+        except Exception:
+            logger.exception("Ошибка действия после commit: %s", callback.__qualname__)
+
+
+@asynccontextmanager
+async def savepoint(session: AsyncSession, keep: tuple[str, ...] = ()) -> AsyncIterator[None]:
+    """SAVEPOINT, откат которого отменяет и on_commit-действия, запланированные внутри.
+
+    Вместе с действиями удаляются ключи session.info, созданные внутри
+    (накопители вроде services.leaderboard.track), — следующий вызов
+    создаст их и запланирует своё действие заново. Ключи из keep
+    остаются: их разбирает вызывающий. Накопители, созданные до
+    savepoint, не откатываются.
+    """
+    info_keys = set(session.info) | set(keep)
+    scheduled = len(session.info.get("after_commit", []))
+    try:
+        async with session.begin_nested():
+            yield
+    except Exception:
+        for key in set(session.info) - info_keys:
+            del session.info[key]
+        if "after_commit" in session.info:
+            del session.info["after_commit"][scheduled:]
+        raise
@@ -5,6 +5,7 @@ from datetime import date, datetime
 from sqlalchemy import (
     BigInteger,
     Boolean,
+    CheckConstraint,
     Date,
     DateTime,
     Enum,
@@ -14,7 +15,9 @@ from sqlalchemy import (
     JSON,
     String,
     Text,
+    UniqueConstraint,
     func,
+    text,
 )
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
@@ -65,27 +68,46 @@ class Player(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
     last_active: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
 
-    # Связи
-    buildings: Mapped[list["Building"]] = relationship(back_populates="player", lazy="selectin")
-    inventory: Mapped[list["Inventory"]] = relationship(back_populates="player", lazy="selectin")
-    orders: Mapped[list["Order"]] = relationship(back_populates="player", lazy="selectin")
-    clicker_upgrades: Mapped[list["ClickerUpgrade"]] = relationship(back_populates="player", lazy="selectin")
-    achievements: Mapped[list["Achievement"]] = relationship(back_populates="player", lazy="selectin")
-    daily_quests: Mapped[list["DailyQuest"]] = relationship(back_populates="player", lazy="selectin")
+    # Несброшенные монеты из леджера тапов Redis (не колонка — заполняется
+    # при загрузке игрока, см. services.redis_service.get_pending_coins)
+    pending_coins = 0
+
+    # Связи. Ничего не грузится автоматически: нужные коллекции выбираются
+    # планом загрузки в db.repositories.player (LOAD_PLANS), обращение к
+    # незагруженной связи — ошибка, а не скрытый запрос.
+    buildings: Mapped[list["Building"]] = relationship(back_populates="player", lazy="raise")
+    inventory: Mapped[list["Inventory"]] = relationship(back_populates="player", lazy="raise")
+    orders: Mapped[list["Order"]] = relationship(back_populates="player", lazy="raise")
+    clicker_upgrades: Mapped[list["ClickerUpgrade"]] = relationship(back_populates="player", lazy="raise")
+    achievements: Mapped[list["Achievement"]] = relationship(back_populates="player", lazy="raise")
+    daily_quests: Mapped[list["DailyQuest"]] = relationship(back_populates="player", lazy="raise")
+
+    @property
+    def balance(self) -> int:
+        """Баланс для отображения: монеты в БД + несброшенные тапы."""
+        return self.coins + self.pending_coins
 
 
 class Building(Base):
     """Здание (ферма) игрока."""
 
     __tablename__ = "buildings"
+    __table_args__ = (
+        UniqueConstraint("player_id", "type", name="uq_buildings_player_type"),
+        # Запущенные производства (заполнение очереди уведомлений)
+        Index("ix_buildings_producing_ends", "production_ends", postgresql_where=text("is_producing")),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    player_id: Mapped[int] = mapped_column(ForeignKey("players.id"), nullable=False, index=True)
+    player_id: Mapped[int] = mapped_column(ForeignKey("players.id"), nullable=False)
     type: Mapped[BuildingType] = mapped_column(Enum(BuildingType), nullable=False)
     level: Mapped[int] = mapped_column(Integer, default=1, server_default="1")
     is_producing: Mapped[bool] = mapped_column(Boolean, default=False, server_default="false")
     production_started: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     production_ends: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # Непрерывный режим: циклы идут сами от last_collected (якорь) и
+    # считаются при чтении — без запуска, таймеров и записей до сбора
+    is_continuous: Mapped[bool] = mapped_column(Boolean, default=False, server_default="false")
     last_collected: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
 
     player: Mapped["Player"] = relationship(back_populates="buildings")
@@ -95,9 +117,13 @@ class Inventory(Base):
     """Инвентарь игрока (ресурсы)."""
 
     __tablename__ = "inventory"
+    __table_args__ = (
+        UniqueConstraint("player_id", "resource", name="uq_inventory_player_resource"),
+        CheckConstraint("quantity >= 0", name="ck_inventory_quantity_nonnegative"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    player_id: Mapped[int] = mapped_column(ForeignKey("players.id"), nullable=False, index=True)
+    player_id: Mapped[int] = mapped_column(ForeignKey("players.id"), nullable=False)
     resource: Mapped[Resource] = mapped_column(Enum(Resource), nullable=False)
     quantity: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
 
@@ -108,6 +134,13 @@ class Order(Base):
     """Заказ от NPC."""
 
     __tablename__ = "orders"
+    __table_args__ = (
+        # Активные заказы игрока (get_active_orders, план загрузки "orders")
+        Index(
+            "ix_orders_player_active", "player_id", "expires_at",
+            postgresql_where=text("completed_at IS NULL"),
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     player_id: Mapped[int] = mapped_column(ForeignKey("players.id"), nullable=False, index=True)
@@ -197,9 +230,12 @@ class ClickerUpgrade(Base):
     """Апгрейд кликера игрока."""
 
     __tablename__ = "clicker_upgrades"
+    __table_args__ = (
+        UniqueConstraint("player_id", "upgrade_type", name="uq_clicker_upgrades_player_type"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    player_id: Mapped[int] = mapped_column(ForeignKey("players.id"), nullable=False, index=True)
+    player_id: Mapped[int] = mapped_column(ForeignKey("players.id"), nullable=False)
     upgrade_type: Mapped[ClickerUpgradeType] = mapped_column(Enum(ClickerUpgradeType), nullable=False)
     level: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
 
@@ -223,9 +259,12 @@ class DailyQuest(Base):
     """Ежедневный квест."""
 
     __tablename__ = "daily_quests"
+    __table_args__ = (
+        UniqueConstraint("player_id", "date", "quest_type", name="uq_daily_quests_player_date_type"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    player_id: Mapped[int] = mapped_column(ForeignKey("players.id"), nullable=False, index=True)
+    player_id: Mapped[int] = mapped_column(ForeignKey("players.id"), nullable=False)
     quest_type: Mapped[str] = mapped_column(String(64), nullable=False)
     progress: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
     target: Mapped[int] = mapped_column(Integer, nullable=False)
@@ -235,3 +274,16 @@ class DailyQuest(Base):
     date: Mapped[date] = mapped_column(Date, nullable=False)
 
     player: Mapped["Player"] = relationship(back_populates="daily_quests")
+
+
+class LedgerFlush(Base):
+    """Применённый батч леджера тапов или перенос монет из него (settle).
+
+    Повтор того же батча не зачисляет монеты; по переносам восстановление
+    после сбоя решает, вернуть ли монеты в леджер.
+    """
+
+    __tablename__ = "ledger_flushes"
+
+    batch_id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    flushed_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), index=True)
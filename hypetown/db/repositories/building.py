@@ -2,10 +2,11 @@
 
 from datetime import datetime
 
-from sqlalchemy import select
+from sqlalchemy import and_, case, or_, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
 
-from db.models import Building
+from db.models import Building, Player
 
 
 async def get_player_buildings(session: AsyncSession, player_id: int) -> list[Building]:
@@ -16,13 +17,84 @@ async def get_player_buildings(session: AsyncSession, player_id: int) -> list[Bu
     return list(result.scalars().all())
 
 
-async def get_ready_buildings(session: AsyncSession) -> list[Building]:
-    """Получить все здания, где производство завершено (для уведомлений)."""
-    now = datetime.utcnow()
+async def get_producing_jobs(session: AsyncSession) -> list[tuple[int, int, str, datetime]]:
+    """Все запущенные производства одним JOIN: (building_id, tg_id, type, production_ends).
+
+    Нужно только для заполнения очереди уведомлений при старте.
+    """
     result = await session.execute(
-        select(Building).where(
+        select(Building.id, Player.tg_id, Building.type, Building.production_ends)
+        .join(Player, Player.id == Building.player_id)
+        .where(
             Building.is_producing == True,
-            Building.production_ends <= now,
+            Building.production_ends.is_not(None),
         )
     )
-    return list(result.scalars().all())
+    return [
+        (building_id, tg_id, building_type.value, ends)
+        for building_id, tg_id, building_type, ends in result.all()
+    ]
+
+
+async def claim_collect(
+    session: AsyncSession,
+    claims: list[tuple[Building, datetime]],
+    now: datetime,
+) -> list[Building]:
+    """Условно сбросить циклы зданий: (здание, новый якорь last_collected).
+
+    Здание с таймером забирается, только если в БД оно всё ещё производит
+    и цикл закончился; непрерывное — только если якорь last_collected не
+    сдвинул никто другой. Здание, которое параллельный апдейт уже собрал,
+    в ответ не попадает — платить за него нельзя. Забранные здания
+    синхронизируются с БД; возвращаются они же.
+    """
+    timers = [b.id for b, _ in claims if not b.is_continuous]
+    anchors = [(b, anchor) for b, anchor in claims if b.is_continuous]
+    claimed: set[int] = set()
+
+    if timers:
+        result = await session.execute(
+            update(Building)
+            .where(
+                Building.id.in_(timers),
+                Building.is_producing == True,
+                or_(Building.production_ends.is_(None), Building.production_ends <= now),
+            )
+            .values(is_producing=False, production_started=None, production_ends=None, last_collected=now)
+            .returning(Building.id)
+            .execution_options(synchronize_session=False)
+        )
+        claimed.update(result.scalars())
+
+    if anchors:
+        # Один UPDATE: новый якорь каждого здания при условии, что старый не изменился
+        result = await session.execute(
+            update(Building)
+            .where(
+                Building.is_continuous == True,
+                or_(*(
+                    and_(Building.id == b.id, Building.last_collected == b.last_collected)
+                    for b, _ in anchors
+                )),
+            )
+            .values(last_collected=case(
+                {b.id: anchor for b, anchor in anchors},
+                value=Building.id,
+            ))
+            .returning(Building.id)
+            .execution_options(synchronize_session=False)
+        )
+        claimed.update(result.scalars())
+
+    buildings = []
+    for building, anchor in claims:
+        if building.id not in claimed:
+            continue
+        set_committed_value(building, "last_collected", anchor)
+        if not building.is_continuous:
+            set_committed_value(building, "is_producing", False)
+            set_committed_value(building, "production_started", None)
+            set_committed_value(building, "production_ends", None)
+        buildings.append(building)
+    return buildings
@@ -1,12 +1,22 @@
-"""CRUD операции для инвентаря (ресурсы игрока)."""
+"""CRUD операции для инвентаря (ресурсы игрока).
 
-from sqlalchemy import select
+Строка инвентаря уникальна по (player_id, resource), количество не может
+уйти в минус (CHECK quantity >= 0). Функции не коммитят — изменения уходят
+в транзакцию вызывающего.
+"""
+
+from sqlalchemy import column, select, update, values
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.models import Inventory
 from game.constants import Resource
 
 
+class _InsufficientStock(Exception):
+    """Внутренний сигнал отката savepoint в consume_resources."""
+
+
 async def get_inventory(session: AsyncSession, player_id: int) -> dict[str, int]:
     """Получить инвентарь как словарь {resource: quantity}."""
     result = await session.execute(
@@ -22,26 +32,75 @@ async def add_resource(
     quantity: int,
 ) -> int:
     """Добавить ресурс в инвентарь. Возвращает новое количество."""
-    result = await session.execute(
-        select(Inventory).where(
+    totals = await add_resources(session, player_id, {resource: quantity})
+    return totals.get(resource, 0)
+
+
+async def add_resources(
+    session: AsyncSession,
+    player_id: int,
+    amounts: dict[str, int],
+) -> dict[str, int]:
+    """Добавить несколько ресурсов одним INSERT ... ON CONFLICT DO UPDATE.
+
+    Возвращает новые количества {resource: quantity}.
+    """
+    amounts = {res: qty for res, qty in amounts.items() if qty}
+    if not amounts:
+        return {}
+
+    stmt = insert(Inventory).values([
+        {"player_id": player_id, "resource": Resource(res), "quantity": qty}
+        for res, qty in amounts.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_inventory_player_resource",
+        set_={"quantity": Inventory.quantity + stmt.excluded.quantity},
+    ).returning(Inventory.resource, Inventory.quantity)
+
+    result = await session.execute(stmt)
+    return {res.value: qty for res, qty in result.all()}
+
+
+async def consume_resources(
+    session: AsyncSession,
+    player_id: int,
+    amounts: dict[str, int],
+) -> bool:
+    """Списать несколько ресурсов одним UPDATE ... FROM (VALUES ...).
+
+    Каждая строка списывается, только если её хватает; если хоть одного
+    ресурса нет или мало — savepoint откатывается и ничего не списано.
+    Возвращает True, если списано всё.
+    """
+    amounts = {res: qty for res, qty in amounts.items() if qty}
+    if not amounts:
+        return True
+
+    v = values(
+        column("resource", Inventory.resource.type),
+        column("qty", Inventory.quantity.type),
+        name="v",
+    ).data([(Resource(res), qty) for res, qty in amounts.items()])
+    stmt = (
+        update(Inventory)
+        .where(
             Inventory.player_id == player_id,
-            Inventory.resource == Resource(resource),
+            Inventory.resource == v.c.resource,
+            Inventory.quantity >= v.c.qty,
         )
+        .values(quantity=Inventory.quantity - v.c.qty)
+        .execution_options(synchronize_session=False)
     )
-    inv = result.scalar_one_or_none()
-
-    if inv:
-        inv.quantity += quantity
-    else:
-        inv = Inventory(
-            player_id=player_id,
-            resource=Resource(resource),
-            quantity=quantity,
-        )
-        session.add(inv)
 
-    await session.commit()
-    return inv.quantity
+    try:
+        async with session.begin_nested():
+            result = await session.execute(stmt)
+            if result.rowcount != len(amounts):
+                raise _InsufficientStock
+    except _InsufficientStock:
+        return False
+    return True
 
 
 async def has_resources(
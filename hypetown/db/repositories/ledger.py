@@ -0,0 +1,84 @@
+"""Атомарные изменения монет и XP игрока: один UPDATE ... RETURNING без чтения строки.
+
+Монеты и XP меняются только здесь (и массовым сбросом леджера тапов в
+repositories.player): инкрементом в SQL, а не записью посчитанного в
+Python значения. Параллельные изменения из бота, Mini App и планировщика
+поэтому не затирают друг друга. Возвращённые значения записываются в
+объект Player как «закоммиченные» — ORM не считает поле изменённым и не
+допишет поверх свой UPDATE. Каждое изменение отмечает игрока для
+публикации в лидерборды и новую версию состояния после commit
+(services.leaderboard.track, services.state_sync.mark_changed).
+"""
+
+from sqlalchemy import func, update
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+from db.models import Player
+from services.leaderboard import track
+from services.state_sync import mark_changed
+
+
+async def _execute(session: AsyncSession, player: Player, stmt) -> Row | None:
+    """Выполнить UPDATE игрока с RETURNING и синхронизировать объект Player."""
+    result = await session.execute(
+        stmt.where(Player.id == player.id)
+        .returning(Player.coins, Player.level, Player.xp)
+        .execution_options(synchronize_session=False)
+    )
+    row = result.one_or_none()
+    if row is not None:
+        sync_player(player, row.coins, row.level, row.xp)
+        track(session, player)
+        mark_changed(session, player.tg_id, "player")
+    return row
+
+
+def sync_player(player: Player, coins: int, level: int, xp: int) -> None:
+    """Записать в Player значения, которые вернул UPDATE ... RETURNING."""
+    set_committed_value(player, "coins", coins)
+    set_committed_value(player, "level", level)
+    set_committed_value(player, "xp", xp)
+
+
+async def credit(session: AsyncSession, player: Player, amount: int, earned: bool = True) -> int:
+    """Зачислить монеты. Возвращает новый баланс в БД.
+
+    earned=False — перенос уже учтённых монет (тапы из леджера): в
+    недельный и сезонный рейтинги они не засчитываются повторно.
+    """
+    row = await _execute(session, player, update(Player).values(coins=Player.coins + amount))
+    if earned:
+        track(session, player, coins_earned=amount)
+    return row.coins
+
+
+async def debit_if_sufficient(session: AsyncSession, player: Player, cost: int) -> bool:
+    """Списать cost, только если монет хватает (проверка и списание — один UPDATE).
+
+    False — монет не хватило, строка не изменена.
+    """
+    row = await _execute(
+        session, player,
+        update(Player)
+        .where(Player.coins >= cost)
+        .values(coins=Player.coins - cost),
+    )
+    return row is not None
+
+
+async def grant_xp(session: AsyncSession, player: Player, amount: int) -> int:
+    """Начислить XP. Возвращает новый XP (уровень пересчитывает game.economy)."""
+    row = await _execute(session, player, update(Player).values(xp=Player.xp + amount))
+    track(session, player, xp_earned=amount)
+    return row.xp
+
+
+async def raise_level(session: AsyncSession, player: Player, level: int) -> int:
+    """Поднять уровень до level (не понижая: параллельный левелап мог уйти дальше)."""
+    row = await _execute(
+        session, player,
+        update(Player).values(level=func.greatest(Player.level, level)),
+    )
+    return row.level
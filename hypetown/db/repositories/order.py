@@ -0,0 +1,91 @@
+"""Операции с заказами NPC, которые должны выполняться одним запросом."""
+
+from datetime import datetime
+
+from sqlalchemy import DateTime, bindparam, text
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Выполнение заказа одним statement'ом. Все шаги — data-modifying CTE в
+# одном снимке, поэтому два параллельных выполнения не спишут ресурсы
+# дважды: второй UPDATE orders не найдёт открытый заказ.
+#   ord — закрыть заказ, если он ещё открыт и не истёк (+ бонус за скорость);
+#   req — требования из JSON; enum resource хранит имена, отсюда upper();
+#   inv — списать каждый ресурс; нехватка нарушит CHECK quantity >= 0
+#         и отменит весь statement, отсутствующая строка даст consumed < required;
+#   pl  — начислить монеты и XP.
+COMPLETE_ORDER_SQL = text("""
+WITH ord AS (
+    UPDATE orders
+    SET completed_at = :now
+    WHERE id = :order_id
+      AND player_id = :player_id
+      AND completed_at IS NULL
+      AND expires_at >= :now
+    RETURNING
+        npc_name,
+        requirements,
+        reward_coins,
+        reward_xp,
+        created_at >= :bonus_since AS got_bonus,
+        CASE WHEN created_at >= :bonus_since THEN bonus_reward_coins ELSE 0 END AS bonus
+),
+req AS (
+    SELECT upper(r.key)::resource AS resource, r.value::int AS qty
+    FROM ord, json_each_text(ord.requirements) AS r
+),
+inv AS (
+    UPDATE inventory i
+    SET quantity = i.quantity - req.qty
+    FROM req
+    WHERE i.player_id = :player_id
+      AND i.resource = req.resource
+    RETURNING i.id
+),
+pl AS (
+    UPDATE players p
+    SET coins = p.coins + ord.reward_coins + ord.bonus,
+        xp = p.xp + ord.reward_xp
+    FROM ord
+    WHERE p.id = :player_id
+    RETURNING p.coins, p.level, p.xp
+)
+SELECT
+    ord.npc_name,
+    ord.reward_coins,
+    ord.got_bonus,
+    ord.bonus,
+    ord.reward_xp,
+    pl.coins,
+    pl.level,
+    pl.xp,
+    (SELECT count(*) FROM req) AS required,
+    (SELECT count(*) FROM inv) AS consumed
+FROM ord, pl
+""").bindparams(
+    bindparam("now", type_=DateTime),
+    bindparam("bonus_since", type_=DateTime),
+)
+
+
+async def complete_order(
+    session: AsyncSession,
+    player_id: int,
+    order_id: int,
+    now: datetime,
+    bonus_since: datetime,
+) -> Row | None:
+    """Выполнить заказ одним запросом: закрыть, списать ресурсы, наградить.
+
+    Возвращает строку (npc_name, reward_coins, got_bonus, bonus, reward_xp, coins,
+    level, xp, required, consumed) или None, если открытого заказа нет.
+    Нехватку ресурсов вызывающий распознаёт по IntegrityError или
+    consumed < required и откатывает savepoint.
+    """
+    result = await session.execute(COMPLETE_ORDER_SQL, {
+        "player_id": player_id,
+        "order_id": order_id,
+        "now": now,
+        "bonus_since": bonus_since,
+    })
+    return result.one_or_none()
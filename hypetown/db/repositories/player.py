@@ -1,18 +1,82 @@
 """CRUD операции для игроков."""
 
-from sqlalchemy import select
+from datetime import datetime, timedelta
+
+from sqlalchemy import BigInteger, column, delete, select, update, values
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.interfaces import LoaderOption
 
-from db.models import Player
+from db.models import LedgerFlush, Order, Player
 from game.constants import Archetype, START_COINS, START_TAP_POWER
+from services.leaderboard import track
 
 
-async def get_player_by_tg_id(session: AsyncSession, tg_id: int) -> Player | None:
-    """Получить игрока по Telegram ID."""
-    result = await session.execute(
-        select(Player).where(Player.tg_id == tg_id)
-    )
-    return result.scalar_one_or_none()
+# ── Планы загрузки ───────────────────────────────────────────────────
+#
+# Каждый экран грузит только те связи Player, которые реально рисует.
+# Маленькие коллекции (≤ 9 зданий, ≤ 8 апгрейдов) подтягиваются JOIN'ом
+# в том же запросе, остальные — отдельным selectin-запросом.
+
+LOAD_PLANS: dict[str, tuple[str, ...]] = {
+    "core": (),                                   # только строка players
+    "clicker": ("clicker_upgrades",),             # экран кликера / апгрейды
+    "farms": ("buildings",),                      # фермы, город, магазин
+    "orders": ("orders",),                        # только активные заказы
+    "state": ("buildings", "clicker_upgrades"),   # /api/state для Unity
+    "full": (
+        "buildings",
+        "inventory",
+        "orders",
+        "clicker_upgrades",
+        "achievements",
+        "daily_quests",
+    ),
+}
+
+DEFAULT_PLAN = "core"
+
+
+def _plan_options(plan: str) -> list[LoaderOption]:
+    """Собрать loader options для плана загрузки."""
+    if plan not in LOAD_PLANS:
+        raise ValueError(f"Неизвестный план загрузки: {plan}")
+
+    relations = LOAD_PLANS[plan]
+    # JOIN для одной коллекции — один запрос; для нескольких JOIN дал бы
+    # декартово произведение, поэтому там selectin по отдельности.
+    loader = joinedload if len(relations) == 1 else selectinload
+
+    options = []
+    for name in relations:
+        if name == "orders":
+            # История заказов растёт бесконечно — берём только активные
+            options.append(selectinload(Player.orders.and_(
+                Order.completed_at.is_(None),
+                Order.expires_at > datetime.utcnow(),
+            )))
+        else:
+            options.append(loader(getattr(Player, name)))
+    return options
+
+
+async def get_player_by_tg_id(
+    session: AsyncSession,
+    tg_id: int,
+    plan: str = DEFAULT_PLAN,
+    reload: bool = False,
+) -> Player | None:
+    """Получить игрока по Telegram ID со связями из плана загрузки.
+
+    reload=True перезаписывает игрока и связи плана, уже загруженные в
+    сессию (например, просроченные откатом savepoint).
+    """
+    stmt = select(Player).where(Player.tg_id == tg_id).options(*_plan_options(plan))
+    if reload:
+        stmt = stmt.execution_options(populate_existing=True)
+    result = await session.execute(stmt)
+    return result.unique().scalar_one_or_none()
 
 
 async def create_player(
@@ -34,8 +98,11 @@ async def create_player(
         tap_power=START_TAP_POWER,
     )
     session.add(player)
-    await session.commit()
+    await session.flush()
+    # Подтянуть server_default'ы (level, xp, ...) — коммит делает вызывающий
     await session.refresh(player)
+    # Профиль (имя, аватар) — в лидерборды после commit
+    track(session, player)
     return player
 
 
@@ -45,3 +112,74 @@ async def player_exists(session: AsyncSession, tg_id: int) -> bool:
         select(Player.id).where(Player.tg_id == tg_id)
     )
     return result.scalar_one_or_none() is not None
+
+
+# Сколько игроков сбрасывать одним UPDATE ... FROM (VALUES ...)
+COIN_DELTA_CHUNK = 1000
+
+
+async def apply_coin_deltas(session: AsyncSession, deltas: dict[int, int]) -> int:
+    """Массово зачислить монеты: {tg_id: delta} → players.coins.
+
+    Один UPDATE players SET coins = coins + v.delta FROM (VALUES ...) v
+    на каждые COIN_DELTA_CHUNK игроков. Возвращает число обновлённых строк.
+    """
+    updated = 0
+    items = list(deltas.items())
+    for i in range(0, len(items), COIN_DELTA_CHUNK):
+        v = values(
+            column("tg_id", BigInteger),
+            column("delta", BigInteger),
+            name="v",
+        ).data(items[i:i + COIN_DELTA_CHUNK])
+        result = await session.execute(
+            update(Player)
+            .where(Player.tg_id == v.c.tg_id)
+            .values(coins=Player.coins + v.c.delta)
+            .execution_options(synchronize_session=False)
+        )
+        updated += result.rowcount
+    return updated
+
+
+# Сколько хранить id применённых батчей и переносов: повтор и разбор
+# брошенных переносов приходят в пределах минут
+LEDGER_FLUSH_RETENTION = timedelta(days=1)
+
+
+async def record_ledger_flush(session: AsyncSession, batch_id: str) -> bool:
+    """Записать id батча леджера в текущей транзакции.
+
+    False — батч уже применён (повтор после сбоя), зачислять нельзя.
+    Параллельный воркер с тем же батчем ждёт на ключе до commit первого
+    и получает False. Заодно удаляет id старше LEDGER_FLUSH_RETENTION.
+    """
+    result = await session.execute(
+        insert(LedgerFlush)
+        .values(batch_id=batch_id)
+        .on_conflict_do_nothing(index_elements=[LedgerFlush.batch_id])
+        .returning(LedgerFlush.batch_id)
+    )
+    if result.scalar_one_or_none() is None:
+        return False
+    await session.execute(
+        delete(LedgerFlush)
+        .where(LedgerFlush.flushed_at < datetime.utcnow() - LEDGER_FLUSH_RETENTION)
+        .execution_options(synchronize_session=False)
+    )
+    return True
+
+
+async def record_ledger_settle(session: AsyncSession, settle_id: str) -> None:
+    """Записать id переноса монет из леджера (settle) в текущей транзакции.
+
+    Строка есть ⇔ перенос закоммичен: так разбор брошенных переносов
+    отличает зачисленные монеты от потерянных при откате.
+    """
+    await session.execute(insert(LedgerFlush).values(batch_id=settle_id))
+
+
+async def get_applied_ledger_ids(session: AsyncSession, ids: list[str]) -> set[str]:
+    """Какие из id батчей / переносов леджера уже закоммичены."""
+    result = await session.scalars(select(LedgerFlush.batch_id).where(LedgerFlush.batch_id.in_(ids)))
+    return set(result)
@@ -0,0 +1,53 @@
+"""CRUD операции для апгрейдов кликера.
+
+Уровень апгрейда меняется одним условным UPDATE / INSERT: покупка
+проходит, только если в БД уровень всё ещё тот, за который заплатили.
+Функции не коммитят — изменения уходят в транзакцию вызывающего.
+"""
+
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+from db.models import ClickerUpgrade
+from game.constants import ClickerUpgradeType
+
+
+async def add_upgrade_levels(session: AsyncSession, upgrade: ClickerUpgrade, levels: int) -> bool:
+    """Поднять апгрейд на levels, если в БД у него всё ещё уровень upgrade.level.
+
+    False — уровень успел измениться (параллельная покупка), строка не
+    изменена. Параллельная покупка ждёт на строке до commit первой.
+    """
+    result = await session.execute(
+        update(ClickerUpgrade)
+        .where(ClickerUpgrade.id == upgrade.id, ClickerUpgrade.level == upgrade.level)
+        .values(level=ClickerUpgrade.level + levels)
+        .returning(ClickerUpgrade.level)
+        .execution_options(synchronize_session=False)
+    )
+    new_level = result.scalar_one_or_none()
+    if new_level is None:
+        return False
+    set_committed_value(upgrade, "level", new_level)
+    return True
+
+
+async def create_upgrade(
+    session: AsyncSession,
+    player_id: int,
+    upgrade_type: ClickerUpgradeType,
+    levels: int,
+) -> ClickerUpgrade | None:
+    """Создать апгрейд с уровнем levels (INSERT ... ON CONFLICT DO NOTHING).
+
+    None — апгрейд уже создала параллельная покупка.
+    """
+    result = await session.scalars(
+        insert(ClickerUpgrade)
+        .values(player_id=player_id, upgrade_type=upgrade_type, level=levels)
+        .on_conflict_do_nothing(constraint="uq_clicker_upgrades_player_type")
+        .returning(ClickerUpgrade)
+    )
+    return result.one_or_none()
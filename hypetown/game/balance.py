@@ -0,0 +1,407 @@
+"""Скомпилированные таблицы баланса: формулы game/*.py, посчитанные при импорте.
+
+Экраны города и ферм вызывают формулы для каждого здания на каждой
+отрисовке. Здесь они считаются один раз — в кортежи, индексируемые
+BuildingType / Archetype / ClickerUpgradeType и уровнем, — а функции
+game/*.py сводятся к поиску по таблице. Здесь же сила тапа и таблица XP
+уровней. Модуль не зависит от БД и Redis.
+
+По формулам (_formula_*) строятся таблицы и считаются уровни за их
+пределами. verify_tables() при старте сверяет таблицы с независимыми
+эталонными значениями (_GOLDEN), снятыми с прежних calc_* до перехода
+на таблицы: правка формулы или констант баланса, меняющая цифры, должна
+сопровождаться осознанной правкой эталона.
+"""
+
+import logging
+from bisect import bisect_right
+from typing import Iterable
+
+from game.constants import (
+    ARCHETYPES,
+    BASE_XP_PER_LEVEL,
+    BUILDINGS,
+    CLICKER_UPGRADES,
+    MAX_PLAYER_LEVEL,
+    XP_LEVEL_EXPONENT,
+    Archetype,
+    BuildingType,
+    ClickerUpgradeType,
+)
+
+logger = logging.getLogger(__name__)
+
+# Уровни зданий, покрытые таблицами; выше — расчёт по формуле
+BUILDING_TABLE_LEVELS: int = 100
+
+# Архетип → локация, фермы которой он усиливает
+ARCHETYPE_BONUS_LOCATIONS: dict[str, str] = {
+    "cinema": "hollywood",
+    "games": "gamer_street",
+    "music": "music_hall",
+    "sports": "sports",
+}
+
+
+# ── Индексы enum ─────────────────────────────────────────────────────
+#
+# Enum'ы наследуют str, поэтому индексы находятся и по enum, и по
+# строковому значению ("cinema_studio").
+
+BUILDING_INDEX: dict[str, int] = {bt: i for i, bt in enumerate(BuildingType)}
+ARCHETYPE_INDEX: dict[str, int] = {a: i for i, a in enumerate(Archetype)}
+UPGRADE_INDEX: dict[str, int] = {u: i for i, u in enumerate(ClickerUpgradeType)}
+
+
+# ── Эталонные формулы ────────────────────────────────────────────────
+
+def _formula_production_time(building_type: str, level: int) -> int:
+    """Время производства в секундах: base_time * 0.95^(level-1)."""
+    info = BUILDINGS[building_type]
+    return int(info["base_time"] * (0.95 ** (level - 1)))
+
+
+def _formula_farm_income(building_type: str, level: int, archetype: str) -> int:
+    """Доход фермы: base_income * 1.25^(level-1) * archetype_bonus."""
+    info = BUILDINGS[building_type]
+    income = info["base_income"] * (1.25 ** (level - 1))
+    arch = ARCHETYPES.get(archetype, {})
+    if ARCHETYPE_BONUS_LOCATIONS.get(arch.get("bonus_type")) == info["location"]:
+        income *= 1.0 + arch["bonus"]
+    return int(income)
+
+
+def _formula_building_upgrade_cost(building_type: str, current_level: int) -> int:
+    """Стоимость апгрейда здания: base_cost * 2^current_level."""
+    return int(BUILDINGS[building_type]["cost"] * (2 ** current_level))
+
+
+def _formula_farm_rate(building_type: str, level: int, archetype: str) -> int:
+    """Доход фермы в минуту: income / (prod_time / 60)."""
+    prod_time = _formula_production_time(building_type, level)
+    if prod_time <= 0:
+        return 0
+    return int(_formula_farm_income(building_type, level, archetype) / (prod_time / 60))
+
+
+def _formula_clicker_upgrade_cost(upgrade_key: str, current_level: int) -> int:
+    """Стоимость апгрейда кликера: base_cost * cost_mult^level."""
+    info = CLICKER_UPGRADES[upgrade_key]
+    return int(info["base_cost"] * (info["cost_mult"] ** current_level))
+
+
+def _formula_clicker_multiplier(upgrade_key: str, level: int) -> float:
+    """Множитель силы тапа от апгрейда: multiplier^level (1.0 — нет множителя)."""
+    info = CLICKER_UPGRADES[upgrade_key]
+    if "multiplier" not in info or level <= 0:
+        return 1.0
+    return info["multiplier"] ** level
+
+
+# ── Построение таблиц ────────────────────────────────────────────────
+
+def _building_tables() -> tuple:
+    """Таблицы зданий: [building] / [building][archetype], индекс — уровень 0..N."""
+    levels = range(BUILDING_TABLE_LEVELS + 1)
+    prod_time = tuple(
+        tuple(_formula_production_time(bt, lvl) for lvl in levels)
+        for bt in BuildingType
+    )
+    upgrade_cost = tuple(
+        tuple(_formula_building_upgrade_cost(bt, lvl) for lvl in levels)
+        for bt in BuildingType
+    )
+    income = tuple(
+        tuple(
+            tuple(_formula_farm_income(bt, lvl, a) for lvl in levels)
+            for a in Archetype
+        )
+        for bt in BuildingType
+    )
+    rate = tuple(
+        tuple(
+            tuple(_formula_farm_rate(bt, lvl, a) for lvl in levels)
+            for a in Archetype
+        )
+        for bt in BuildingType
+    )
+    return prod_time, upgrade_cost, income, rate
+
+
+def _clicker_tables() -> tuple:
+    """Таблицы кликера: цены, префиксные суммы, бонусы и множители по уровням."""
+    costs, prefix, bonus, mult = [], [], [], []
+    for u in ClickerUpgradeType:
+        info = CLICKER_UPGRADES[u]
+        level_costs = tuple(
+            _formula_clicker_upgrade_cost(u, lvl) for lvl in range(info["max_level"])
+        )
+        sums = [0]
+        for c in level_costs:
+            sums.append(sums[-1] + c)
+        costs.append(level_costs)
+        prefix.append(tuple(sums))
+        bonus.append(info.get("tap_bonus", 0))
+        mult.append(tuple(
+            _formula_clicker_multiplier(u, lvl) for lvl in range(info["max_level"] + 1)
+        ))
+    return tuple(costs), tuple(prefix), tuple(bonus), tuple(mult)
+
+
+# PRODUCTION_TIME[b][lvl], BUILDING_UPGRADE_COST[b][lvl],
+# FARM_INCOME[b][a][lvl], FARM_RATE[b][a][lvl] (монет/мин)
+PRODUCTION_TIME, BUILDING_UPGRADE_COST, FARM_INCOME, FARM_RATE = _building_tables()
+
+# UPGRADE_COSTS[u][L]       — цена перехода L → L+1 (L < max_level)
+# UPGRADE_COST_PREFIX[u][L] — сумма цен уровней 0..L-1; цена покупки
+#                             n уровней с L: prefix[L+n] - prefix[L]
+# UPGRADE_TAP_BONUS[u]      — аддитивный бонус за уровень (0 у множителей)
+# UPGRADE_MULTIPLIER[u][L]  — множитель силы тапа на уровне L
+UPGRADE_COSTS, UPGRADE_COST_PREFIX, UPGRADE_TAP_BONUS, UPGRADE_MULTIPLIER = _clicker_tables()
+
+# Множитель силы тапа от архетипа (Блогер — +20% к кликеру)
+ARCHETYPE_TAP_MULT: tuple[float, ...] = tuple(
+    1.0 + ARCHETYPES[a]["bonus"] if ARCHETYPES[a]["bonus_type"] == "clicker" else 1.0
+    for a in Archetype
+)
+
+
+# ── Поиск по таблицам ────────────────────────────────────────────────
+
+def production_time(building_type: str, level: int) -> int:
+    """Время производства в секундах."""
+    if level > BUILDING_TABLE_LEVELS:
+        return _formula_production_time(building_type, level)
+    return PRODUCTION_TIME[BUILDING_INDEX[building_type]][level]
+
+
+def farm_income(building_type: str, level: int, archetype: str) -> int:
+    """Доход фермы за цикл с бонусом архетипа."""
+    if level > BUILDING_TABLE_LEVELS:
+        return _formula_farm_income(building_type, level, archetype)
+    return FARM_INCOME[BUILDING_INDEX[building_type]][ARCHETYPE_INDEX[archetype]][level]
+
+
+def farm_rate(building_type: str, level: int, archetype: str) -> int:
+    """Доход фермы в минуту."""
+    if level > BUILDING_TABLE_LEVELS:
+        return _formula_farm_rate(building_type, level, archetype)
+    return FARM_RATE[BUILDING_INDEX[building_type]][ARCHETYPE_INDEX[archetype]][level]
+
+
+def building_upgrade_cost(building_type: str, current_level: int) -> int:
+    """Стоимость апгрейда здания на следующий уровень."""
+    if current_level > BUILDING_TABLE_LEVELS:
+        return _formula_building_upgrade_cost(building_type, current_level)
+    return BUILDING_UPGRADE_COST[BUILDING_INDEX[building_type]][current_level]
+
+
+def calc_tap_power(upgrades: Iterable, archetype: str) -> int:
+    """Вычислить итоговую силу тапа с учётом всех апгрейдов и архетипа.
+
+    tap_power = (1 + sum(tap_bonus * level)) * multipliers * archetype_bonus
+    upgrades — объекты с upgrade_type и level (ClickerUpgrade).
+    """
+    base_tap = 1
+    additive = 0
+    multiplier = 1.0
+
+    for upg in upgrades:
+        i = UPGRADE_INDEX[upg.upgrade_type]
+        additive += UPGRADE_TAP_BONUS[i] * upg.level
+        multiplier *= UPGRADE_MULTIPLIER[i][upg.level]
+
+    # Бонус архетипа (Блогер — +20% к кликеру)
+    multiplier *= ARCHETYPE_TAP_MULT[ARCHETYPE_INDEX[archetype]]
+
+    return max(1, int((base_tap + additive) * multiplier))
+
+
+# ── Уровни игрока ────────────────────────────────────────────────────
+
+def _xp_formula(level: int) -> int:
+    """XP, необходимый для достижения уровня: base * level^exponent."""
+    return int(BASE_XP_PER_LEVEL * (level ** XP_LEVEL_EXPONENT))
+
+
+# LEVEL_XP[L] — суммарный XP для уровня L (0..MAX_PLAYER_LEVEL), по возрастанию
+LEVEL_XP: tuple[int, ...] = tuple(_xp_formula(lvl) for lvl in range(MAX_PLAYER_LEVEL + 1))
+
+
+def xp_for_level(level: int) -> int:
+    """XP, необходимый для достижения уровня."""
+    if level > MAX_PLAYER_LEVEL:
+        return _xp_formula(level)
+    return LEVEL_XP[level]
+
+
+def level_for_xp(xp: int) -> int:
+    """Уровень для суммарного XP — бинарный поиск по LEVEL_XP, O(log n)."""
+    return max(1, min(bisect_right(LEVEL_XP, xp) - 1, MAX_PLAYER_LEVEL))
+
+
+# ── Проверка при старте ──────────────────────────────────────────────
+#
+# Эталон: выход calc_* из game/farms.py и game/clicker.py до перехода на
+# таблицы, для выборочных уровней каждого здания и апгрейда. Архетипы —
+# нейтральный (journalist) и тот, чей бонус действует на локацию.
+# clicker_cost_total — цена всех уровней апгрейда с нуля.
+
+_GOLDEN: dict[str, dict[tuple, int | float]] = {
+    "production_time": {
+        ("cinema_studio", 1): 1800,
+        ("cinema_studio", 100): 11,
+        ("series_lot", 1): 900,
+        ("series_lot", 100): 5,
+        ("game_studio", 1): 3600,
+        ("game_studio", 100): 22,
+        ("cyber_arena", 1): 1200,
+        ("cyber_arena", 100): 7,
+        ("recording", 1): 600,
+        ("recording", 100): 3,
+        ("concert_hall", 1): 2700,
+        ("concert_hall", 100): 16,
+        ("sports_arena", 1): 1800,
+        ("sports_arena", 100): 11,
+        ("tv_studio", 1): 1500,
+        ("tv_studio", 100): 9,
+        ("podcast_studio", 1): 600,
+        ("podcast_studio", 100): 3,
+    },
+    "building_upgrade_cost": {
+        ("cinema_studio", 0): 2000,
+        ("cinema_studio", 10): 2048000,
+        ("series_lot", 0): 1000,
+        ("series_lot", 10): 1024000,
+        ("game_studio", 0): 5000,
+        ("game_studio", 10): 5120000,
+        ("cyber_arena", 0): 3000,
+        ("cyber_arena", 10): 3072000,
+        ("recording", 0): 800,
+        ("recording", 10): 819200,
+        ("concert_hall", 0): 4000,
+        ("concert_hall", 10): 4096000,
+        ("sports_arena", 0): 3500,
+        ("sports_arena", 10): 3584000,
+        ("tv_studio", 0): 2500,
+        ("tv_studio", 10): 2560000,
+        ("podcast_studio", 0): 600,
+        ("podcast_studio", 10): 614400,
+    },
+    "farm_income": {
+        ("cinema_studio", 1, "director"): 575,
+        ("cinema_studio", 100, "director"): 2258182994036,
+        ("cinema_studio", 1, "journalist"): 500,
+        ("cinema_studio", 100, "journalist"): 1963637386119,
+        ("series_lot", 1, "director"): 229,
+        ("series_lot", 100, "director"): 903273197614,
+        ("series_lot", 1, "journalist"): 200,
+        ("series_lot", 100, "journalist"): 785454954447,
+        ("game_studio", 1, "journalist"): 1200,
+        ("game_studio", 100, "journalist"): 4712729726685,
+        ("game_studio", 1, "streamer"): 1380,
+        ("game_studio", 100, "streamer"): 5419639185688,
+        ("cyber_arena", 1, "journalist"): 350,
+        ("cyber_arena", 100, "journalist"): 1374546170283,
+        ("cyber_arena", 1, "streamer"): 402,
+        ("cyber_arena", 100, "streamer"): 1580728095825,
+        ("recording", 1, "journalist"): 150,
+        ("recording", 100, "journalist"): 589091215835,
+        ("recording", 1, "producer"): 172,
+        ("recording", 100, "producer"): 677454898211,
+        ("concert_hall", 1, "journalist"): 800,
+        ("concert_hall", 100, "journalist"): 3141819817790,
+        ("concert_hall", 1, "producer"): 919,
+        ("concert_hall", 100, "producer"): 3613092790459,
+        ("sports_arena", 1, "journalist"): 600,
+        ("sports_arena", 100, "journalist"): 2356364863342,
+        ("sports_arena", 1, "magnate"): 690,
+        ("sports_arena", 100, "magnate"): 2709819592844,
+        ("tv_studio", 1, "journalist"): 450,
+        ("tv_studio", 100, "journalist"): 1767273647507,
+        ("podcast_studio", 1, "journalist"): 120,
+        ("podcast_studio", 100, "journalist"): 471272972668,
+    },
+    "farm_rate": {
+        ("cinema_studio", 10, "director"): 226,
+        ("cinema_studio", 10, "journalist"): 197,
+        ("series_lot", 10, "director"): 181,
+        ("series_lot", 10, "journalist"): 157,
+        ("game_studio", 10, "journalist"): 236,
+        ("game_studio", 10, "streamer"): 271,
+        ("cyber_arena", 10, "journalist"): 206,
+        ("cyber_arena", 10, "streamer"): 237,
+        ("recording", 10, "journalist"): 177,
+        ("recording", 10, "producer"): 203,
+        ("concert_hall", 10, "journalist"): 210,
+        ("concert_hall", 10, "producer"): 241,
+        ("sports_arena", 10, "journalist"): 236,
+        ("sports_arena", 10, "magnate"): 271,
+        ("tv_studio", 10, "journalist"): 212,
+        ("podcast_studio", 10, "journalist"): 141,
+    },
+    "clicker_cost": {
+        ("smartphone", 49): 21254050007,
+        ("camera", 39): 18268770466,
+        ("laptop", 29): 4819685721,
+        ("studio", 24): 6691294225,
+        ("production", 19): 4946049139,
+        ("media_corp", 14): 3276800000,
+        ("viral_algo", 4): 8100000,
+        ("gold_button", 2): 8000000,
+    },
+    "clicker_cost_total": {
+        ("smartphone",): 63762149900,
+        ("camera",): 48716720892,
+        ("laptop",): 11704949595,
+        ("studio",): 15055405748,
+        ("production",): 10441631506,
+        ("media_corp",): 6553400000,
+        ("viral_algo",): 12100000,
+        ("gold_button",): 10500000,
+    },
+    "clicker_multiplier": {
+        ("viral_algo", 5): 32,
+        ("gold_button", 3): 3.375,
+    },
+}
+
+
+def _table_lookups() -> dict:
+    """Название эталона → поиск по таблицам с теми же аргументами."""
+    return {
+        "production_time": production_time,
+        "building_upgrade_cost": building_upgrade_cost,
+        "farm_income": farm_income,
+        "farm_rate": farm_rate,
+        "clicker_cost": lambda u, lvl: UPGRADE_COSTS[UPGRADE_INDEX[u]][lvl],
+        "clicker_cost_total": lambda u: UPGRADE_COST_PREFIX[UPGRADE_INDEX[u]][-1],
+        "clicker_multiplier": lambda u, lvl: UPGRADE_MULTIPLIER[UPGRADE_INDEX[u]][lvl],
+    }
+
+
+def verify_tables() -> None:
+    """Сверить таблицы с эталоном _GOLDEN и префиксные суммы с ценами; RuntimeError при расхождении."""
+    mismatches = []
+    lookups = _table_lookups()
+
+    for name, expected in _GOLDEN.items():
+        for args, value in expected.items():
+            got = lookups[name](*args)
+            if got != value:
+                mismatches.append(f"{name}{args}: таблица={got!r}, эталон={value!r}")
+
+    for u in ClickerUpgradeType:
+        i = UPGRADE_INDEX[u]
+        total = 0
+        for lvl, cost in enumerate(UPGRADE_COSTS[i]):
+            total += cost
+            if UPGRADE_COST_PREFIX[i][lvl + 1] != total:
+                mismatches.append(f"clicker_prefix[{u.value}][{lvl + 1}]: не сумма цен уровней")
+                break
+
+    if mismatches:
+        for m in mismatches[:20]:
+            logger.error("Таблица баланса расходится с эталоном — %s", m)
+        raise RuntimeError(f"Таблицы баланса расходятся с эталоном: {len(mismatches)}")
+    logger.info("Таблицы баланса сверены с эталоном")
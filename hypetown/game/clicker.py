@@ -1,77 +1,186 @@
-"""Бизнес-логика кликера: формулы тапа, апгрейды, мультипликаторы."""
+"""Бизнес-логика кликера: формулы тапа, апгрейды, мультипликаторы.
+
+Функции не коммитят: транзакцией управляет вызывающий (единица работы апдейта).
+"""
+
+import math
+import uuid
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db.models import ClickerUpgrade, Player
+from db.models import Player
+from db.database import on_commit
+from db.repositories.ledger import credit, debit_if_sufficient
+from db.repositories.player import record_ledger_settle
+from db.repositories.upgrade import add_upgrade_levels, create_upgrade
+from game.balance import UPGRADE_COST_PREFIX, UPGRADE_COSTS, UPGRADE_INDEX, calc_tap_power
 from game.constants import (
-    ARCHETYPES,
     CLICKER_UPGRADES,
+    MAX_TAPS_PER_BATCH,
+    TAP_BURST,
+    TAP_RATE_PER_SEC,
     ClickerUpgradeType,
 )
+from services.redis_service import (
+    apply_taps,
+    release_settled_coins,
+    reserve_pending_coins,
+    return_settled_coins,
+    set_cached_tap_power,
+)
+from services.state_sync import mark_changed
 
 
 def calc_upgrade_cost(upgrade_key: str, current_level: int) -> int:
-    """Стоимость апгрейда на следующий уровень."""
-    info = CLICKER_UPGRADES[upgrade_key]
-    return int(info["base_cost"] * (info["cost_mult"] ** current_level))
+    """Стоимость апгрейда на следующий уровень (из таблицы game.balance)."""
+    return UPGRADE_COSTS[UPGRADE_INDEX[upgrade_key]][current_level]
+
 
+def calc_bulk_cost(upgrade_key: str, current_level: int, levels: int) -> int:
+    """Стоимость покупки levels уровней подряд начиная с current_level."""
+    prefix = UPGRADE_COST_PREFIX[UPGRADE_INDEX[upgrade_key]]
+    return prefix[current_level + levels] - prefix[current_level]
 
-def calc_tap_power(upgrades: list[ClickerUpgrade], archetype: str) -> int:
-    """Вычислить итоговую силу тапа с учётом всех апгрейдов и архетипа.
 
-    tap_power = (1 + sum(tap_bonus * level)) * multipliers * archetype_bonus
+def max_affordable_levels(upgrade_key: str, current_level: int, coins: int) -> int:
+    """Сколько уровней подряд можно купить на coins — за O(1).
+
+    Сумма геометрической прогрессии a * (r^n - 1) / (r - 1) ≤ coins даёт
+    n = floor(log(1 + coins * (r - 1) / a) / log(r)), где a — цена
+    следующего уровня. Реальные цены округляются вниз по уровням,
+    поэтому оценка уточняется по префиксным суммам (на ±1–2 шага).
     """
-    base_tap = 1
-    additive = 0
-    multiplier = 1.0
+    info = CLICKER_UPGRADES[upgrade_key]
+    remaining = info["max_level"] - current_level
+    if remaining <= 0 or coins <= 0:
+        return 0
+
+    a = calc_upgrade_cost(upgrade_key, current_level)
+    r = info["cost_mult"]
+    if a <= 0:
+        return remaining
+    if r == 1:
+        n = coins // a
+    else:
+        n = int(math.log1p(coins * (r - 1) / a) / math.log(r))
+    n = max(0, min(n, remaining))
 
-    for upg in upgrades:
-        info = CLICKER_UPGRADES.get(upg.upgrade_type.value, {})
-        if "tap_bonus" in info:
-            additive += info["tap_bonus"] * upg.level
-        if "multiplier" in info and upg.level > 0:
-            multiplier *= info["multiplier"] ** upg.level
+    # Уточнение по точным суммам
+    while n > 0 and calc_bulk_cost(upgrade_key, current_level, n) > coins:
+        n -= 1
+    while n < remaining and calc_bulk_cost(upgrade_key, current_level, n + 1) <= coins:
+        n += 1
+    return n
 
-    # Бонус архетипа «Блогер» — +20% к кликеру
-    arch = ARCHETYPES.get(archetype, {})
-    if arch.get("bonus_type") == "clicker":
-        multiplier *= 1.0 + arch["bonus"]
 
-    return max(1, int((base_tap + additive) * multiplier))
+async def process_tap(player: Player, tap_count: int = 1) -> dict:
+    """Обработать тап(ы) одним вызовом Redis: лимит, леджер, лидерборд.
 
+    В БД тапы не пишутся — их переносит фоновый сброс леджера.
+    Тапы сверх лимита TAP_RATE_PER_SEC/TAP_BURST отбрасываются.
+    Возвращает: {"taps": int, "earned": int, "total_coins": int, "tap_power": int}
+    """
+    tap_count = min(tap_count, MAX_TAPS_PER_BATCH)
+    result = await apply_taps(
+        player.tg_id,
+        tap_count,
+        rate=TAP_RATE_PER_SEC,
+        burst=TAP_BURST,
+        fallback_tap_power=player.tap_power,
+        base_coins=player.coins,
+    )
 
-async def process_tap(
-    session: AsyncSession,
-    player: Player,
-    tap_count: int = 1,
-) -> dict:
-    """Обработать тап(ы): начислить монеты, вернуть результат.
+    return {
+        "taps": result["taps"],
+        "earned": result["earned"],
+        "total_coins": player.coins + result["pending"],
+        "tap_power": result["tap_power"],
+    }
+
+
+async def process_tap_cached(tg_id: int, tap_count: int = 1) -> dict | None:
+    """process_tap без игрока из БД: сила тапа — из кэша скрипта тапа.
 
-    Возвращает: {"earned": int, "total_coins": int, "tap_power": int}
+    Баланс — счёт игрока в рейтинге монет за всё время (монеты в БД плюс
+    несброшенные, его поддерживают публикация после commit и сам тап).
+    None — кэша нет: вызывающий загружает игрока и зовёт process_tap.
     """
-    tap_count = min(tap_count, 50)
-    earned = player.tap_power * tap_count
-    player.coins += earned
-    await session.commit()
+    result = await apply_taps(
+        tg_id,
+        min(tap_count, MAX_TAPS_PER_BATCH),
+        rate=TAP_RATE_PER_SEC,
+        burst=TAP_BURST,
+    )
+    if result is None:
+        return None
 
     return {
-        "earned": earned,
-        "total_coins": player.coins,
-        "tap_power": player.tap_power,
+        "taps": result["taps"],
+        "earned": result["earned"],
+        "total_coins": int(result["score"]),
+        "tap_power": result["tap_power"],
     }
 
 
+async def settle_pending_coins(session: AsyncSession, player: Player) -> int:
+    """Перенести несброшенные монеты игрока в players.coins текущей транзакции.
+
+    Вызывается перед списанием, чтобы проверка баланса учитывала тапы.
+    Зачисление — атомарный инкремент (db.repositories.ledger.credit), так
+    что параллельный сброс леджера ничего не теряет. Монеты лежат в
+    Redis под id переноса до commit: id пишется в ledger_flushes той же
+    транзакцией, и перенос, брошенный упавшим воркером, разбирается по
+    нему (services.scheduler.recover_settled_coins).
+    Возвращает перенесённую сумму.
+    """
+    settle_id = uuid.uuid4().hex
+    pending = await reserve_pending_coins(player.tg_id, settle_id)
+    if pending:
+        # При откате транзакции перенос нужно вернуть в леджер
+        session.info.setdefault("settled_coins", {})[settle_id] = pending
+        await record_ledger_settle(session, settle_id)
+        await credit(session, player, pending, earned=False)
+        on_commit(session, release_settled_coins, [settle_id])
+    player.pending_coins = 0
+    return pending
+
+
+async def restore_settled_coins(session: AsyncSession, since: dict[str, int] | None = None) -> None:
+    """Вернуть в леджер монеты, перенесённые в откатившуюся транзакцию.
+
+    since — снимок settled_coins_snapshot(), сделанный перед откатившимся
+    savepoint: возвращаются только переносы после него.
+    """
+    since = since or {}
+    returned = [s for s in session.info.pop("settled_coins", {}) if s not in since]
+    if returned:
+        await return_settled_coins(returned)
+    if since:
+        session.info["settled_coins"] = dict(since)
+
+
+def settled_coins_snapshot(session: AsyncSession) -> dict[str, int]:
+    """Сколько монет уже перенесено из леджера в текущей транзакции."""
+    return dict(session.info.get("settled_coins", {}))
+
+
 async def buy_upgrade(
     session: AsyncSession,
     player: Player,
     upgrade_key: str,
+    count: int | None = 1,
 ) -> dict:
-    """Купить апгрейд кликера.
+    """Купить апгрейд кликера: count уровней подряд, count=None — сколько хватит монет.
 
-    Возвращает: {"ok": bool, "error"?: str, "new_level"?: int, "new_tap_power"?: int, "cost"?: int}
+    Все уровни покупаются одной операцией, tap_power пересчитывается один раз.
+    error="conflict" — уровень изменила параллельная покупка, списание возвращено.
+    Возвращает: {"ok": bool, "error"?: str, "new_level"?: int, "levels"?: int,
+                 "new_tap_power"?: int, "cost"?: int}
     """
     if upgrade_key not in CLICKER_UPGRADES:
         return {"ok": False, "error": "unknown_upgrade"}
+    if count is not None and count < 1:
+        return {"ok": False, "error": "invalid_count"}
 
     info = CLICKER_UPGRADES[upgrade_key]
     upgrade_type = ClickerUpgradeType(upgrade_key)
@@ -86,45 +195,63 @@ async def buy_upgrade(
     current_level = current.level if current else 0
 
     # Проверка лимита
-    if current_level >= info["max_level"]:
+    remaining = info["max_level"] - current_level
+    if remaining <= 0:
         return {"ok": False, "error": "max_level"}
 
-    # Стоимость
-    cost = calc_upgrade_cost(upgrade_key, current_level)
-    if player.coins < cost:
-        return {"ok": False, "error": "not_enough_coins", "cost": cost}
+    # Баланс с учётом несброшенных тапов
+    await settle_pending_coins(session, player)
 
-    # Покупка
-    player.coins -= cost
+    if count is None:
+        levels = max_affordable_levels(upgrade_key, current_level, player.coins)
+        if levels == 0:
+            return {"ok": False, "error": "not_enough_coins", "cost": calc_upgrade_cost(upgrade_key, current_level)}
+    else:
+        levels = min(count, remaining)
+
+    cost = calc_bulk_cost(upgrade_key, current_level, levels)
+    # Покупка: проверка баланса и списание — один UPDATE
+    if not await debit_if_sufficient(session, player, cost):
+        return {"ok": False, "error": "not_enough_coins", "cost": cost}
 
+    # Уровень — условным UPDATE / INSERT от уровня, за который заплатили:
+    # параллельная покупка (бот + Mini App) получает конфликт, а не
+    # второй платёж за те же уровни
     if current:
-        current.level += 1
+        claimed = await add_upgrade_levels(session, current, levels)
     else:
-        new_upg = ClickerUpgrade(
-            player_id=player.id,
-            upgrade_type=upgrade_type,
-            level=1,
-        )
-        session.add(new_upg)
-        player.clicker_upgrades.append(new_upg)
+        current = await create_upgrade(session, player.id, upgrade_type, levels)
+        claimed = current is not None
+        if claimed:
+            player.clicker_upgrades.append(current)
+    if not claimed:
+        await credit(session, player, cost, earned=False)
+        return {"ok": False, "error": "conflict"}
 
     # Пересчёт tap_power
     new_tap_power = calc_tap_power(player.clicker_upgrades, player.archetype.value)
     player.tap_power = new_tap_power
-
-    await session.commit()
+    mark_changed(session, player.tg_id, "upgrades", "player")
+    # Кэш силы тапа для скрипта тапа — только после успешного commit
+    on_commit(session, set_cached_tap_power, player.tg_id, new_tap_power)
 
     return {
         "ok": True,
-        "new_level": current_level + 1,
+        "new_level": current_level + levels,
+        "levels": levels,
         "new_tap_power": new_tap_power,
         "cost": cost,
     }
 
 
-def get_upgrades_info(player: Player) -> list[dict]:
-    """Получить инфо обо всех апгрейдах для отображения в UI."""
+def get_upgrades_info(player: Player, count: int | None = 1) -> list[dict]:
+    """Получить инфо обо всех апгрейдах для отображения в UI.
+
+    count — режим покупки (1, N или None = «макс»): для него считаются
+    buy_levels/buy_cost. Все цены берутся из предрасчитанных таблиц.
+    """
     result = []
+    coins = player.balance
 
     # Словарь текущих уровней
     owned = {}
@@ -136,6 +263,15 @@ def get_upgrades_info(player: Player) -> list[dict]:
         maxed = level >= info["max_level"]
         cost = calc_upgrade_cost(key, level) if not maxed else 0
 
+        # Сколько уровней и за сколько купит выбранный режим
+        if maxed:
+            buy_levels = 0
+        elif count is None:
+            buy_levels = max(1, max_affordable_levels(key, level, coins))
+        else:
+            buy_levels = min(count, info["max_level"] - level)
+        buy_cost = calc_bulk_cost(key, level, buy_levels)
+
         # Описание бонуса
         if "tap_bonus" in info:
             bonus = f"+{info['tap_bonus']} за тап"
@@ -149,8 +285,10 @@ def get_upgrades_info(player: Player) -> list[dict]:
             "level": level,
             "max_level": info["max_level"],
             "cost": cost,
+            "buy_levels": buy_levels,
+            "buy_cost": buy_cost,
             "maxed": maxed,
-            "affordable": player.coins >= cost and not maxed,
+            "affordable": coins >= buy_cost and not maxed,
         })
 
     return result
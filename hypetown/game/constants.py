@@ -157,5 +157,60 @@ START_COINS: int = 100
 START_TAP_POWER: int = 1
 BASE_XP_PER_LEVEL: int = 100
 XP_LEVEL_EXPONENT: float = 1.5
+MAX_PLAYER_LEVEL: int = 200      # Потолок уровня (и размер таблицы XP)
 PVP_BASE_RATING: int = 1000
 PVP_K_FACTOR: int = 32
+
+
+# ── Лимиты кликера ───────────────────────────────────────────────────
+
+MAX_TAPS_PER_BATCH: int = 50     # Макс. тапов в одном запросе
+MAX_BATCH_ACTIONS: int = 32      # Макс. действий в одном POST /api/batch
+TAP_RATE_PER_SEC: float = 20.0   # Устойчивый темп тапов на игрока
+TAP_BURST: int = 100             # Ёмкость ведра (батч Unity + запас)
+
+
+# ── Лидерборды ───────────────────────────────────────────────────────
+
+# Рейтинг → заголовок
+LEADERBOARDS: dict[str, str] = {
+    "coins": "💰 Вьюкоины",
+    "level": "⭐ Уровень",
+    "passive_income": "💸 Пассивный доход",
+    "pvp_rating": "⚔️ PvP рейтинг",
+    "prestige": "🔄 Престиж",
+}
+
+# Период → заголовок
+LEADERBOARD_PERIODS: dict[str, str] = {
+    "all": "за всё время",
+    "week": "неделя",
+    "season": "сезон",
+}
+
+# Рейтинги с недельным и сезонным вариантом (счёт — заработок за период)
+LEADERBOARD_PERIODIC: tuple[str, ...] = ("coins", "level")
+SEASON_MONTHS: int = 3   # Сезон — квартал: с 1 января, апреля, июля, октября
+
+
+# ── Лимиты запросов (antiflood) ──────────────────────────────────────
+#
+# Действие → (устойчивый темп запросов/сек, всплеск). Бот и TMA API
+# делят лимиты: тап из бота и батч тапов из Unity — одно действие.
+#
+# Лимит "tap" считает запросы, а не тапы: callback clicker:tap несёт один
+# тап, POST /api/tap — до MAX_TAPS_PER_BATCH. Запрос содержит хотя бы
+# один тап, поэтому параметры взяты из лимита тапов (TAP_RATE_PER_SEC,
+# TAP_BURST): запрос, который примет скрипт тапа, middleware не отсечёт.
+# Сами тапы считает и обрезает скрипт тапа (game.clicker.process_tap).
+
+RATE_LIMITS: dict[str, tuple[float, int]] = {
+    "tap": (TAP_RATE_PER_SEC, TAP_BURST),   # Запросы тапов (callback clicker:tap, POST /api/tap)
+    "nav": (1.0, 20),     # Остальные апдейты бота: команды, экраны, покупки
+    "api": (3.0, 20),     # Остальные эндпоинты TMA API
+}
+
+
+# ── Непрерывное производство ─────────────────────────────────────────
+
+CONTINUOUS_STORAGE_CYCLES: int = 8   # Склад здания: макс. несобранных циклов
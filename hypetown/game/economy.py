@@ -3,38 +3,41 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.models import Player
-from game.constants import BASE_XP_PER_LEVEL, XP_LEVEL_EXPONENT
-
-
-def xp_for_level(level: int) -> int:
-    """XP, необходимый для достижения уровня."""
-    return int(BASE_XP_PER_LEVEL * (level ** XP_LEVEL_EXPONENT))
+from db.repositories.ledger import grant_xp, raise_level
+from game.balance import level_for_xp, xp_for_level
+from game.constants import MAX_PLAYER_LEVEL
 
 
 def xp_to_next_level(player: Player) -> int:
-    """Сколько XP до следующего уровня."""
-    required = xp_for_level(player.level + 1)
-    return max(0, required - player.xp)
+    """Сколько XP до следующего уровня (0 — достигнут потолок)."""
+    if player.level >= MAX_PLAYER_LEVEL:
+        return 0
+    return max(0, xp_for_level(player.level + 1) - player.xp)
 
 
 async def add_xp(session: AsyncSession, player: Player, amount: int) -> dict:
     """Начислить XP и проверить повышение уровня.
 
-    Возвращает: {"xp_added": int, "leveled_up": bool, "new_level"?: int}
+    Возвращает: {"xp_added": int, "leveled_up": bool, "levels": [int, ...],
+                 "new_level"?: int}; levels — все пройденные уровни по порядку.
     """
-    player.xp += amount
-    leveled_up = False
-    new_level = player.level
+    await grant_xp(session, player, amount)
+    levels = await sync_level(session, player)
+
+    result = {"xp_added": amount, "leveled_up": bool(levels), "levels": levels}
+    if levels:
+        result["new_level"] = player.level
+    return result
 
-    # Проверяем повышение (может быть несколько уровней за раз)
-    while player.xp >= xp_for_level(player.level + 1):
-        player.level += 1
-        leveled_up = True
-        new_level = player.level
 
-    await session.commit()
+async def sync_level(session: AsyncSession, player: Player) -> list[int]:
+    """Поднять уровень под уже начисленный XP.
 
-    result = {"xp_added": amount, "leveled_up": leveled_up}
-    if leveled_up:
-        result["new_level"] = new_level
-    return result
+    Возвращает пройденные уровни (пусто — без повышения), чтобы награды
+    за уровни можно было выдать одним пакетом.
+    """
+    old_level = player.level
+    target = level_for_xp(player.xp)
+    if target > old_level:
+        await raise_level(session, player, target)
+    return list(range(old_level + 1, player.level + 1))
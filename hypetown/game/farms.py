@@ -1,12 +1,22 @@
-"""Бизнес-логика ферм: производство, таймеры, апгрейды зданий."""
+"""Бизнес-логика ферм: производство, таймеры, апгрейды зданий.
+
+Функции не коммитят: транзакцией управляет вызывающий (единица работы апдейта).
+"""
 
 from datetime import datetime, timedelta
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from db.database import on_commit
 from db.models import Building, Inventory, Player
-from db.repositories.inventory import add_resource
-from game.constants import ARCHETYPES, BUILDINGS, BuildingType, Resource
+from db.repositories.building import claim_collect
+from db.repositories.inventory import add_resources
+from db.repositories.ledger import credit, debit_if_sufficient
+from game.balance import building_upgrade_cost, farm_income, farm_rate, production_time
+from game.clicker import settle_pending_coins
+from game.constants import BUILDINGS, CONTINUOUS_STORAGE_CYCLES, BuildingType, Resource
+from services.redis_service import cancel_farm_ready, schedule_farm_ready
+from services.state_sync import mark_changed
 
 # Маппинг: тип здания → ресурс, который оно производит
 BUILDING_RESOURCE_MAP: dict[str, str] = {
@@ -24,34 +34,33 @@ BUILDING_RESOURCE_MAP: dict[str, str] = {
 
 def calc_production_time(building_type: str, level: int) -> int:
     """Время производства в секундах: base_time * 0.95^(level-1)."""
-    info = BUILDINGS[building_type]
-    return int(info["base_time"] * (0.95 ** (level - 1)))
+    return production_time(building_type, level)
 
 
 def calc_farm_income(building_type: str, level: int, archetype: str) -> int:
     """Доход фермы: base_income * 1.25^(level-1) * archetype_bonus."""
-    info = BUILDINGS[building_type]
-    income = info["base_income"] * (1.25 ** (level - 1))
-
-    # Бонус архетипа к конкретной локации
-    arch = ARCHETYPES.get(archetype, {})
-    location = info["location"]
-    bonus_map = {
-        "cinema": "hollywood",
-        "games": "gamer_street",
-        "music": "music_hall",
-        "sports": "sports",
-    }
-    if bonus_map.get(arch.get("bonus_type")) == location:
-        income *= 1.0 + arch["bonus"]
-
-    return int(income)
+    return farm_income(building_type, level, archetype)
 
 
 def calc_upgrade_cost(building_type: str, current_level: int) -> int:
     """Стоимость апгрейда здания: base_cost * 2^current_level."""
-    info = BUILDINGS[building_type]
-    return int(info["cost"] * (2 ** current_level))
+    return building_upgrade_cost(building_type, current_level)
+
+
+def continuous_cycles(building: Building, now: datetime) -> tuple[int, int]:
+    """Непрерывный режим: (готовых циклов на складе, сек до следующего цикла).
+
+    Считается от якоря last_collected в замкнутой форме; склад ограничен
+    CONTINUOUS_STORAGE_CYCLES — при полном складе производство стоит.
+    """
+    prod_time = calc_production_time(building.type.value, building.level)
+    elapsed = max(0.0, (now - building.last_collected).total_seconds())
+    if prod_time <= 0:
+        return CONTINUOUS_STORAGE_CYCLES, 0
+    cycles = min(int(elapsed // prod_time), CONTINUOUS_STORAGE_CYCLES)
+    if cycles >= CONTINUOUS_STORAGE_CYCLES:
+        return cycles, 0
+    return cycles, int(prod_time - elapsed % prod_time)
 
 
 async def buy_building(
@@ -74,12 +83,12 @@ async def buy_building(
         if b.type.value == building_type:
             return {"ok": False, "error": "already_owned"}
 
-    # Стоимость
+    # Стоимость (с учётом несброшенных тапов)
     cost = info["cost"]
-    if player.coins < cost:
+    await settle_pending_coins(session, player)
+    if not await debit_if_sufficient(session, player, cost):
         return {"ok": False, "error": "not_enough_coins", "cost": cost}
 
-    player.coins -= cost
     building = Building(
         player_id=player.id,
         type=BuildingType(building_type),
@@ -87,7 +96,9 @@ async def buy_building(
     )
     session.add(building)
     player.buildings.append(building)
-    await session.commit()
+    mark_changed(session, player.tg_id, "buildings")
+    # flush — чтобы вернуть id нового здания
+    await session.flush()
 
     return {"ok": True, "building_id": building.id, "cost": cost}
 
@@ -107,16 +118,13 @@ async def start_production(
     if not building:
         return {"ok": False, "error": "building_not_found"}
 
+    if building.is_continuous:
+        return {"ok": False, "error": "continuous_mode"}
+
     if building.is_producing:
         return {"ok": False, "error": "already_producing"}
 
-    prod_time = calc_production_time(building.type.value, building.level)
-    now = datetime.utcnow()
-
-    building.is_producing = True
-    building.production_started = now
-    building.production_ends = now + timedelta(seconds=prod_time)
-    await session.commit()
+    prod_time = _start_building(session, player, building, datetime.utcnow())
 
     return {
         "ok": True,
@@ -140,43 +148,152 @@ async def collect_production(
     if not building:
         return {"ok": False, "error": "building_not_found"}
 
-    if not building.is_producing:
-        return {"ok": False, "error": "not_producing"}
-
     now = datetime.utcnow()
-    if building.production_ends and now < building.production_ends:
+    if building.is_continuous:
+        cycles, remaining = continuous_cycles(building, now)
+        if not cycles:
+            return {"ok": False, "error": "not_ready", "remaining_sec": remaining}
+    elif not building.is_producing:
+        return {"ok": False, "error": "not_producing"}
+    elif building.production_ends and now < building.production_ends:
         remaining = int((building.production_ends - now).total_seconds())
         return {"ok": False, "error": "not_ready", "remaining_sec": remaining}
 
-    # Начислить доход
-    income = calc_farm_income(building.type.value, building.level, player.archetype.value)
-    player.coins += income
-
-    # Начислить ресурс в инвентарь
-    resource_key = BUILDING_RESOURCE_MAP.get(building.type.value)
-    resource_qty = 0
-    if resource_key:
-        resource_qty = max(1, building.level)  # Больше ресурсов с уровнем
-        await add_resource(session, player.id, resource_key, resource_qty)
+    # Начислить доход и ресурс — если цикл не забрал параллельный апдейт
+    collected, income, resources = await _collect_buildings(session, player, [building], now)
+    if not collected:
+        return {"ok": False, "error": "already_collected"}
+    await credit(session, player, income)
+    await add_resources(session, player.id, resources)
+    resource_key, resource_qty = next(iter(resources.items()), (None, 0))
 
     # Обновить пассивный доход (пересчёт)
     player.passive_income = _calc_total_passive_income(player)
 
-    building.is_producing = False
-    building.production_started = None
-    building.production_ends = None
-    building.last_collected = now
-    await session.commit()
-
     return {
         "ok": True,
         "income": income,
-        "total_coins": player.coins,
+        "total_coins": player.balance,
         "resource": resource_key,
         "resource_qty": resource_qty,
     }
 
 
+async def collect_all(session: AsyncSession, player: Player) -> dict:
+    """Собрать продукцию со всех готовых зданий за один проход.
+
+    Монеты зачисляются одной суммой, ресурсы — одним обращением к
+    инвентарю, коммит один (у вызывающего).
+    Возвращает: {"ok": bool, "error"?: str, "collected": int, "income": int,
+                 "resources": {resource: qty}, "total_coins": int}
+    """
+    now = datetime.utcnow()
+    ready = [b for b in player.buildings if _is_ready(b, now)]
+    collected, income, resources = await _collect_buildings(session, player, ready, now)
+    if not collected:
+        return {"ok": False, "error": "nothing_ready"}
+
+    await credit(session, player, income)
+    await add_resources(session, player.id, resources)
+    player.passive_income = _calc_total_passive_income(player)
+
+    return {
+        "ok": True,
+        "collected": collected,
+        "income": income,
+        "resources": resources,
+        "total_coins": player.balance,
+    }
+
+
+async def start_all(session: AsyncSession, player: Player) -> dict:
+    """Запустить производство во всех простаивающих зданиях.
+
+    Возвращает: {"ok": bool, "error"?: str, "started": int, "max_duration_sec": int}
+    """
+    now = datetime.utcnow()
+    idle = [b for b in player.buildings if not b.is_producing and not b.is_continuous]
+    if not idle:
+        return {"ok": False, "error": "nothing_idle"}
+
+    durations = [_start_building(session, player, b, now) for b in idle]
+    return {"ok": True, "started": len(idle), "max_duration_sec": max(durations)}
+
+
+def _is_ready(building: Building, now: datetime) -> bool:
+    """Есть ли что собрать: готовый цикл таймера или циклы на складе."""
+    if building.is_continuous:
+        return continuous_cycles(building, now)[0] > 0
+    return building.is_producing and (
+        building.production_ends is None or building.production_ends <= now
+    )
+
+
+def _start_building(session: AsyncSession, player: Player, building: Building, now: datetime) -> int:
+    """Перевести здание в производство. Возвращает длительность цикла (сек)."""
+    prod_time = calc_production_time(building.type.value, building.level)
+    building.is_producing = True
+    building.production_started = now
+    building.production_ends = now + timedelta(seconds=prod_time)
+    mark_changed(session, player.tg_id, "buildings")
+    # Уведомление о готовности — в очередь Redis, только после commit
+    on_commit(
+        session, schedule_farm_ready,
+        building.id, player.tg_id, building.type.value, building.production_ends,
+    )
+    return prod_time
+
+
+def _collect_plan(player: Player, building: Building, now: datetime) -> tuple[datetime, int, str | None, int]:
+    """Сбор готовых циклов здания: (новый якорь last_collected, доход, ресурс, количество)."""
+    income = calc_farm_income(building.type.value, building.level, player.archetype.value)
+    resource_key = BUILDING_RESOURCE_MAP.get(building.type.value)
+    resource_qty = max(1, building.level) if resource_key else 0  # Больше ресурсов с уровнем
+
+    if not building.is_continuous:
+        return now, income, resource_key, resource_qty
+
+    # Забрать все готовые циклы; начатый цикл сохраняет прогресс,
+    # при полном складе отсчёт начинается заново
+    cycles, _ = continuous_cycles(building, now)
+    if cycles >= CONTINUOUS_STORAGE_CYCLES:
+        anchor = now
+    else:
+        prod_time = calc_production_time(building.type.value, building.level)
+        anchor = building.last_collected + timedelta(seconds=cycles * prod_time)
+    return anchor, income * cycles, resource_key, resource_qty * cycles
+
+
+async def _collect_buildings(
+    session: AsyncSession,
+    player: Player,
+    buildings: list[Building],
+    now: datetime,
+) -> tuple[int, int, dict[str, int]]:
+    """Сбросить циклы зданий условным UPDATE (db.repositories.building.claim_collect).
+
+    Готовность проверяется в БД, поэтому параллельные сборы одного цикла
+    не оплачиваются дважды. Возвращает (собрано зданий, доход, ресурсы) —
+    зачисляет вызывающий.
+    """
+    plans = {b.id: _collect_plan(player, b, now) for b in buildings}
+    claimed = await claim_collect(session, [(b, plans[b.id][0]) for b in buildings], now) if buildings else []
+
+    income = 0
+    resources: dict[str, int] = {}
+    for building in claimed:
+        _, b_income, resource_key, resource_qty = plans[building.id]
+        income += b_income
+        if resource_key:
+            resources[resource_key] = resources.get(resource_key, 0) + resource_qty
+        if not building.is_continuous:
+            # Собрали раньше, чем ушло уведомление, — оно больше не нужно
+            on_commit(session, cancel_farm_ready, building.id, player.tg_id, building.type.value)
+    if claimed:
+        mark_changed(session, player.tg_id, "buildings")
+    return len(claimed), income, resources
+
+
 async def upgrade_building(
     session: AsyncSession,
     player: Player,
@@ -195,16 +312,23 @@ async def upgrade_building(
     if building.is_producing:
         return {"ok": False, "error": "cant_upgrade_while_producing"}
 
+    now = datetime.utcnow()
+    if building.is_continuous and continuous_cycles(building, now)[0]:
+        return {"ok": False, "error": "collect_first"}
+
     cost = calc_upgrade_cost(building.type.value, building.level)
-    if player.coins < cost:
+    await settle_pending_coins(session, player)
+    if not await debit_if_sufficient(session, player, cost):
         return {"ok": False, "error": "not_enough_coins", "cost": cost}
 
-    player.coins -= cost
     building.level += 1
+    mark_changed(session, player.tg_id, "buildings")
+    if building.is_continuous:
+        # Длительность цикла изменилась — отсчёт с нуля
+        building.last_collected = now
 
     # Пересчёт пассивного дохода
     player.passive_income = _calc_total_passive_income(player)
-    await session.commit()
 
     return {
         "ok": True,
@@ -214,19 +338,47 @@ async def upgrade_building(
     }
 
 
+async def set_continuous(
+    session: AsyncSession,
+    player: Player,
+    building_id: int,
+    enabled: bool,
+) -> dict:
+    """Включить/выключить непрерывный режим здания.
+
+    Включение ставит якорь last_collected = сейчас; дальше циклы
+    считаются при чтении. Выключить можно только с пустым складом.
+    """
+    building = None
+    for b in player.buildings:
+        if b.id == building_id:
+            building = b
+            break
+
+    if not building:
+        return {"ok": False, "error": "building_not_found"}
+
+    if building.is_continuous == enabled:
+        return {"ok": True, "continuous": enabled}
+
+    if building.is_producing:
+        return {"ok": False, "error": "already_producing"}
+
+    now = datetime.utcnow()
+    if enabled:
+        building.last_collected = now
+    elif continuous_cycles(building, now)[0]:
+        return {"ok": False, "error": "collect_first"}
+
+    building.is_continuous = enabled
+    mark_changed(session, player.tg_id, "buildings")
+    return {"ok": True, "continuous": enabled}
+
+
 def _calc_total_passive_income(player: Player) -> int:
     """Пересчитать суммарный пассивный доход всех ферм (монет/мин)."""
-    total = 0
-    for b in player.buildings:
-        info = BUILDINGS.get(b.type.value)
-        if not info:
-            continue
-        income = calc_farm_income(b.type.value, b.level, player.archetype.value)
-        prod_time = calc_production_time(b.type.value, b.level)
-        # Доход в минуту = income / (prod_time / 60)
-        if prod_time > 0:
-            total += int(income / (prod_time / 60))
-    return total
+    archetype = player.archetype.value
+    return sum(farm_rate(b.type, b.level, archetype) for b in player.buildings)
 
 
 def get_building_info(building: Building, archetype: str) -> dict:
@@ -238,7 +390,10 @@ def get_building_info(building: Building, archetype: str) -> dict:
 
     now = datetime.utcnow()
     remaining = 0
-    if building.is_producing and building.production_ends:
+    stored = 0
+    if building.is_continuous:
+        stored, remaining = continuous_cycles(building, now)
+    elif building.is_producing and building.production_ends:
         remaining = max(0, int((building.production_ends - now).total_seconds()))
 
     return {
@@ -251,8 +406,11 @@ def get_building_info(building: Building, archetype: str) -> dict:
         "prod_time_sec": prod_time,
         "upgrade_cost": upgrade_cost,
         "is_producing": building.is_producing,
+        "continuous": building.is_continuous,
+        "stored_cycles": stored,
+        "storage_cap": CONTINUOUS_STORAGE_CYCLES,
         "remaining_sec": remaining,
-        "ready": building.is_producing and remaining == 0,
+        "ready": stored > 0 if building.is_continuous else building.is_producing and remaining == 0,
     }
 
 
@@ -271,7 +429,7 @@ def get_available_buildings(player: Player) -> list[dict]:
             "cost": info["cost"],
             "unlock_level": info["unlock_level"],
             "unlocked": unlocked,
-            "affordable": unlocked and player.coins >= info["cost"],
+            "affordable": unlocked and player.balance >= info["cost"],
             "location": info["location"],
         })
     return result
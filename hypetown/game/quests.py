@@ -1,13 +1,25 @@
-"""Бизнес-логика заказов: генерация, NPC, проверка выполнения."""
+"""Бизнес-логика заказов: генерация, NPC, проверка выполнения.
+
+Функции не коммитят: транзакцией управляет вызывающий (единица работы апдейта).
+"""
 
 import random
 from datetime import datetime, timedelta
 
 from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db.models import Inventory, Order, Player
+from db.database import on_commit
+from db.models import Order, Player
+from db.repositories.inventory import has_resources
+from db.repositories.ledger import sync_player
+from db.repositories.order import complete_order
+from game.economy import sync_level
 from game.constants import ARCHETYPES, NPCS, Resource
+from services.leaderboard import track
+from services.redis_service import publish_event
+from services.state_sync import mark_changed
 
 
 # ── Шаблоны заказов по категориям ─────────────────────────────────────
@@ -131,7 +143,14 @@ async def generate_orders(
         session.add(order)
         new_orders.append(order)
 
-    await session.commit()
+    # flush — чтобы у новых заказов появились id для кнопок
+    await session.flush()
+    if new_orders:
+        on_commit(session, publish_event, player.tg_id, {
+            "t": "order",
+            "order_ids": [o.id for o in new_orders],
+            "status": "new",
+        })
     return new_orders
 
 
@@ -154,9 +173,59 @@ async def check_and_complete_order(
 ) -> dict:
     """Проверить выполнение заказа и выдать награду.
 
+    Закрытие заказа, списание ресурсов и начисление монет/XP — один
+    запрос (db.repositories.order.complete_order) в savepoint: при
+    нехватке ресурсов откатывается всё. Причину отказа выясняем
+    отдельными запросами только на неуспешном пути.
     Возвращает: {"ok": bool, "error"?: str, ...reward_info}
     """
-    # Найти заказ
+    now = datetime.utcnow()
+    # Бонус за быстрое выполнение (в первые 30 мин)
+    bonus_since = now - timedelta(minutes=BONUS_WINDOW_MINUTES)
+
+    row = None
+    try:
+        async with session.begin_nested():
+            row = await complete_order(session, player.id, order_id, now, bonus_since)
+            if row is not None and row.consumed < row.required:
+                # Какого-то ресурса нет в инвентаре вовсе
+                raise _NotEnoughResources
+    except (IntegrityError, _NotEnoughResources):
+        return await _order_failure(session, player, order_id, now)
+
+    if row is None:
+        return await _order_failure(session, player, order_id, now)
+
+    sync_player(player, row.coins, row.level, row.xp)
+    track(session, player, coins_earned=row.reward_coins + row.bonus, xp_earned=row.reward_xp)
+    mark_changed(session, player.tg_id, "player")
+    on_commit(session, publish_event, player.tg_id, {"t": "order", "order_id": order_id, "status": "completed"})
+    levels = await sync_level(session, player)
+
+    return {
+        "ok": True,
+        "coins_earned": row.reward_coins + row.bonus,
+        "xp_earned": row.reward_xp,
+        "got_bonus": row.got_bonus,
+        "bonus_amount": row.bonus,
+        "leveled_up": bool(levels),
+        "new_level": player.level if levels else None,
+        "levels": levels,
+        "npc_name": row.npc_name,
+    }
+
+
+class _NotEnoughResources(Exception):
+    """Внутренний сигнал отката savepoint в check_and_complete_order."""
+
+
+async def _order_failure(
+    session: AsyncSession,
+    player: Player,
+    order_id: int,
+    now: datetime,
+) -> dict:
+    """Диагностика невыполненного заказа: почему complete_order ничего не сделал."""
     result = await session.execute(
         select(Order).where(Order.id == order_id, Order.player_id == player.id)
     )
@@ -164,66 +233,13 @@ async def check_and_complete_order(
 
     if not order:
         return {"ok": False, "error": "order_not_found"}
-
     if order.completed_at:
         return {"ok": False, "error": "already_completed"}
-
-    now = datetime.utcnow()
     if order.expires_at < now:
         return {"ok": False, "error": "expired"}
 
-    # Проверить ресурсы в инвентаре
-    inv_result = await session.execute(
-        select(Inventory).where(Inventory.player_id == player.id)
-    )
-    inventory = {inv.resource.value: inv for inv in inv_result.scalars().all()}
-
-    missing = {}
-    for res_key, qty_needed in order.requirements.items():
-        inv_item = inventory.get(res_key)
-        have = inv_item.quantity if inv_item else 0
-        if have < qty_needed:
-            missing[res_key] = qty_needed - have
-
-    if missing:
-        return {"ok": False, "error": "not_enough_resources", "missing": missing}
-
-    # Списать ресурсы
-    for res_key, qty_needed in order.requirements.items():
-        inventory[res_key].quantity -= qty_needed
-
-    # Начислить награду
-    total_coins = order.reward_coins
-
-    # Бонус за быстрое выполнение (в первые 30 мин)
-    elapsed = (now - order.created_at).total_seconds()
-    got_bonus = elapsed <= BONUS_WINDOW_MINUTES * 60
-    if got_bonus:
-        total_coins += order.bonus_reward_coins
-
-    player.coins += total_coins
-    player.xp += order.reward_xp
-
-    # Проверка левелапа
-    from game.economy import xp_for_level
-    leveled_up = False
-    while player.xp >= xp_for_level(player.level + 1):
-        player.level += 1
-        leveled_up = True
-
-    order.completed_at = now
-    await session.commit()
-
-    return {
-        "ok": True,
-        "coins_earned": total_coins,
-        "xp_earned": order.reward_xp,
-        "got_bonus": got_bonus,
-        "bonus_amount": order.bonus_reward_coins if got_bonus else 0,
-        "leveled_up": leveled_up,
-        "new_level": player.level if leveled_up else None,
-        "npc_name": order.npc_name,
-    }
+    _, missing = await has_resources(session, player.id, order.requirements)
+    return {"ok": False, "error": "not_enough_resources", "missing": missing}
 
 
 def format_requirements(requirements: dict) -> str:
@@ -0,0 +1,70 @@
+"""Тело ответа /api/state: разделы состояния игрока и их сериализация.
+
+Без побочных эффектов при импорте (ни конфига, ни БД, ни Redis): модуль
+используют и эндпоинт TMA API, и бенчмарк benchmarks/state_payload.py.
+"""
+
+from game.constants import ARCHETYPES, BUILDINGS
+
+# Разделы ответа /api/state
+SECTIONS: tuple[str, ...] = ("player", "buildings", "upgrades")
+
+
+def serialize_player(player, pending_coins: int) -> dict:
+    """Раздел player: профиль и баланс с несброшенными тапами."""
+    arch = ARCHETYPES.get(player.archetype.value, {})
+    return {
+        "id": player.id,
+        "tg_id": player.tg_id,
+        "name": player.name,
+        "avatar": player.avatar,
+        "archetype": player.archetype.value,
+        "archetype_emoji": arch.get("emoji", ""),
+        "level": player.level,
+        "xp": player.xp,
+        "coins": player.coins + pending_coins,
+        "stars": player.stars,
+        "tap_power": player.tap_power,
+        "passive_income": player.passive_income,
+        "pvp_rating": player.pvp_rating,
+        "model_url": player.model_url,
+        "ton_wallet": player.ton_wallet,
+    }
+
+
+def serialize_buildings(player) -> list[dict]:
+    """Раздел buildings: здания игрока и состояние производства."""
+    buildings_data = []
+    for b in player.buildings:
+        bld_info = BUILDINGS.get(b.type.value, {})
+        buildings_data.append({
+            "id": b.id,
+            "type": b.type.value,
+            "name": bld_info.get("name", ""),
+            "level": b.level,
+            "is_producing": b.is_producing,
+            "is_continuous": b.is_continuous,
+            "last_collected": b.last_collected.isoformat() if b.last_collected else None,
+            "production_ends": b.production_ends.isoformat() if b.production_ends else None,
+        })
+    return buildings_data
+
+
+def serialize_upgrades(player) -> list[dict]:
+    """Раздел upgrades: уровни апгрейдов кликера."""
+    return [
+        {"type": u.upgrade_type.value, "level": u.level}
+        for u in player.clicker_upgrades
+    ]
+
+
+def build_state(player, sections: list[str], version: int, pending_coins: int = 0) -> dict:
+    """Тело ответа /api/state: версия и запрошенные разделы."""
+    data = {"version": version, "full": len(sections) == len(SECTIONS)}
+    if "player" in sections:
+        data["player"] = serialize_player(player, pending_coins)
+    if "buildings" in sections:
+        data["buildings"] = serialize_buildings(player)
+    if "upgrades" in sections:
+        data["upgrades"] = serialize_upgrades(player)
+    return data
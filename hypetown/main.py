@@ -10,7 +10,10 @@ from aiogram.enums import ParseMode
 
 from config import config
 from db.database import engine
-from db.models import Base
+from game.balance import verify_tables
+from services.leaderboard import boards_missing, rebuild_boards
+from services.notifier import notifier
+from services.realtime import hub
 from services.redis_service import redis_client
 
 from bot.handlers.miniapp import create_webapp
@@ -22,7 +25,12 @@ from bot.handlers.city import router as city_router
 from bot.handlers.orders import router as orders_router
 from bot.middlewares.auth import AuthMiddleware
 from bot.middlewares.antiflood import AntifloodMiddleware
-from services.scheduler import setup_scheduler, shutdown_scheduler
+from services.scheduler import (
+    backfill_farm_jobs,
+    flush_tap_ledger,
+    setup_scheduler,
+    shutdown_scheduler,
+)
 
 # Настройка логирования
 logging.basicConfig(
@@ -33,17 +41,25 @@ logger = logging.getLogger(__name__)
 
 
 async def on_startup(bot: Bot) -> None:
-    """Действия при запуске бота: создание таблиц, проверка Redis."""
-    # Создание таблиц (для первого запуска; в продакшене — через Alembic)
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    logger.info("Таблицы БД готовы")
+    """Действия при запуске бота: проверка таблиц баланса и Redis.
+
+    Схема БД создаётся и обновляется только миграциями (alembic upgrade head).
+    """
+    # Таблицы баланса должны совпадать с эталонными значениями
+    verify_tables()
 
     # Проверка Redis
     await redis_client.ping()
     logger.info("Redis подключён")
 
-    # Планировщик (уведомления о готовности ферм)
+    # Рейтинги: заполнить из БД, если Redis пуст (или всегда — по настройке)
+    if config.leaderboard_rebuild == "always" or (
+        config.leaderboard_rebuild == "auto" and await boards_missing()
+    ):
+        await rebuild_boards()
+
+    # Планировщик (уведомления о готовности ферм, сброс леджера)
+    await backfill_farm_jobs()
     setup_scheduler(bot)
 
     bot_info = await bot.me()
@@ -53,6 +69,11 @@ async def on_startup(bot: Bot) -> None:
 async def on_shutdown(bot: Bot) -> None:
     """Действия при остановке бота."""
     shutdown_scheduler()
+    # Дослать очередь уведомлений, пока сессия бота открыта
+    await notifier.stop()
+    await hub.stop()
+    # Финальный сброс леджера тапов, пока Redis и БД ещё доступны
+    await flush_tap_ledger()
     await redis_client.aclose()
     await engine.dispose()
     logger.info("Бот остановлен, соединения закрыты")
@@ -79,9 +100,12 @@ async def main() -> None:
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
 
-    # Middleware (порядок важен: antiflood → auth)
+    # Middleware (порядок важен: antiflood → auth).
+    # Auth — inner middleware: срабатывает только для найденного хендлера
+    # и видит его флаги (план загрузки игрока).
     dp.update.middleware(AntifloodMiddleware())
-    dp.update.middleware(AuthMiddleware())
+    dp.message.middleware(AuthMiddleware())
+    dp.callback_query.middleware(AuthMiddleware())
 
     # Роутеры хендлеров
     dp.include_router(start_router)
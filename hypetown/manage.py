@@ -0,0 +1,60 @@
+"""Служебные команды HYPETOWN.
+
+    python manage.py rebuild-leaderboards   — перестроить рейтинги Redis из players
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+
+from config import config
+from db.database import engine
+from services.leaderboard import rebuild_boards
+from services.redis_service import redis_client
+
+logger = logging.getLogger("manage")
+
+
+# ── rebuild-leaderboards ──────────────────────────────────────────────
+
+async def rebuild_leaderboards() -> int:
+    """Перестроить рейтинги за всё время и профили из таблицы players."""
+    try:
+        stats = await rebuild_boards()
+    finally:
+        await redis_client.aclose()
+    if stats is None:
+        print("Перестроение уже идёт в другом процессе")
+        return 1
+    print(f"Игроков: {stats['rows']}, {stats['seconds']:.1f} с, {stats['rows_per_sec']:.0f} строк/с")
+    return 0
+
+
+# ── CLI ──────────────────────────────────────────────────────────────
+
+COMMANDS = {
+    "rebuild-leaderboards": rebuild_leaderboards,
+}
+
+
+async def _run(command: str) -> int:
+    try:
+        return await COMMANDS[command]()
+    finally:
+        await engine.dispose()
+
+
+def main() -> None:
+    logging.basicConfig(
+        level=getattr(logging, config.log_level, logging.INFO),
+        format="%(asctime)s | %(levelname)-8s | %(name)s | %(message)s",
+    )
+    parser = argparse.ArgumentParser(description="Служебные команды HYPETOWN")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    args = parser.parse_args()
+    sys.exit(asyncio.run(_run(args.command)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Кодирование ответов TMA API: формат по Accept, сжатие по Accept-Encoding.
+
+По умолчанию — JSON через orjson (в разы быстрее stdlib json). Клиент,
+приславший Accept: application/msgpack, получает MessagePack: меньше
+байт и без разбора текста на главном потоке WebGL. Тела длиннее
+COMPRESS_MIN_BYTES сжимаются brotli или gzip — что клиент принимает;
+маленькие ответы сжатие только удлиняет.
+
+Новый формат — запись в ENCODERS, новое сжатие — в COMPRESSORS.
+"""
+
+import gzip
+from typing import Any, Callable
+
+import brotli
+import msgpack
+import orjson
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+# Тип содержимого → сериализатор
+ENCODERS: dict[str, Callable[[Any], bytes]] = {
+    JSON: orjson.dumps,
+    MSGPACK: msgpack.packb,
+}
+
+# Content-Encoding → компрессор, в порядке предпочтения
+COMPRESSORS: dict[str, Callable[[bytes], bytes]] = {
+    "br": lambda body: brotli.compress(body, quality=4),
+    "gzip": lambda body: gzip.compress(body, compresslevel=5),
+}
+
+# Меньшие тела не сжимаются
+COMPRESS_MIN_BYTES = 1024
+
+
+def _accepted(header: str) -> set[str]:
+    """Значения заголовка Accept* без параметров; с q=0 — отброшены."""
+    values = set()
+    for item in header.split(","):
+        value, *params = (p.strip() for p in item.split(";"))
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if value and q > 0:
+            values.add(value.lower())
+    return values
+
+
+def negotiate_type(accept: str) -> str:
+    """Тип ответа по Accept: MessagePack, если клиент его просит, иначе JSON."""
+    accepted = _accepted(accept)
+    for content_type in ENCODERS:
+        if content_type != JSON and content_type in accepted:
+            return content_type
+    return JSON
+
+
+def negotiate_encoding(accept_encoding: str) -> str | None:
+    """Сжатие по Accept-Encoding (None — без сжатия)."""
+    accepted = _accepted(accept_encoding)
+    for encoding in COMPRESSORS:
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def encode(data: Any, accept: str = "", accept_encoding: str = "") -> tuple[bytes, dict[str, str]]:
+    """Сериализовать и при необходимости сжать. Возвращает (тело, заголовки)."""
+    content_type = negotiate_type(accept)
+    body = ENCODERS[content_type](data)
+    headers = {"Content-Type": content_type, "Vary": "Accept, Accept-Encoding"}
+
+    if len(body) >= COMPRESS_MIN_BYTES:
+        encoding = negotiate_encoding(accept_encoding)
+        if encoding is not None:
+            body = COMPRESSORS[encoding](body)
+            headers["Content-Encoding"] = encoding
+    return body, headers
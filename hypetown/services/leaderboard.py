@@ -0,0 +1,390 @@
+"""Лидерборды: рейтинги по монетам, уровню, доходу, PvP и престижу.
+
+Каждый рейтинг — ZSET tg_id → счёт (ключи см. redis_service.leaderboard_key).
+Рейтинги монет и уровня имеют недельный и сезонный варианты: в них
+копится заработанное за период, а смена периода — атомарный RENAME
+текущего ZSET в архивный. Имена и аватары лежат в HASH профилей, поэтому
+отрисовка рейтинга не ходит в Postgres.
+
+Значения попадают в рейтинги после commit: db.repositories.ledger и
+создание игрока отмечают игрока через track(), а тапы пишут в рейтинги
+монет прямо из скрипта тапа.
+"""
+
+import json
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.database import async_session, on_commit
+from db.models import Player
+from game.constants import LEADERBOARD_PERIODIC, SEASON_MONTHS
+from services.redis_service import (
+    LEADERBOARD_REBUILDING,
+    LEDGER_FLUSHING,
+    LEDGER_PENDING,
+    key,
+    leaderboard_key,
+    leaderboard_rebuild_key,
+    redis_client,
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько хранить архивные рейтинги прошлых периодов
+ARCHIVE_TTL = 180 * 86400
+# Игроков на чанк при перестроении рейтингов из БД
+REBUILD_CHUNK = 5000
+# Защита от параллельного перестроения из нескольких воркеров (сек)
+REBUILD_LOCK_TTL = 3600
+
+PROFILES = key("leaderboard", "profiles")
+
+
+# ── Публикация после commit ──────────────────────────────────────────
+
+# KEYS[1] — профили, KEYS[2], KEYS[3] — леджер тапов (pending, flushing),
+# KEYS[4] — маркер перестроения, KEYS[5] — перестраиваемые профили,
+# KEYS[6..] — рейтинги. ARGV[1] — tg_id, ARGV[2] — профиль (JSON), далее
+# на каждый рейтинг пара (операция, значение): set — ZADD, add — ZINCRBY
+# (если > 0), coins — ZADD значения плюс несброшенных монет из леджера.
+# У рейтингов set / coins два ключа подряд: живой и перестраиваемый —
+# во время перестроения ZADD дублируется в него.
+_PUBLISH_LUA = """
+local rebuilding = redis.call('EXISTS', KEYS[4]) == 1
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+if rebuilding then
+    redis.call('HSET', KEYS[5], ARGV[1], ARGV[2])
+end
+local k = 6
+for i = 3, #ARGV, 2 do
+    local op = ARGV[i]
+    local value = tonumber(ARGV[i + 1])
+    if op == 'add' then
+        if value > 0 then
+            redis.call('ZINCRBY', KEYS[k], value, ARGV[1])
+        end
+        k = k + 1
+    else
+        if op == 'coins' then
+            value = value + (tonumber(redis.call('HGET', KEYS[2], ARGV[1])) or 0)
+                + (tonumber(redis.call('HGET', KEYS[3], ARGV[1])) or 0)
+        end
+        redis.call('ZADD', KEYS[k], value, ARGV[1])
+        if rebuilding then
+            redis.call('ZADD', KEYS[k + 1], value, ARGV[1])
+        end
+        k = k + 2
+    end
+end
+return 1
+"""
+
+_publish_script = redis_client.register_script(_PUBLISH_LUA)
+
+
+def _profile(player: Player) -> str:
+    return json.dumps({"name": player.name, "avatar": player.avatar}, ensure_ascii=False)
+
+
+def _publish_args(player: Player, coins_earned: int, xp_earned: int) -> tuple[list, list]:
+    """Ключи и аргументы скрипта публикации для одного игрока."""
+    boards = [
+        (leaderboard_key("coins"), "coins", player.coins),
+        (leaderboard_key("level"), "set", player.xp),
+        (leaderboard_key("passive_income"), "set", player.passive_income),
+        (leaderboard_key("pvp_rating"), "set", player.pvp_rating),
+        (leaderboard_key("prestige"), "set", player.prestige),
+    ]
+    for period in ("week", "season"):
+        boards.append((leaderboard_key("coins", period), "add", coins_earned))
+        boards.append((leaderboard_key("level", period), "add", xp_earned))
+
+    keys = [
+        PROFILES, LEDGER_PENDING, LEDGER_FLUSHING,
+        LEADERBOARD_REBUILDING, leaderboard_rebuild_key(PROFILES),
+    ]
+    args = [str(player.tg_id), _profile(player)]
+    for board_key, op, value in boards:
+        keys.append(board_key)
+        if op != "add":
+            keys.append(leaderboard_rebuild_key(board_key))
+        args.extend((op, value))
+    return keys, args
+
+
+def track(session: AsyncSession, player: Player, coins_earned: int = 0, xp_earned: int = 0) -> None:
+    """Опубликовать игрока в рейтинги после commit сессии.
+
+    Абсолютные значения (баланс, XP, доход, PvP, престиж) берутся из
+    Player в момент публикации; coins_earned / xp_earned копятся за
+    транзакцию и добавляются в недельные и сезонные рейтинги.
+    """
+    tracked = session.info.get("leaderboard")
+    if tracked is None:
+        tracked = session.info["leaderboard"] = {}
+        on_commit(session, _publish_tracked, session)
+    entry = tracked.setdefault(player.tg_id, [player, 0, 0])
+    entry[1] += coins_earned
+    entry[2] += xp_earned
+
+
+async def _publish_tracked(session: AsyncSession) -> None:
+    tracked = session.info.pop("leaderboard", {})
+    if not tracked:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    for player, coins_earned, xp_earned in tracked.values():
+        keys, args = _publish_args(player, coins_earned, xp_earned)
+        await _publish_script(keys=keys, args=args, client=pipe)
+    await pipe.execute()
+
+
+# ── Чтение ───────────────────────────────────────────────────────────
+
+# KEYS[1] — рейтинг, KEYS[2] — профили. ARGV: tg_id, N, K.
+# Топ-N, ранг игрока, ±K соседей, размер рейтинга и профили — один вызов.
+_BOARD_LUA = """
+local top = redis.call('ZREVRANGE', KEYS[1], 0, tonumber(ARGV[2]) - 1, 'WITHSCORES')
+local rank = redis.call('ZREVRANK', KEYS[1], ARGV[1])
+local around, from = {}, 0
+if rank then
+    from = math.max(0, rank - tonumber(ARGV[3]))
+    around = redis.call('ZREVRANGE', KEYS[1], from, rank + tonumber(ARGV[3]), 'WITHSCORES')
+else
+    rank = -1
+end
+local ids = {}
+for i = 1, #top, 2 do ids[#ids + 1] = top[i] end
+for i = 1, #around, 2 do ids[#ids + 1] = around[i] end
+local profiles = {}
+if #ids > 0 then
+    profiles = redis.call('HMGET', KEYS[2], unpack(ids))
+end
+return {top, rank, from, around, redis.call('ZCARD', KEYS[1]), ids, profiles}
+"""
+
+_board_script = redis_client.register_script(_BOARD_LUA)
+
+
+def _entries(flat: list, first_rank: int, profiles: dict[str, dict]) -> list[dict]:
+    """[member, score, ...] → [{"rank", "tg_id", "score", "name", "avatar"}]."""
+    entries = []
+    for i in range(0, len(flat), 2):
+        member = flat[i]
+        profile = profiles.get(member, {})
+        entries.append({
+            "rank": first_rank + i // 2 + 1,
+            "tg_id": int(member),
+            "score": int(float(flat[i + 1])),
+            "name": profile.get("name", "Игрок"),
+            "avatar": profile.get("avatar", "👤"),
+        })
+    return entries
+
+
+async def get_board(
+    board: str,
+    period: str,
+    tg_id: int,
+    top: int = 10,
+    around: int = 2,
+) -> dict:
+    """Топ-N, место игрока и ±around соседей одним вызовом Redis.
+
+    Возвращает: {"top": [entry], "me": entry | None, "around": [entry],
+                 "total": int}; around — только места за пределами топа.
+    """
+    res = await _board_script(
+        keys=[leaderboard_key(board, period), PROFILES],
+        args=[tg_id, top, around],
+    )
+    top_flat, rank, first, around_flat, total, ids, raw_profiles = res
+    profiles = {
+        member: json.loads(raw)
+        for member, raw in zip(ids, raw_profiles) if raw
+    }
+
+    top_entries = _entries(top_flat, 0, profiles)
+    around_entries = _entries(around_flat, int(first), profiles)
+    me = next((e for e in around_entries if e["tg_id"] == tg_id), None)
+    return {
+        "top": top_entries,
+        "me": me,
+        "around": [e for e in around_entries if e["rank"] > len(top_entries)],
+        "total": int(total),
+    }
+
+
+# ── Смена периода ────────────────────────────────────────────────────
+
+# KEYS[1] — маркер смены (защита от повтора в другом воркере), далее
+# пары (текущий рейтинг, архивный). ARGV: TTL маркера, TTL архива.
+_ROLLOVER_LUA = """
+if not redis.call('SET', KEYS[1], '1', 'NX', 'EX', ARGV[1]) then
+    return 0
+end
+for i = 2, #KEYS, 2 do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call('RENAME', KEYS[i], KEYS[i + 1])
+        redis.call('EXPIRE', KEYS[i + 1], ARGV[2])
+    end
+end
+return 1
+"""
+
+_rollover_script = redis_client.register_script(_ROLLOVER_LUA)
+
+
+def period_label(period: str, moment: datetime) -> str:
+    """Метка периода, в который попадает moment: 2026-W42 / 2026-S4."""
+    if period == "week":
+        year, week, _ = moment.isocalendar()
+        return f"{year}-W{week:02d}"
+    return f"{moment.year}-S{(moment.month - 1) // SEASON_MONTHS + 1}"
+
+
+async def rollover(period: str, label: str) -> bool:
+    """Закрыть период: рейтинги period уходят в архив с меткой label.
+
+    Все рейтинги переименовываются одним скриптом, так что начисления
+    после смены попадают уже в новый период. False — период label уже
+    закрыт (например, другим воркером).
+    """
+    keys = [key("leaderboard", "rollover", period, label)]
+    for board in LEADERBOARD_PERIODIC:
+        current = leaderboard_key(board, period)
+        keys.extend((current, f"{current}:{label}"))
+    done = bool(await _rollover_script(keys=keys, args=[ARCHIVE_TTL, ARCHIVE_TTL]))
+    if done:
+        logger.info("Рейтинги закрыты: %s %s", period, label)
+    return done
+
+
+# ── Перестроение из БД ───────────────────────────────────────────────
+#
+# Рейтинги за всё время и профили строятся заново из players: чанки по
+# keyset (id > последний id) → пайплайн ZADD / HSET во временные ключи →
+# все ключи подменяются одним скриптом RENAME. В памяти — один чанк.
+# Недельные и сезонные рейтинги из БД не восстановить (истории
+# начислений нет) — они не трогаются.
+#
+# Тапы и публикации не останавливаются: пока стоит маркер
+# LEADERBOARD_REBUILDING, они пишут и во временные ключи. Чанк ставит
+# баланс = БД + несброшенные монеты одним скриптом, поэтому тап до него
+# уже в леджере, а тап после — ZINCRBY поверх; подмена ничего не теряет.
+
+# Рейтинг → колонка players со счётом
+REBUILD_COLUMNS = {
+    "coins": Player.coins,
+    "level": Player.xp,
+    "passive_income": Player.passive_income,
+    "pvp_rating": Player.pvp_rating,
+    "prestige": Player.prestige,
+}
+
+REBUILD_LOCK = key("leaderboard", "rebuild", "lock")
+
+# KEYS[1], KEYS[2] — леджер тапов (pending, flushing), KEYS[3] — новый
+# рейтинг монет. ARGV — пары (tg_id, монеты в БД).
+_REBUILD_COINS_LUA = """
+for i = 1, #ARGV, 2 do
+    local value = tonumber(ARGV[i + 1])
+        + (tonumber(redis.call('HGET', KEYS[1], ARGV[i])) or 0)
+        + (tonumber(redis.call('HGET', KEYS[2], ARGV[i])) or 0)
+    redis.call('ZADD', KEYS[3], value, ARGV[i])
+end
+return 1
+"""
+
+# KEYS[1] — маркер перестроения, далее пары (живой ключ, перестроенный).
+# Перестроенного нет (в players пусто) — живой удаляется.
+_REBUILD_SWAP_LUA = """
+for i = 2, #KEYS, 2 do
+    if redis.call('EXISTS', KEYS[i + 1]) == 1 then
+        redis.call('RENAME', KEYS[i + 1], KEYS[i])
+    else
+        redis.call('DEL', KEYS[i])
+    end
+end
+redis.call('DEL', KEYS[1])
+return 1
+"""
+
+_rebuild_coins_script = redis_client.register_script(_REBUILD_COINS_LUA)
+_rebuild_swap_script = redis_client.register_script(_REBUILD_SWAP_LUA)
+
+
+async def boards_missing() -> bool:
+    """Рейтингов в Redis нет (первый запуск или Redis очищен)."""
+    return not await redis_client.exists(PROFILES)
+
+
+async def rebuild_boards(chunk: int = REBUILD_CHUNK) -> dict | None:
+    """Перестроить рейтинги за всё время и профили из players.
+
+    Возвращает {"rows", "seconds", "rows_per_sec"} или None, если
+    перестроение уже идёт в другом процессе.
+    """
+    if not await redis_client.set(REBUILD_LOCK, "1", nx=True, ex=REBUILD_LOCK_TTL):
+        logger.warning("Перестроение рейтингов уже идёт")
+        return None
+
+    live = [PROFILES] + [leaderboard_key(board) for board in REBUILD_COLUMNS]
+    try:
+        await redis_client.delete(*(leaderboard_rebuild_key(k) for k in live))
+        await redis_client.set(LEADERBOARD_REBUILDING, "1", ex=REBUILD_LOCK_TTL)
+        started = time.monotonic()
+        rows, last_id = 0, 0
+        stmt = select(Player.id, Player.tg_id, Player.name, Player.avatar, *REBUILD_COLUMNS.values())
+
+        while True:
+            async with async_session() as session:
+                batch = (await session.execute(
+                    stmt.where(Player.id > last_id).order_by(Player.id).limit(chunk)
+                )).all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+            rows += len(batch)
+
+            members = [str(r.tg_id) for r in batch]
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.hset(leaderboard_rebuild_key(PROFILES), mapping={
+                m: json.dumps({"name": r.name, "avatar": r.avatar}, ensure_ascii=False)
+                for m, r in zip(members, batch)
+            })
+            for board, column in REBUILD_COLUMNS.items():
+                board_key = leaderboard_rebuild_key(leaderboard_key(board))
+                if board == "coins":
+                    # Баланс для рейтинга учитывает несброшенные тапы
+                    await _rebuild_coins_script(
+                        keys=[LEDGER_PENDING, LEDGER_FLUSHING, board_key],
+                        args=[v for m, r in zip(members, batch) for v in (m, r.coins)],
+                        client=pipe,
+                    )
+                else:
+                    pipe.zadd(board_key, {m: getattr(r, column.key) for m, r in zip(members, batch)})
+            await pipe.execute()
+
+            elapsed = time.monotonic() - started
+            logger.info("Рейтинги: %d игроков, %.0f строк/с", rows, rows / elapsed if elapsed else 0)
+
+        # Подмена всех ключей и снятие маркера разом
+        keys = [LEADERBOARD_REBUILDING]
+        for k in live:
+            keys.extend((k, leaderboard_rebuild_key(k)))
+        await _rebuild_swap_script(keys=keys)
+    finally:
+        await redis_client.delete(REBUILD_LOCK, LEADERBOARD_REBUILDING)
+
+    elapsed = time.monotonic() - started
+    stats = {"rows": rows, "seconds": elapsed, "rows_per_sec": rows / elapsed if elapsed else 0.0}
+    logger.info(
+        "Рейтинги перестроены: %d игроков за %.1f с (%.0f строк/с)",
+        stats["rows"], stats["seconds"], stats["rows_per_sec"],
+    )
+    return stats
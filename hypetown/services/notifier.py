@@ -0,0 +1,221 @@
+"""Диспетчер уведомлений: дайджесты по игрокам, общий лимит отправки, метрики.
+
+Telegram допускает около 30 сообщений в секунду на бота и около одного в
+секунду в один чат. Notifier копит уведомления по (чат, тема): всё, что
+пришло в чат до отправки, уходит одним сообщением-дайджестом. Отправку
+ведут несколько воркеров параллельно под общим token bucket; 429
+(TelegramRetryAfter) приостанавливает всех воркеров на retry_after.
+
+Очередь живёт в памяти процесса. Устойчивость даёт источник: строка
+может нести ref задачи, и после попытки отправки дайджеста его refs
+подтверждаются обработчиком темы (DELIVERY_ACKS). Неподтверждённое при
+падении процесса источник вернёт в очередь сам (аренда задач ферм в
+services.redis_service).
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+from config import config
+from services.redis_service import ack_farm_jobs
+
+logger = logging.getLogger(__name__)
+
+# Параллельных отправок
+NOTIFY_WORKERS = 8
+# Повторов одной отправки после 429
+NOTIFY_MAX_RETRIES = 3
+# Сколько последних задержек хранить для метрик
+LATENCY_WINDOW = 1000
+
+
+# ── Дайджесты ────────────────────────────────────────────────────────
+
+def render_farm_ready(lines: list[str]) -> str:
+    """Дайджест готовых ферм игрока."""
+    if len(lines) == 1:
+        return f"📦 {lines[0]} завершило производство!\nЗайди собрать продукцию 💰"
+    body = "\n".join(f"• {line}" for line in lines)
+    return f"📦 <b>Производство завершено:</b>\n{body}\n\nЗайди собрать продукцию 💰"
+
+
+# Тема → сборка текста дайджеста из строк
+DIGEST_RENDERERS: dict[str, Callable[[list[str]], str]] = {
+    "farm_ready": render_farm_ready,
+}
+
+# Тема → подтверждение refs строк дайджеста после попытки отправки
+DELIVERY_ACKS: dict[str, Callable[[list[str]], Awaitable[None]]] = {
+    "farm_ready": ack_farm_jobs,
+}
+
+
+class Notifier:
+    """Очередь уведомлений с объединением по чату и ограничением темпа."""
+
+    def __init__(self, rate: float, chat_interval: float, workers: int = NOTIFY_WORKERS):
+        self.rate = rate
+        self.chat_interval = chat_interval
+        self.workers = workers
+        self._bot: Bot | None = None
+        self._queue: asyncio.Queue[tuple[int, str]] = asyncio.Queue()
+        # (chat_id, тема) → (строки дайджеста, refs для подтверждения, время первой постановки)
+        self._pending: dict[tuple[int, str], tuple[list[str], list[str], float]] = {}
+        self._chat_last_sent: dict[int, float] = {}
+        self._tasks: list[asyncio.Task] = []
+        # Глобальный token bucket
+        self._tokens = rate
+        self._tokens_ts = time.monotonic()
+        self._paused_until = 0.0
+        self._bucket_lock = asyncio.Lock()
+        # Метрики
+        self.sent = 0
+        self.failed = 0
+        self._latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    # ── Жизненный цикл ──
+
+    def start(self, bot: Bot) -> None:
+        """Запустить воркеры отправки."""
+        self._bot = bot
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info("Notifier запущен: %d воркеров, %.0f сообщ/с", self.workers, self.rate)
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """Дослать очередь (не дольше timeout) и остановить воркеры."""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Notifier остановлен, не отправлено: %d", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ── Постановка ──
+
+    def enqueue(self, chat_id: int, topic: str, line: str, ref: str | None = None) -> None:
+        """Добавить строку в дайджест чата; новый дайджест встаёт в очередь.
+
+        ref подтверждается через DELIVERY_ACKS[topic] после попытки отправки.
+        """
+        k = (chat_id, topic)
+        entry = self._pending.get(k)
+        if entry is None:
+            entry = self._pending[k] = ([], [], time.monotonic())
+            self._queue.put_nowait(k)
+        entry[0].append(line)
+        if ref is not None:
+            entry[1].append(ref)
+
+    # ── Отправка ──
+
+    async def _worker(self) -> None:
+        while True:
+            k = await self._queue.get()
+            try:
+                await self._deliver(k)
+            except Exception:
+                logger.exception("Ошибка отправки уведомления chat_id=%d", k[0])
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, k: tuple[int, str]) -> None:
+        chat_id, topic = k
+        # Лимит на чат: пока ждём, в дайджест дописываются новые строки
+        wait = self._chat_last_sent.get(chat_id, 0.0) + self.chat_interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        lines, refs, enqueued_at = self._pending.pop(k)
+        # Любой исход попытки снимает задачи (иначе постоянная ошибка чата
+        # повторялась бы бесконечно), кроме остановки посреди отправки:
+        # тогда аренда истечёт и источник вернёт их в очередь
+        try:
+            await self._send(chat_id, DIGEST_RENDERERS[topic](lines), enqueued_at)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await self._ack(topic, refs)
+            raise
+        await self._ack(topic, refs)
+
+    @staticmethod
+    async def _ack(topic: str, refs: list[str]) -> None:
+        if refs:
+            await DELIVERY_ACKS[topic](refs)
+
+    async def _send(self, chat_id: int, text: str, enqueued_at: float) -> None:
+        for _ in range(NOTIFY_MAX_RETRIES + 1):
+            await self._acquire()
+            try:
+                await self._bot.send_message(chat_id, text)
+            except TelegramRetryAfter as e:
+                # Флуд-лимит — пауза для всех воркеров
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                logger.warning("429 от Telegram, пауза %.1f с", e.retry_after)
+                continue
+            except TelegramForbiddenError:
+                # Игрок заблокировал бота — не повторяем
+                self.failed += 1
+                return
+            self._chat_last_sent[chat_id] = time.monotonic()
+            self._latencies.append(time.monotonic() - enqueued_at)
+            self.sent += 1
+            return
+
+        self.failed += 1
+        logger.error("Уведомление chat_id=%d не отправлено после %d повторов", chat_id, NOTIFY_MAX_RETRIES)
+
+    async def _acquire(self) -> None:
+        """Взять токен из общего ведра (rate сообщений в секунду)."""
+        async with self._bucket_lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.rate, self._tokens + (now - self._tokens_ts) * self.rate)
+                self._tokens_ts = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    # ── Метрики ──
+
+    def stats(self) -> dict:
+        """Глубина очереди, счётчики и задержка постановка → отправка (сек)."""
+        lat = sorted(self._latencies)
+        return {
+            "queue_depth": self._queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "latency_avg": sum(lat) / len(lat) if lat else 0.0,
+            "latency_p95": lat[int(len(lat) * 0.95) - 1] if lat else 0.0,
+            "latency_max": lat[-1] if lat else 0.0,
+        }
+
+    def log_stats(self) -> None:
+        """Записать метрики в лог (периодическая задача планировщика)."""
+        # Лимит на чат нужен только для недавних отправок
+        cutoff = time.monotonic() - self.chat_interval
+        self._chat_last_sent = {c: t for c, t in self._chat_last_sent.items() if t > cutoff}
+
+        s = self.stats()
+        if not s["sent"] and not s["queue_depth"]:
+            return
+        logger.info(
+            "Notifier: очередь=%d отправлено=%d ошибок=%d задержка avg=%.2fс p95=%.2fс max=%.2fс",
+            s["queue_depth"], s["sent"], s["failed"],
+            s["latency_avg"], s["latency_p95"], s["latency_max"],
+        )
+
+
+notifier = Notifier(rate=config.notify_rate, chat_interval=config.notify_chat_interval)
@@ -0,0 +1,58 @@
+"""Лимитер запросов: GCRA в Redis за локальным предфильтром воркера.
+
+Глобальный лимит на игрока считает скрипт GCRA в Redis (один ключ —
+одно целое, один вызов). Перед ним каждый воркер держит такой же GCRA
+в памяти: воркер видит только часть запросов игрока, поэтому локальный
+отказ всегда означает и отказ в Redis. Флуд отсекается без похода в
+Redis, а после отказа Redis воркер помнит «повтори через» и до этого
+момента отвечает отказом сам.
+"""
+
+import time
+from collections import OrderedDict
+
+from game.constants import RATE_LIMITS
+from services.redis_service import check_rate_limit
+
+
+class RateLimiter:
+    """Лимиты по действиям (RATE_LIMITS) для субъекта: tg_id или IP."""
+
+    def __init__(self, limits: dict[str, tuple[float, int]], max_entries: int = 100_000):
+        # Действие → (interval, tolerance) в мс
+        self.limits = {
+            action: (int(1000 / rate), int(1000 / rate * (burst - 1)))
+            for action, (rate, burst) in limits.items()
+        }
+        self.max_entries = max_entries
+        # (действие, субъект) → локальный TAT (мс, time.monotonic)
+        self._tat: OrderedDict[tuple[str, str], float] = OrderedDict()
+
+    async def hit(self, action: str, subject: int | str) -> float:
+        """Учесть запрос. 0 — разрешён, иначе секунд до следующей попытки."""
+        interval, tolerance = self.limits[action]
+        k = (action, str(subject))
+        now = time.monotonic() * 1000
+
+        # Локальная проверка: без Redis
+        tat = max(self._tat.get(k, now), now)
+        if tat - tolerance > now:
+            return (tat - tolerance - now) / 1000
+        self._remember(k, tat + interval)
+
+        retry_ms = await check_rate_limit(action, k[1], interval, tolerance)
+        if retry_ms:
+            # Отказ Redis: до now + retry_ms отвечаем отказом локально
+            self._remember(k, now + retry_ms + tolerance)
+            return retry_ms / 1000
+        return 0.0
+
+    def _remember(self, k: tuple[str, str], tat: float) -> None:
+        self._tat[k] = tat
+        self._tat.move_to_end(k)
+        # Вытесняем самые давние: у давно молчащих субъектов TAT уже в прошлом
+        while len(self._tat) > self.max_entries:
+            self._tat.popitem(last=False)
+
+
+limiter = RateLimiter(RATE_LIMITS)
@@ -0,0 +1,86 @@
+"""Доставка push-событий в WebSocket-соединения Mini App.
+
+Каждый воркер держит одно pub/sub-подключение к Redis и подписывает его
+на каналы игроков (redis_service.player_channel), чьи /ws открыты в этом
+воркере. Читающая задача раскладывает события по очередям соединений.
+Публикуют события redis_service.publish_event(s) и скрипт версий
+состояния — из любого процесса.
+"""
+
+import asyncio
+import json
+import logging
+
+from services.redis_service import player_channel, redis_client
+
+logger = logging.getLogger(__name__)
+
+# Событий в очереди одного соединения; медленный клиент теряет старые
+CONNECTION_QUEUE_SIZE = 100
+
+
+class EventHub:
+    """Подписки воркера: tg_id → очереди открытых соединений игрока."""
+
+    def __init__(self):
+        self._pubsub = None
+        self._reader: asyncio.Task | None = None
+        self._queues: dict[int, set[asyncio.Queue]] = {}
+        self._lock = asyncio.Lock()
+
+    async def connect(self, tg_id: int) -> asyncio.Queue:
+        """Подписать соединение игрока на его события."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=CONNECTION_QUEUE_SIZE)
+        async with self._lock:
+            queues = self._queues.setdefault(tg_id, set())
+            queues.add(queue)
+            if len(queues) == 1:
+                if self._pubsub is None:
+                    self._pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                await self._pubsub.subscribe(player_channel(tg_id))
+            if self._reader is None:
+                self._reader = asyncio.create_task(self._read())
+        return queue
+
+    async def disconnect(self, tg_id: int, queue: asyncio.Queue) -> None:
+        """Отписать соединение; канал — когда закрыто последнее соединение игрока."""
+        async with self._lock:
+            queues = self._queues.get(tg_id)
+            if queues is None:
+                return
+            queues.discard(queue)
+            if not queues:
+                del self._queues[tg_id]
+                await self._pubsub.unsubscribe(player_channel(tg_id))
+
+    async def stop(self) -> None:
+        """Остановить чтение и закрыть pub/sub-подключение."""
+        if self._reader is not None:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+            self._reader = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    async def _read(self) -> None:
+        while True:
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка чтения pub/sub")
+                await asyncio.sleep(1.0)
+                continue
+            if message is None or message["type"] != "message":
+                continue
+            tg_id = int(message["channel"].rsplit(":", 1)[1])
+            event = json.loads(message["data"])
+            for queue in self._queues.get(tg_id, ()):
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(event)
+
+
+hub = EventHub()
@@ -1,6 +1,11 @@
 """Redis-сервис: подключение, кэш, лидерборды, батчинг кликов."""
 
+import json
+import math
 import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
 
 import redis.asyncio as redis
 
@@ -20,76 +25,670 @@ def key(*parts: str) -> str:
     return f"{NAMESPACE}:{':'.join(parts)}"
 
 
-# ── Батчинг кликов ───────────────────────────────────────────────────
+# ── Write-behind леджер тапов ────────────────────────────────────────
+#
+# Заработок с тапов копится в Redis (источник истины для несброшенных
+# монет) и периодически одним UPDATE переносится в players.coins
+# (services.scheduler.flush_tap_ledger).
+#
+#   ledger:pending  — HASH tg_id → монеты, ещё не попавшие в БД
+#   ledger:flushing — HASH батча, который сейчас пишется в БД; переживает
+#                     падение между RENAME и commit и повторяется на след. тике
+#   ledger:batch    — id батча из ledger:flushing; записывается в БД той же
+#                     транзакцией, что и монеты (ledger_flushes), поэтому
+#                     повтор уже применённого батча ничего не зачисляет
+#   ledger:lock     — токен воркера, который сейчас сбрасывает батч
+#   ledger:settling — HASH id переноса → "tg_id:монеты:время": монеты,
+#                     забранные из pending в открытую транзакцию
+#                     (game.clicker.settle_pending_coins); после commit
+#                     запись удаляется, при откате монеты возвращаются
+#                     в pending. id переноса пишется в ledger_flushes той
+#                     же транзакцией — по нему записи, брошенные упавшим
+#                     воркером, разбирает recover_settled_coins
+#
+# Сброс — «хотя бы один раз»: батч повторяется, если упал finish после
+# commit или блокировка истекла во время долгого commit. Дубли отсекает
+# id батча в БД, а не блокировка.
+#
+# Несброшенные монеты игрока — pending + flushing: пока батч пишется (или
+# ждёт повтора после неудачи), его монет ещё нет в players.coins. Между
+# commit батча и finish_ledger_flush он учитывается дважды — это окно
+# только для отображения: списать можно лишь pending (reserve_pending_coins).
 
-async def add_pending_taps(tg_id: int, count: int) -> int:
-    """Накопить тапы в Redis. Возвращает общее число pending."""
-    k = key("clicker", str(tg_id))
-    total = await redis_client.incrby(k, count)
-    await redis_client.expire(k, 30)  # TTL 30 сек
-    return total
+LEDGER_PENDING = key("ledger", "pending")
+LEDGER_FLUSHING = key("ledger", "flushing")
+LEDGER_BATCH = key("ledger", "batch")
+LEDGER_LOCK = key("ledger", "lock")
+LEDGER_LOCK_TTL = 30
+LEDGER_SETTLING = key("ledger", "settling")
+# Через сколько секунд незавершённый перенос считается брошенным:
+# с запасом больше любой транзакции апдейта
+LEDGER_SETTLE_GRACE = 600
 
+# Несброшенные монеты игроков ARGV: pending + flushing по каждому
+_UNFLUSHED_LUA = """
+local result = {}
+for i, member in ipairs(ARGV) do
+    result[i] = (tonumber(redis.call('HGET', KEYS[1], member)) or 0)
+        + (tonumber(redis.call('HGET', KEYS[2], member)) or 0)
+end
+return result
+"""
 
-async def flush_pending_taps(tg_id: int) -> int:
-    """Забрать и обнулить накопленные тапы. Возвращает количество."""
-    k = key("clicker", str(tg_id))
+# Перенести монеты игрока ARGV[1] из pending в ledger:settling под id
+# ARGV[2] (время ARGV[3]). Возвращает перенесённую сумму.
+_RESERVE_PENDING_LUA = """
+local v = redis.call('HGET', KEYS[1], ARGV[1])
+if not v then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+if tonumber(v) ~= 0 then
+    redis.call('HSET', KEYS[2], ARGV[2], ARGV[1] .. ':' .. v .. ':' .. ARGV[3])
+end
+return v
+"""
+
+# Вернуть в pending переносы ARGV (транзакция откатилась). Возвращает их число.
+_RETURN_SETTLED_LUA = """
+local n = 0
+for _, id in ipairs(ARGV) do
+    local entry = redis.call('HGET', KEYS[2], id)
+    if entry then
+        local tg_id, amount = string.match(entry, '^(%-?%d+):(%-?%d+):')
+        redis.call('HINCRBY', KEYS[1], tg_id, amount)
+        redis.call('HDEL', KEYS[2], id)
+        n = n + 1
+    end
+end
+return n
+"""
+
+# Захватить батч для сброса: pending → flushing с новым id (или повторить
+# старый flushing с его id). ARGV: TTL блокировки, токен воркера, id нового батча.
+# Возвращает {id батча, tg_id, монеты, ...}.
+_BEGIN_FLUSH_LUA = """
+if not redis.call('SET', KEYS[4], ARGV[2], 'NX', 'EX', ARGV[1]) then
+    return false
+end
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        redis.call('DEL', KEYS[4])
+        return {}
+    end
+    redis.call('RENAME', KEYS[1], KEYS[2])
+    redis.call('DEL', KEYS[3])
+end
+local batch = redis.call('GET', KEYS[3])
+if not batch then
+    batch = ARGV[3]
+    redis.call('SET', KEYS[3], batch)
+end
+local result = redis.call('HGETALL', KEYS[2])
+table.insert(result, 1, batch)
+return result
+"""
+
+# Удалить ключи KEYS[2..], только если блокировка KEYS[1] всё ещё наша (ARGV[1])
+_RELEASE_FLUSH_LUA = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+return redis.call('DEL', unpack(KEYS))
+"""
+
+_unflushed_script = redis_client.register_script(_UNFLUSHED_LUA)
+_reserve_pending_script = redis_client.register_script(_RESERVE_PENDING_LUA)
+_return_settled_script = redis_client.register_script(_RETURN_SETTLED_LUA)
+_begin_flush_script = redis_client.register_script(_BEGIN_FLUSH_LUA)
+_release_flush_script = redis_client.register_script(_RELEASE_FLUSH_LUA)
+
+
+async def get_pending_coins(tg_id: int) -> int:
+    """Несброшенные монеты игрока (добавляются к players.coins при чтении)."""
+    return (await get_pending_coins_many([tg_id]))[0]
+
+
+async def get_pending_coins_many(tg_ids: list[int]) -> list[int]:
+    """Несброшенные монеты игроков — в порядке tg_ids, одним вызовом."""
+    res = await _unflushed_script(
+        keys=[LEDGER_PENDING, LEDGER_FLUSHING],
+        args=[str(tg_id) for tg_id in tg_ids],
+    )
+    return [int(v) for v in res]
+
+
+async def reserve_pending_coins(tg_id: int, settle_id: str) -> int:
+    """Забрать несброшенные монеты игрока под id переноса settle_id.
+
+    Монеты остаются в Redis (ledger:settling), пока вызывающий не
+    подтвердит перенос (release_settled_coins) или не вернёт его
+    (return_settled_coins). Возвращает сумму.
+    """
+    return int(await _reserve_pending_script(
+        keys=[LEDGER_PENDING, LEDGER_SETTLING],
+        args=[str(tg_id), settle_id, int(time.time())],
+    ))
+
+
+async def release_settled_coins(settle_ids: list[str]) -> None:
+    """Переносы закоммичены в БД — удалить их записи."""
+    await redis_client.hdel(LEDGER_SETTLING, *settle_ids)
+
+
+async def return_settled_coins(settle_ids: list[str]) -> int:
+    """Переносы откатились — вернуть их монеты в pending. Возвращает число возвращённых."""
+    return int(await _return_settled_script(
+        keys=[LEDGER_PENDING, LEDGER_SETTLING],
+        args=settle_ids,
+    ))
+
+
+async def get_stale_settled_coins(older_than: int = LEDGER_SETTLE_GRACE) -> list[str]:
+    """id переносов, не завершённых дольше older_than секунд."""
+    cutoff = time.time() - older_than
+    entries = await redis_client.hgetall(LEDGER_SETTLING)
+    return [
+        settle_id for settle_id, entry in entries.items()
+        if int(entry.rsplit(":", 1)[1]) < cutoff
+    ]
+
+
+@dataclass(frozen=True)
+class LedgerBatch:
+    """Захваченный батч леджера."""
+
+    batch_id: str              # id для защиты от повторного применения в БД
+    token: str                 # токен блокировки воркера
+    deltas: dict[int, int]     # tg_id → монеты
+
+
+async def begin_ledger_flush() -> LedgerBatch | None:
+    """Захватить батч леджера для записи в БД.
+
+    Возвращает батч (deltas пустой — сбрасывать нечего) или None, если
+    сброс уже выполняет другой воркер. Повторно захваченный батч
+    сохраняет свой batch_id.
+    """
+    token = uuid.uuid4().hex
+    raw = await _begin_flush_script(
+        keys=[LEDGER_PENDING, LEDGER_FLUSHING, LEDGER_BATCH, LEDGER_LOCK],
+        args=[LEDGER_LOCK_TTL, token, uuid.uuid4().hex],
+    )
+    if raw is None:
+        return None
+    if not raw:
+        return LedgerBatch("", token, {})
+    batch_id, pairs = raw[0], raw[1:]
+    deltas = {int(pairs[i]): int(pairs[i + 1]) for i in range(0, len(pairs), 2)}
+    return LedgerBatch(batch_id, token, deltas)
+
+
+async def finish_ledger_flush(batch: LedgerBatch) -> bool:
+    """Батч записан в БД — удалить его и снять блокировку.
+
+    Только пока блокировка наша: если она истекла и батч перехватил
+    другой воркер, его ключи не трогаем. Возвращает, удалён ли батч.
+    """
+    return bool(await _release_flush_script(
+        keys=[LEDGER_LOCK, LEDGER_FLUSHING, LEDGER_BATCH],
+        args=[batch.token],
+    ))
+
+
+async def abort_ledger_flush(batch: LedgerBatch) -> None:
+    """Запись батча не удалась — снять свою блокировку, батч повторится на след. тике."""
+    await _release_flush_script(keys=[LEDGER_LOCK], args=[batch.token])
+
+
+# ── Атомарный тап ────────────────────────────────────────────────────
+#
+# Один вызов скрипта = один RTT на тап: лимит тапов (token bucket),
+# начисление в леджер по кэшированной силе тапа, рейтинги монет (за всё
+# время — баланс, недельный и сезонный — заработок за период), версия
+# раздела player в state:<tg_id>.
+#
+#   tap:<tg_id> — HASH {tap_power, tokens, ts}: кэш силы тапа + ведро лимита
+
+TAP_STATE_TTL_MS = 3_600_000
+
+_TAP_LUA = """
+local st = redis.call('HMGET', KEYS[2], 'tap_power', 'tokens', 'ts')
+local tp = tonumber(st[1])
+local score = redis.call('ZSCORE', KEYS[3], ARGV[1])
+if not tp or not score then
+    -- Промах кэша: без значений из БД (ARGV[6], ARGV[7]) тапы не применить
+    if tonumber(ARGV[6]) <= 0 then
+        return {-1, 0, 0, '0', 0}
+    end
+    if not tp then
+        tp = tonumber(ARGV[6])
+        redis.call('HSET', KEYS[2], 'tap_power', tp)
+    end
+end
+
+local now = tonumber(ARGV[3])
+local rate = tonumber(ARGV[4])
+local burst = tonumber(ARGV[5])
+local tokens = tonumber(st[2]) or burst
+local ts = tonumber(st[3]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+
+local taps = math.max(0, math.min(tonumber(ARGV[2]), math.floor(tokens)))
+redis.call('HSET', KEYS[2], 'tokens', tokens - taps, 'ts', now)
+redis.call('PEXPIRE', KEYS[2], ARGV[8])
+
+local earned = taps * tp
+local pending = redis.call('HINCRBY', KEYS[1], ARGV[1], earned)
+    + (tonumber(redis.call('HGET', KEYS[7], ARGV[1])) or 0)
+
+if score then
+    score = redis.call('ZINCRBY', KEYS[3], earned, ARGV[1])
+else
+    score = tonumber(ARGV[7]) + pending
+    redis.call('ZADD', KEYS[3], score, ARGV[1])
+end
+if earned > 0 then
+    if redis.call('EXISTS', KEYS[8]) == 1 then
+        -- Идёт перестроение рейтингов: начисление попадёт и в новый рейтинг
+        redis.call('ZINCRBY', KEYS[9], earned, ARGV[1])
+    end
+    redis.call('ZINCRBY', KEYS[4], earned, ARGV[1])
+    redis.call('ZINCRBY', KEYS[5], earned, ARGV[1])
+    if redis.call('HEXISTS', KEYS[6], 'v') == 1 then
+        redis.call('HSET', KEYS[6], 'player', redis.call('HINCRBY', KEYS[6], 'v', 1))
+    end
+end
+return {taps, earned, pending, tostring(score), tp}
+"""
+
+_tap_script = redis_client.register_script(_TAP_LUA)
+
+
+async def apply_taps(
+    tg_id: int,
+    taps: int,
+    rate: float,
+    burst: int,
+    fallback_tap_power: int = 0,
+    base_coins: int = 0,
+) -> dict | None:
+    """Атомарно применить тапы одним вызовом Redis.
+
+    Отрезает тапы сверх лимита (rate тапов/сек, ведро на burst), начисляет
+    taps * tap_power в леджер и двигает счёт в рейтингах монет.
+    Сила тапа берётся из кэша; при промахе — fallback_tap_power (и кэшируется),
+    base_coins — монеты в БД для первичного счёта в лидерборде.
+
+    Возвращает {"taps", "earned", "pending", "score", "tap_power"}
+    (pending — все несброшенные монеты, см. get_pending_coins; score —
+    баланс в рейтинге монет) или None, если в кэше нет силы тапа или
+    счёта игрока, а fallback не передан (вызывающий должен загрузить игрока).
+    """
+    res = await _tap_script(
+        keys=[
+            LEDGER_PENDING, key("tap", str(tg_id)), leaderboard_key("coins"),
+            leaderboard_key("coins", "week"), leaderboard_key("coins", "season"),
+            state_key(tg_id), LEDGER_FLUSHING,
+            LEADERBOARD_REBUILDING, leaderboard_rebuild_key(leaderboard_key("coins")),
+        ],
+        args=[
+            str(tg_id), taps, int(time.time() * 1000), rate, burst,
+            fallback_tap_power, base_coins, TAP_STATE_TTL_MS,
+        ],
+    )
+    if int(res[0]) < 0:
+        return None
+    return {
+        "taps": int(res[0]),
+        "earned": int(res[1]),
+        "pending": int(res[2]),
+        "score": float(res[3]),
+        "tap_power": int(res[4]),
+    }
+
+
+async def set_cached_tap_power(tg_id: int, tap_power: int) -> None:
+    """Обновить кэш силы тапа (после commit покупки апгрейда)."""
+    k = key("tap", str(tg_id))
     pipe = redis_client.pipeline()
-    pipe.get(k)
-    pipe.delete(k)
-    results = await pipe.execute()
-    return int(results[0] or 0)
+    pipe.hset(k, "tap_power", tap_power)
+    pipe.pexpire(k, TAP_STATE_TTL_MS)
+    await pipe.execute()
+
+
+# ── Отложенные задачи: готовность ферм ───────────────────────────────
+#
+# start_production кладёт здание в ZSET со score = production_ends
+# (unix-время); планировщик атомарно переносит наступившие задачи в ZSET
+# аренды — без сканирования таблицы buildings. Notifier подтверждает
+# задачу после отправки (ack_farm_jobs); аренды, не подтверждённые за
+# FARM_JOB_LEASE (процесс упал или перезапущен), возвращаются в очередь.
+# Доставка — «хотя бы один раз»: падение между отправкой и ack даст повтор.
+#
+#   jobs:farm_ready        — ZSET "<building_id>:<tg_id>:<type>" → ready_at
+#   jobs:farm_ready:leased — ZSET снятых, но не подтверждённых задач → срок аренды
+#   jobs:farm_ready:seeded — маркер: ZSET заполнен из БД (см. backfill)
+
+FARM_READY_JOBS = key("jobs", "farm_ready")
+FARM_READY_LEASED = key("jobs", "farm_ready", "leased")
+FARM_READY_SEEDED = key("jobs", "farm_ready", "seeded")
+
+# Секунд на отправку снятой задачи (с ожиданием лимитов и 429)
+FARM_JOB_LEASE = 300
+
+# Перенести до ARGV[2] задач со score ≤ ARGV[1] из очереди в аренду до ARGV[3]
+_POP_DUE_LUA = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(due) do
+    redis.call('ZADD', KEYS[2], ARGV[3], member)
+end
+if #due > 0 then
+    redis.call('ZREM', KEYS[1], unpack(due))
+end
+return due
+"""
+
+# Вернуть в очередь (score ARGV[1]) аренды, истёкшие к ARGV[1]. Задача,
+# заново поставленная за это время, сохраняет свой срок (NX)
+_REQUEUE_LEASED_LUA = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, member in ipairs(expired) do
+    redis.call('ZADD', KEYS[1], 'NX', ARGV[1], member)
+end
+if #expired > 0 then
+    redis.call('ZREM', KEYS[2], unpack(expired))
+end
+return #expired
+"""
+
+_pop_due_script = redis_client.register_script(_POP_DUE_LUA)
+_requeue_leased_script = redis_client.register_script(_REQUEUE_LEASED_LUA)
 
 
-# ── Кулдауны / Rate Limiting ─────────────────────────────────────────
+def _farm_job(building_id: int, tg_id: int, building_type: str) -> str:
+    return f"{building_id}:{tg_id}:{building_type}"
 
-async def check_cooldown(tg_id: int, action: str, cooldown_sec: int) -> bool:
-    """Проверить кулдаун. True = можно действовать, False = ещё на кулдауне."""
-    k = key("cooldown", str(tg_id), action)
-    if await redis_client.exists(k):
+
+def _utc_ts(dt: datetime) -> float:
+    """Unix-время наивного UTC datetime (как пишет datetime.utcnow())."""
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+async def schedule_farm_ready(
+    building_id: int,
+    tg_id: int,
+    building_type: str,
+    ready_at: datetime,
+) -> None:
+    """Поставить уведомление о готовности здания на момент ready_at (UTC)."""
+    await redis_client.zadd(
+        FARM_READY_JOBS,
+        {_farm_job(building_id, tg_id, building_type): _utc_ts(ready_at)},
+    )
+
+
+async def cancel_farm_ready(building_id: int, tg_id: int, building_type: str) -> None:
+    """Снять уведомление (продукцию собрали раньше, чем оно ушло)."""
+    await redis_client.zrem(FARM_READY_JOBS, _farm_job(building_id, tg_id, building_type))
+
+
+async def pop_due_farm_jobs(limit: int = 500) -> list[tuple[int, int, str]]:
+    """Атомарно взять наступившие задачи в аренду: [(building_id, tg_id, type), ...].
+
+    Каждую задачу нужно подтвердить ack_farm_jobs после отправки.
+    """
+    now = time.time()
+    raw = await _pop_due_script(
+        keys=[FARM_READY_JOBS, FARM_READY_LEASED],
+        args=[now, limit, now + FARM_JOB_LEASE],
+    )
+    jobs = []
+    for member in raw:
+        building_id, tg_id, building_type = member.split(":", 2)
+        jobs.append((int(building_id), int(tg_id), building_type))
+    return jobs
+
+
+def farm_job_ref(building_id: int, tg_id: int, building_type: str) -> str:
+    """Идентификатор задачи для ack_farm_jobs."""
+    return _farm_job(building_id, tg_id, building_type)
+
+
+async def ack_farm_jobs(refs: list[str]) -> None:
+    """Подтвердить отправку: снять задачи из аренды."""
+    if refs:
+        await redis_client.zrem(FARM_READY_LEASED, *refs)
+
+
+async def requeue_expired_farm_jobs() -> int:
+    """Вернуть в очередь задачи с истёкшей арендой. Возвращает их число."""
+    return int(await _requeue_leased_script(
+        keys=[FARM_READY_JOBS, FARM_READY_LEASED],
+        args=[time.time()],
+    ))
+
+
+async def seed_farm_jobs(jobs: list[tuple[int, int, str, datetime]]) -> bool:
+    """Заполнить ZSET задач из БД, если он ещё не заполнялся.
+
+    Маркер seeded защищает от повторных уведомлений после рестарта:
+    снятые задачи не возвращаются. Пропал Redis — пропал и маркер,
+    и заполнение повторится. Возвращает True, если заполнение выполнено.
+    """
+    if not await redis_client.set(FARM_READY_SEEDED, "1", nx=True):
         return False
-    await redis_client.setex(k, cooldown_sec, "1")
+    pipe = redis_client.pipeline(transaction=False)
+    for i in range(0, len(jobs), 1000):
+        pipe.zadd(FARM_READY_JOBS, {
+            _farm_job(building_id, tg_id, building_type): _utc_ts(ready_at)
+            for building_id, tg_id, building_type, ready_at in jobs[i:i + 1000]
+        }, nx=True)
+    await pipe.execute()
     return True
 
 
-async def get_cooldown_ttl(tg_id: int, action: str) -> int:
-    """Оставшееся время кулдауна в секундах."""
-    k = key("cooldown", str(tg_id), action)
-    ttl = await redis_client.ttl(k)
-    return max(0, ttl)
+# ── События игрока (pub/sub) ─────────────────────────────────────────
+#
+# Push-события для WebSocket-соединений Mini App (services.realtime):
+# соединение игрока может быть открыто в любом воркере, поэтому
+# события идут через канал Redis игрока.
+#
+#   ws:<tg_id> — канал JSON-событий {"t": тип, ...}
+
+def player_channel(tg_id: int) -> str:
+    return key("ws", str(tg_id))
+
+
+async def publish_events(events: list[tuple[int, dict]]) -> None:
+    """Опубликовать события [(tg_id, событие)] одним пайплайном."""
+    if not events:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    for tg_id, event in events:
+        pipe.publish(player_channel(tg_id), json.dumps(event, ensure_ascii=False))
+    await pipe.execute()
+
+
+async def publish_event(tg_id: int, event: dict) -> None:
+    """Опубликовать одно событие игроку."""
+    await publish_events([(tg_id, event)])
+
+
+# ── Версии состояния игрока ──────────────────────────────────────────
+#
+# Каждое изменение состояния игрока после commit увеличивает счётчик v и
+# помечает им изменённые разделы (player / buildings / upgrades). По
+# версии /api/state отвечает 304 без БД, по версиям разделов — отдаёт
+# только изменившиеся. base — версия создания хеша: если хеш истёк и
+# создан заново, клиенту с since < base нужна полная выгрузка. base
+# берётся из часов Redis (мс), поэтому версии не идут назад.
+#
+#   state:<tg_id> — HASH {v, base, <раздел>: версия последнего изменения}
 
+STATE_TTL = 7 * 86400
 
-# ── Rate Limiting (antiflood) ────────────────────────────────────────
+# KEYS[1] — хеш версий, KEYS[2] — канал игрока (событие "state" для /ws).
+# ARGV[1] — TTL, ARGV[2..] — изменённые разделы. Возвращает новую версию.
+_BUMP_STATE_LUA = """
+local v
+if redis.call('HEXISTS', KEYS[1], 'v') == 1 then
+    v = redis.call('HINCRBY', KEYS[1], 'v', 1)
+else
+    local t = redis.call('TIME')
+    v = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+    redis.call('HSET', KEYS[1], 'v', v, 'base', v)
+end
+local sections = {}
+for i = 2, #ARGV do
+    redis.call('HSET', KEYS[1], ARGV[i], v)
+    sections[#sections + 1] = ARGV[i]
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+if #sections > 0 then
+    redis.call('PUBLISH', KEYS[2], cjson.encode({t = 'state', v = v, sections = sections}))
+end
+return v
+"""
 
-async def check_rate_limit(tg_id: int, limit: int = 30, window: int = 60) -> bool:
-    """Sliding window rate limiter. True = разрешено, False = лимит."""
-    k = key("ratelimit", str(tg_id))
+_bump_state_script = redis_client.register_script(_BUMP_STATE_LUA)
+
+
+def state_key(tg_id: int) -> str:
+    return key("state", str(tg_id))
+
+
+async def bump_state(tg_id: int, sections: list[str]) -> int:
+    """Отметить изменение разделов состояния и оповестить /ws. Возвращает новую версию."""
+    return int(await _bump_state_script(
+        keys=[state_key(tg_id), player_channel(tg_id)],
+        args=[STATE_TTL, *sections],
+    ))
+
+
+async def bump_state_many(tg_ids: list[int], sections: list[str]) -> None:
+    """bump_state для многих игроков одним пайплайном."""
+    pipe = redis_client.pipeline(transaction=False)
+    for tg_id in tg_ids:
+        await _bump_state_script(
+            keys=[state_key(tg_id), player_channel(tg_id)],
+            args=[STATE_TTL, *sections],
+            client=pipe,
+        )
+    await pipe.execute()
+
+
+async def get_state_versions(tg_id: int) -> dict[str, int]:
+    """Версии состояния игрока: {"v", "base", <раздел>: версия}.
+
+    Раздел без версии изменялся не позже base. Нет хеша — создаётся.
+    """
+    versions = await redis_client.hgetall(state_key(tg_id))
+    if not versions:
+        v = await bump_state(tg_id, [])
+        return {"v": v, "base": v}
+    return {name: int(value) for name, value in versions.items()}
+
+
+# ── Кулдауны ─────────────────────────────────────────────────────────
+#
+# Взятие кулдауна — SET NX EX одним скриптом: проверка и установка
+# атомарны, при отказе тот же вызов возвращает остаток. Значение ключа —
+# момент окончания (unix-время), поэтому статус всех кулдаунов игрока
+# читается одним MGET без TTL на каждый ключ.
+#
+#   cooldown:<tg_id>:<действие> — unix-время окончания кулдауна
+
+# ARGV: длительность (сек). 0 — кулдаун взят, иначе осталось секунд.
+_COOLDOWN_LUA = """
+local now = tonumber(redis.call('TIME')[1])
+if redis.call('SET', KEYS[1], now + tonumber(ARGV[1]), 'NX', 'EX', ARGV[1]) then
+    return 0
+end
+return math.max(1, redis.call('TTL', KEYS[1]))
+"""
+
+_cooldown_script = redis_client.register_script(_COOLDOWN_LUA)
+
+
+async def acquire_cooldown(tg_id: int, action: str, cooldown_sec: int) -> int:
+    """Взять кулдаун действия. 0 — можно действовать, иначе осталось секунд."""
+    return int(await _cooldown_script(
+        keys=[key("cooldown", str(tg_id), action)],
+        args=[cooldown_sec],
+    ))
+
+
+async def get_cooldowns(tg_id: int, actions: list[str]) -> dict[str, int]:
+    """Остаток кулдаунов игрока по действиям (сек, 0 — свободно) одним MGET."""
+    if not actions:
+        return {}
+    ends = await redis_client.mget([key("cooldown", str(tg_id), a) for a in actions])
     now = time.time()
-    pipe = redis_client.pipeline()
-    pipe.zremrangebyscore(k, 0, now - window)  # Удалить старые
-    pipe.zadd(k, {str(now): now})              # Добавить текущий
-    pipe.zcard(k)                               # Подсчитать
-    pipe.expire(k, window)
-    results = await pipe.execute()
-    count = results[2]
-    return count <= limit
+    return {
+        a: max(0, math.ceil(int(end) - now)) if end else 0
+        for a, end in zip(actions, ends)
+    }
+
+
+# ── Rate Limiting (GCRA) ─────────────────────────────────────────────
+#
+# Generic Cell Rate Algorithm: на ключ хранится одно целое — TAT
+# (theoretical arrival time, мс по часам Redis). Запрос проходит, если
+# TAT - tolerance <= now; тогда TAT сдвигается на interval. Проверка и
+# запись — один вызов скрипта; ключ живёт, пока TAT в будущем.
+#
+#   ratelimit:<действие>:<субъект> — TAT в мс
+
+# ARGV: interval (мс на запрос), tolerance (мс = interval * (burst - 1)).
+# Возвращает 0 — разрешено, иначе через сколько мс повторить.
+_GCRA_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local tat = math.max(tonumber(redis.call('GET', KEYS[1]) or now), now)
+if tat - tolerance > now then
+    return tat - tolerance - now
+end
+tat = tat + interval
+redis.call('SET', KEYS[1], tat, 'PX', tat - now)
+return 0
+"""
+
+_gcra_script = redis_client.register_script(_GCRA_LUA)
+
+
+async def check_rate_limit(action: str, subject: str, interval_ms: int, tolerance_ms: int) -> int:
+    """GCRA-проверка в Redis. 0 — разрешено, иначе мс до следующей попытки."""
+    return int(await _gcra_script(
+        keys=[key("ratelimit", action, subject)],
+        args=[interval_ms, tolerance_ms],
+    ))
 
 
 # ── Лидерборд ────────────────────────────────────────────────────────
+#
+# Ключи рейтингов (логика — services.leaderboard; скрипт тапа пишет в
+# рейтинги монет напрямую).
+#
+#   leaderboard:<рейтинг>          — ZSET за всё время
+#   leaderboard:<рейтинг>:<период> — ZSET текущей недели / сезона
+#   leaderboard:<рейтинг>:rebuild  — ZSET, который строит rebuild_boards
+#   leaderboard:rebuild:active     — маркер перестроения: пока он есть,
+#                                    записи в рейтинги за всё время
+#                                    дублируются в :rebuild ключи
 
-async def update_leaderboard(tg_id: int, coins: int) -> None:
-    """Обновить позицию в лидерборде монет."""
-    k = key("leaderboard", "coins")
-    await redis_client.zadd(k, {str(tg_id): coins})
+LEADERBOARD_REBUILDING = key("leaderboard", "rebuild", "active")
 
 
-async def get_leaderboard_top(count: int = 10) -> list[tuple[str, float]]:
-    """Получить топ игроков по монетам."""
-    k = key("leaderboard", "coins")
-    return await redis_client.zrevrange(k, 0, count - 1, withscores=True)
+def leaderboard_key(board: str, period: str = "all") -> str:
+    """Ключ ZSET рейтинга за период ("all" — за всё время)."""
+    if period == "all":
+        return key("leaderboard", board)
+    return key("leaderboard", board, period)
 
 
-async def get_leaderboard_rank(tg_id: int) -> int | None:
-    """Получить ранг игрока (0-based). None если не в лидерборде."""
-    k = key("leaderboard", "coins")
-    rank = await redis_client.zrevrank(k, str(tg_id))
-    return rank
+def leaderboard_rebuild_key(live_key: str) -> str:
+    """Временный ключ, в котором перестраивается live_key."""
+    return f"{live_key}:rebuild"
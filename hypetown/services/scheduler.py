@@ -1,61 +1,204 @@
-"""APScheduler: таймеры ферм, уведомления о готовности производства."""
+"""APScheduler: уведомления о готовности производства, сброс леджера тапов, смена периодов рейтингов."""
 
 import logging
+from datetime import datetime, timedelta
 
 from aiogram import Bot
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+from config import config
 from db.database import async_session
-from db.repositories.building import get_ready_buildings
-from game.constants import BUILDINGS
+from db.repositories.building import get_producing_jobs
+from db.repositories.player import apply_coin_deltas, get_applied_ledger_ids, record_ledger_flush
+from game.constants import BUILDINGS, SEASON_MONTHS
+from services.leaderboard import period_label, rollover
+from services.notifier import notifier
+from services.redis_service import (
+    abort_ledger_flush,
+    begin_ledger_flush,
+    bump_state_many,
+    finish_ledger_flush,
+    farm_job_ref,
+    get_stale_settled_coins,
+    pop_due_farm_jobs,
+    publish_events,
+    release_settled_coins,
+    requeue_expired_farm_jobs,
+    return_settled_coins,
+    seed_farm_jobs,
+)
 
 logger = logging.getLogger(__name__)
 
 scheduler = AsyncIOScheduler()
 
+# Сколько задач готовности снимать из Redis за один вызов скрипта
+FARM_JOBS_BATCH = 500
 
-async def check_production_ready(bot: Bot) -> None:
-    """Проверить все здания с завершённым производством и отправить уведомления."""
+
+async def notify_farms_ready() -> int:
+    """Взять наступившие задачи из Redis в аренду и передать их в диспетчер уведомлений.
+
+    Задача подтверждается после отправки; аренды, брошенные упавшим или
+    перезапущенным процессом, сначала возвращаются в очередь. Доставка
+    «хотя бы один раз», в БД не ходим. Несколько ферм одного игрока
+    notifier объединит в один дайджест; в Mini App уходит событие
+    farm_ready. Возвращает число снятых задач.
+    """
+    requeued = await requeue_expired_farm_jobs()
+    if requeued:
+        logger.warning("Уведомления ферм: %d неподтверждённых задач возвращено в очередь", requeued)
+
+    total = 0
+    while True:
+        jobs = await pop_due_farm_jobs(FARM_JOBS_BATCH)
+        for building_id, tg_id, building_type in jobs:
+            info = BUILDINGS.get(building_type, {})
+            notifier.enqueue(
+                tg_id,
+                "farm_ready",
+                f"{info.get('emoji', '🏗')} <b>{info.get('name', 'Здание')}</b>",
+                ref=farm_job_ref(building_id, tg_id, building_type),
+            )
+        # То же событие — в открытый Mini App (WebSocket)
+        await publish_events([
+            (tg_id, {"t": "farm_ready", "building_id": building_id, "type": building_type})
+            for building_id, tg_id, building_type in jobs
+        ])
+        total += len(jobs)
+        if len(jobs) < FARM_JOBS_BATCH:
+            break
+    return total
+
+
+async def backfill_farm_jobs() -> None:
+    """Заполнить очередь уведомлений из БД (первый запуск или потеря Redis)."""
+    async with async_session() as session:
+        jobs = await get_producing_jobs(session)
+    if await seed_farm_jobs(jobs):
+        logger.info("Очередь уведомлений ферм заполнена из БД: %d задач", len(jobs))
+
+
+async def flush_tap_ledger() -> int:
+    """Перенести накопленные в Redis монеты с тапов в players.coins.
+
+    Один батч → один UPDATE ... FROM (VALUES ...) на чанк игроков.
+    Если запись в БД упала, батч остаётся в Redis и повторяется на
+    следующем тике. id батча пишется в ledger_flushes той же
+    транзакцией: повтор уже закоммиченного батча (упал finish, истекла
+    блокировка) монеты не зачисляет. После finish разделу player
+    сброшенных игроков поднимается версия: пока батч лежал и в БД, и в
+    ledger:flushing, /api/state мог отдать баланс с двойным счётом под
+    версией, которую клиент иначе продолжал бы подтверждать через 304.
+    Возвращает число обновлённых игроков.
+    """
+    batch = await begin_ledger_flush()
+    if batch is None or not batch.deltas:
+        # None — сброс уже идёт в другом воркере, {} — нечего сбрасывать
+        return 0
+
+    updated = 0
+    try:
+        async with async_session() as session:
+            if await record_ledger_flush(session, batch.batch_id):
+                updated = await apply_coin_deltas(session, batch.deltas)
+            else:
+                logger.warning("Леджер тапов: батч %s уже применён, пропуск", batch.batch_id)
+            await session.commit()
+    except Exception:
+        await abort_ledger_flush(batch)
+        raise
+
+    if not await finish_ledger_flush(batch):
+        logger.warning("Леджер тапов: блокировка батча %s истекла до finish", batch.batch_id)
+    await bump_state_many(list(batch.deltas), ["player"])
+    logger.debug("Леджер тапов: сброшено %d игроков", updated)
+    return updated
+
+
+async def recover_settled_coins() -> int:
+    """Разобрать переносы монет из леджера, брошенные упавшим воркером.
+
+    Перенос, чей id есть в ledger_flushes, закоммичен — его запись
+    удаляется; остальные откатились вместе с транзакцией — монеты
+    возвращаются в pending. Возвращает число возвращённых переносов.
+    """
+    stale = await get_stale_settled_coins()
+    if not stale:
+        return 0
     async with async_session() as session:
-        ready = await get_ready_buildings(session)
-
-    if not ready:
-        return
-
-    for building in ready:
-        info = BUILDINGS.get(building.type.value, {})
-        try:
-            # Получаем tg_id игрока через relationship
-            async with async_session() as session:
-                from db.models import Player
-                from sqlalchemy import select
-                result = await session.execute(
-                    select(Player.tg_id).where(Player.id == building.player_id)
-                )
-                tg_id = result.scalar_one_or_none()
-
-            if tg_id:
-                await bot.send_message(
-                    tg_id,
-                    f"📦 {info.get('emoji', '🏗')} <b>{info.get('name', 'Здание')}</b> "
-                    f"завершило производство!\n"
-                    f"Зайди собрать продукцию 💰",
-                )
-        except Exception as e:
-            logger.error("Ошибка уведомления для building_id=%d: %s", building.id, e)
-
-    logger.info("Отправлено %d уведомлений о готовности", len(ready))
+        applied = await get_applied_ledger_ids(session, stale)
+    if applied:
+        await release_settled_coins(list(applied))
+    returned = await return_settled_coins([s for s in stale if s not in applied])
+    logger.warning(
+        "Леджер тапов: брошенных переносов %d, возвращено в леджер %d",
+        len(stale), returned,
+    )
+    return returned
+
+
+async def rollover_leaderboards(period: str) -> None:
+    """Закрыть недельные / сезонные рейтинги (задача запускается в начале нового периода)."""
+    # Метка — период, который только что закончился
+    await rollover(period, period_label(period, datetime.utcnow() - timedelta(hours=1)))
 
 
 def setup_scheduler(bot: Bot) -> None:
     """Настроить и запустить планировщик."""
-    # Проверка готовности ферм каждые 30 секунд
+    # Уведомления о готовности ферм из очереди Redis
+    notifier.start(bot)
     scheduler.add_job(
-        check_production_ready,
+        notify_farms_ready,
         "interval",
-        seconds=30,
-        args=[bot],
-        id="check_production",
+        seconds=config.farm_notify_interval,
+        id="notify_farms_ready",
+        max_instances=1,
+        replace_existing=True,
+    )
+    # Метрики диспетчера уведомлений
+    scheduler.add_job(
+        notifier.log_stats,
+        "interval",
+        seconds=60,
+        id="notifier_stats",
+        replace_existing=True,
+    )
+    # Сброс леджера тапов Redis → Postgres
+    scheduler.add_job(
+        flush_tap_ledger,
+        "interval",
+        seconds=config.ledger_flush_interval,
+        id="flush_tap_ledger",
+        replace_existing=True,
+    )
+    # Переносы монет из леджера, брошенные упавшими воркерами
+    scheduler.add_job(
+        recover_settled_coins,
+        "interval",
+        seconds=60,
+        id="recover_settled_coins",
+        max_instances=1,
+        replace_existing=True,
+    )
+    # Смена недели (пн 00:00 UTC) и сезона (1-е число квартала) в рейтингах
+    scheduler.add_job(
+        rollover_leaderboards,
+        "cron",
+        args=["week"],
+        day_of_week="mon", hour=0, minute=0, timezone="UTC",
+        id="rollover_week",
+        misfire_grace_time=3600,
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        rollover_leaderboards,
+        "cron",
+        args=["season"],
+        month=",".join(str(m) for m in range(1, 13, SEASON_MONTHS)),
+        day=1, hour=0, minute=0, timezone="UTC",
+        id="rollover_season",
+        misfire_grace_time=3600,
         replace_existing=True,
     )
     scheduler.start()
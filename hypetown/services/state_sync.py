@@ -0,0 +1,35 @@
+"""Версии состояния игрока для дельта-синхронизации /api/state.
+
+Игровая логика отмечает изменённые разделы через mark_changed(); после
+commit они одной командой Redis получают новую версию
+(redis_service.bump_state). Тапы помечают раздел player прямо в
+скрипте тапа.
+"""
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.database import on_commit
+from game.state import SECTIONS
+from services.redis_service import bump_state
+
+
+def mark_changed(session: AsyncSession, tg_id: int, *sections: str) -> None:
+    """Отметить разделы состояния игрока изменёнными (версия — после commit)."""
+    changed = session.info.get("state_changes")
+    if changed is None:
+        changed = session.info["state_changes"] = {}
+        on_commit(session, _bump_changed, session)
+    changed.setdefault(tg_id, set()).update(sections)
+
+
+async def _bump_changed(session: AsyncSession) -> None:
+    for tg_id, sections in session.info.pop("state_changes", {}).items():
+        await bump_state(tg_id, sorted(sections))
+
+
+def changed_since(versions: dict[str, int], since: int) -> list[str]:
+    """Разделы, изменённые после версии since (все — если since не из этого хеша)."""
+    base = versions["base"]
+    if not base <= since <= versions["v"]:
+        return list(SECTIONS)
+    return [s for s in SECTIONS if versions.get(s, base) > since]
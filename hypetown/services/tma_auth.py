@@ -1,48 +1,75 @@
-"""Валидация Telegram WebApp initData для Mini App."""
+"""Валидация Telegram WebApp initData для Mini App.
+
+Клиент шлёт одну и ту же initData во всех запросах сессии. Секрет
+HMAC считается один раз при импорте, а проверенная initData кэшируется
+(LRU по полю hash) до истечения auth_date + TMA_AUTH_MAX_AGE: повторный
+запрос обходится без HMAC, разбора строки и JSON.
+"""
 
 import hashlib
 import hmac
 import json
 import logging
-from urllib.parse import parse_qs, unquote
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl
 
 from config import config
 
 logger = logging.getLogger(__name__)
 
+# secret_key = HMAC_SHA256("WebAppData", bot_token) — не зависит от запроса
+_SECRET_KEY = hmac.new(b"WebAppData", config.bot_token.encode(), hashlib.sha256).digest()
+
+# Сколько проверенных initData держать в кэше
+VERIFIED_CACHE_SIZE = 10_000
+
+# hash → (initData целиком, данные, истекает в unix-время). Совпадение
+# строки целиком обязательно: один hash с другими полями — подделка.
+_verified: OrderedDict[str, tuple[str, dict, float]] = OrderedDict()
+
+
+def _received_hash(init_data: str) -> str | None:
+    """Значение поля hash без разбора всей строки (hex, в URL-кодировании не нуждается)."""
+    for part in init_data.split("&"):
+        if part.startswith("hash="):
+            return part[5:]
+    return None
+
 
 def validate_init_data(init_data: str) -> dict | None:
     """Валидация initData от Telegram WebApp.
 
-    Возвращает распарсенные данные пользователя или None при невалидном хеше.
+    Возвращает распарсенные данные пользователя или None при невалидном
+    хеше или auth_date старше config.tma_auth_max_age. Результат общий для
+    повторных запросов — не изменять.
     Документация: https://core.telegram.org/bots/webapps#validating-data-received-via-the-mini-app
     """
-    parsed = parse_qs(init_data)
-    received_hash = parsed.get("hash", [None])[0]
-
+    received_hash = _received_hash(init_data)
     if not received_hash:
         logger.warning("initData без hash")
         return None
 
+    now = time.time()
+    cached = _verified.get(received_hash)
+    if cached is not None and cached[0] == init_data:
+        if cached[2] > now:
+            _verified.move_to_end(received_hash)
+            return cached[1]
+        del _verified[received_hash]
+        logger.debug("initData просрочена")
+        return None
+
+    parsed = dict(parse_qsl(init_data))
+
     # Собираем data-check-string: все поля кроме hash, отсортированные по ключу
-    data_pairs = []
-    for key, values in parsed.items():
-        if key == "hash":
-            continue
-        data_pairs.append(f"{key}={unquote(values[0])}")
-    data_pairs.sort()
-    data_check_string = "\n".join(data_pairs)
-
-    # HMAC-SHA256: secret_key = HMAC_SHA256("WebAppData", bot_token)
-    secret_key = hmac.new(
-        b"WebAppData",
-        config.bot_token.encode(),
-        hashlib.sha256,
-    ).digest()
+    data_check_string = "\n".join(
+        f"{key}={value}" for key, value in sorted(parsed.items()) if key != "hash"
+    )
 
     # Вычисляем хеш и сравниваем
     computed_hash = hmac.new(
-        secret_key,
+        _SECRET_KEY,
         data_check_string.encode(),
         hashlib.sha256,
     ).hexdigest()
@@ -51,15 +78,24 @@ def validate_init_data(init_data: str) -> dict | None:
         logger.warning("Невалидный hash в initData")
         return None
 
+    # Свежесть: подписанная initData не должна жить вечно
+    auth_date = parsed.get("auth_date", "")
+    expires_at = (int(auth_date) if auth_date.isdigit() else 0) + config.tma_auth_max_age
+    if expires_at <= now:
+        logger.debug("initData просрочена")
+        return None
+
     # Парсим данные пользователя
-    user_raw = parsed.get("user", [None])[0]
-    if user_raw:
-        user_data = json.loads(unquote(user_raw))
-    else:
-        user_data = {}
+    user_raw = parsed.get("user")
+    user_data = json.loads(user_raw) if user_raw else {}
 
-    return {
+    data = {
         "user": user_data,
-        "auth_date": parsed.get("auth_date", [None])[0],
-        "query_id": parsed.get("query_id", [None])[0],
+        "auth_date": auth_date or None,
+        "query_id": parsed.get("query_id"),
     }
+
+    _verified[received_hash] = (init_data, data, expires_at)
+    while len(_verified) > VERIFIED_CACHE_SIZE:
+        _verified.popitem(last=False)
+    return data
@@ -0,0 +1,36 @@
+"""Общая настройка тестов: конфиг без .env и SQLite в памяти вместо PostgreSQL.
+
+Запуск из каталога hypetown:
+    pip install -r requirements.txt -r requirements-dev.txt
+    python -m pytest
+"""
+
+import os
+
+# config читается при импорте модулей бота — нужен хотя бы токен
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+
+
+@pytest.fixture
+def engine():
+    """Движок SQLite в памяти (одно соединение на все сессии теста).
+
+    pysqlite сам управляет транзакциями и ломает SAVEPOINT, поэтому BEGIN
+    выдаётся явно (рецепт из документации SQLAlchemy для SQLite).
+    """
+    engine = create_async_engine("sqlite+aiosqlite://")
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _connect(dbapi_connection, _record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine.sync_engine, "begin")
+    def _begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+    return engine
+
@@ -0,0 +1,79 @@
+"""POST /api/batch: best_effort откатывает отказавшее действие, не ломая следующие."""
+
+import asyncio
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from bot.handlers import miniapp
+from db.models import Base, Building, ClickerUpgrade, Player
+from db.repositories.player import get_player_by_tg_id
+from game.constants import Archetype, BuildingType, ClickerUpgradeType
+
+TG_ID = 1001
+
+
+async def _seed(engine) -> async_sessionmaker[AsyncSession]:
+    """Схема и игрок со зданием и апгрейдом; фабрика сессий как db.database.async_session."""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with factory() as session:
+        player = Player(tg_id=TG_ID, name="Test", avatar="🎬", archetype=Archetype.DIRECTOR, coins=500)
+        session.add(player)
+        await session.flush()
+        session.add_all([
+            Building(player_id=player.id, type=BuildingType.CINEMA_STUDIO, level=2),
+            ClickerUpgrade(player_id=player.id, upgrade_type=ClickerUpgradeType.SMARTPHONE, level=3),
+        ])
+        await session.commit()
+    return factory
+
+
+async def _failing_action(session, player, params: dict) -> dict:
+    """Меняет игрока и обе связи, пишет в БД и отказывает."""
+    player.coins = 0
+    player.buildings[0].level = 99
+    player.clicker_upgrades[0].level = 99
+    player.buildings.append(Building(type=BuildingType.SERIES_LOT))
+    await session.flush()
+    return {"ok": False, "error": "boom"}
+
+
+async def _reading_action(session, player, params: dict) -> dict:
+    return {
+        "ok": True,
+        "coins": player.coins,
+        "buildings": [(b.type, b.level) for b in player.buildings],
+        "upgrades": [(u.upgrade_type, u.level) for u in player.clicker_upgrades],
+    }
+
+
+async def _no_pending(tg_id: int) -> int:
+    return 0
+
+
+def test_best_effort_failure_reloads_relations(engine, monkeypatch):
+    """После отката savepoint следующее действие читает связи без lazy="raise"."""
+    monkeypatch.setattr(miniapp, "get_pending_coins", _no_pending)
+
+    async def scenario() -> tuple[dict, dict]:
+        try:
+            factory = await _seed(engine)
+            plan = miniapp._relations_plan({"buildings", "clicker_upgrades"})
+            async with factory() as session:
+                player = await get_player_by_tg_id(session, TG_ID, plan=plan)
+                failed = await miniapp._run_isolated(session, player, _failing_action, {"type": "boom"}, plan)
+                read = await miniapp._run_isolated(session, player, _reading_action, {"type": "read"}, plan)
+        finally:
+            await engine.dispose()
+        return failed, read
+
+    failed, read = asyncio.run(scenario())
+
+    assert failed == {"ok": False, "error": "boom"}
+    assert read == {
+        "ok": True,
+        "coins": 500,
+        "buildings": [(BuildingType.CINEMA_STUDIO, 2)],
+        "upgrades": [(ClickerUpgradeType.SMARTPHONE, 3)],
+    }
@@ -0,0 +1,69 @@
+"""Сбор ферм: цикл, который уже забрал параллельный апдейт, не оплачивается повторно."""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from db.models import Base, Building, Player
+from db.repositories.building import claim_collect
+from game.constants import Archetype, BuildingType
+
+
+async def _seed(engine, now: datetime) -> async_sessionmaker[AsyncSession]:
+    """Игрок с готовым зданием на таймере и непрерывным зданием с циклами на складе."""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with factory() as session:
+        player = Player(tg_id=1, name="Test", avatar="🎬", archetype=Archetype.DIRECTOR)
+        session.add(player)
+        await session.flush()
+        session.add_all([
+            Building(
+                player_id=player.id, type=BuildingType.CINEMA_STUDIO,
+                is_producing=True, production_started=now - timedelta(hours=2),
+                production_ends=now - timedelta(hours=1),
+            ),
+            Building(
+                player_id=player.id, type=BuildingType.SERIES_LOT,
+                is_continuous=True, last_collected=now - timedelta(days=1),
+            ),
+        ])
+        await session.commit()
+    return factory
+
+
+def test_concurrent_collect_claims_each_cycle_once(engine):
+    now = datetime.utcnow()
+    select_buildings = select(Building).order_by(Building.id)
+
+    async def scenario() -> tuple[list, list, list]:
+        try:
+            factory = await _seed(engine, now)
+            async with factory() as stale, factory() as fresh:
+                # Первый апдейт прочитал здания раньше, чем второй их собрал
+                late = list(await stale.scalars(select_buildings))
+                await stale.commit()
+                early = list(await fresh.scalars(select_buildings))
+                anchor = early[1].last_collected + timedelta(hours=1)
+
+                won = await claim_collect(fresh, [(early[0], now), (early[1], anchor)], now)
+                await fresh.commit()
+                lost = await claim_collect(stale, [(late[0], now), (late[1], anchor)], now)
+                await stale.commit()
+
+            async with factory() as session:
+                reread = list(await session.scalars(select_buildings))
+            return won, lost, reread
+        finally:
+            await engine.dispose()
+
+    won, lost, reread = asyncio.run(scenario())
+
+    assert [b.type for b in won] == [BuildingType.CINEMA_STUDIO, BuildingType.SERIES_LOT]
+    assert won[0].is_producing is False and won[0].production_ends is None
+    assert lost == []
+    assert reread[0].is_producing is False
+    assert reread[1].last_collected == won[1].last_collected
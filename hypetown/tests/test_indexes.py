@@ -0,0 +1,101 @@
+"""Горячие запросы идут по индексам: EXPLAIN на PostgreSQL без Seq Scan.
+
+Нужна PostgreSQL с применёнными миграциями (SQLite индексы не проверит):
+    alembic upgrade head
+    TEST_DATABASE_URL=postgresql+asyncpg://... python -m pytest tests/test_indexes.py
+Без TEST_DATABASE_URL тест пропускается.
+"""
+
+import asyncio
+import json
+import os
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from db.models import Building, ClickerUpgrade, DailyQuest, Inventory, Order, Player
+from db.repositories.order import COMPLETE_ORDER_SQL
+from game.constants import Resource
+
+DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL не задан")
+
+
+def _hot_queries() -> dict:
+    """Запросы репозиториев и игровой логики: имя → statement с подставленными параметрами."""
+    now = datetime.utcnow()
+    return {
+        # db.repositories.player.get_player_by_tg_id
+        "player_by_tg_id": select(Player).where(Player.tg_id == 1),
+        # db.repositories.player.apply_coin_deltas (по одной строке чанка)
+        "apply_coin_delta": update(Player).where(Player.tg_id == 1).values(coins=Player.coins + 1),
+        # LOAD_PLANS: selectin/joined загрузка связей по player_id
+        "buildings_by_player": select(Building).where(Building.player_id == 1),
+        "upgrades_by_player": select(ClickerUpgrade).where(ClickerUpgrade.player_id == 1),
+        "inventory_by_player": select(Inventory).where(Inventory.player_id == 1),
+        "daily_quests_by_player": select(DailyQuest).where(
+            DailyQuest.player_id == 1, DailyQuest.date == date.today(),
+        ),
+        # game.quests.get_active_orders
+        "active_orders": select(Order).where(
+            Order.player_id == 1,
+            Order.completed_at.is_(None),
+            Order.expires_at > now,
+        ).order_by(Order.expires_at),
+        # db.repositories.building.get_producing_jobs
+        "producing_buildings": (
+            select(Building.id, Player.tg_id, Building.type, Building.production_ends)
+            .join(Player, Player.id == Building.player_id)
+            .where(Building.is_producing == True, Building.production_ends.is_not(None))
+        ),
+        # db.repositories.inventory.add_resources / consume_resources (ключ строки)
+        "inventory_row": select(Inventory).where(
+            Inventory.player_id == 1, Inventory.resource == Resource.FILM,
+        ),
+        # db.repositories.order.complete_order
+        "complete_order": COMPLETE_ORDER_SQL.bindparams(
+            player_id=1, order_id=1, now=now, bonus_since=now,
+        ),
+    }
+
+
+def _seq_scans(plan: dict) -> list[str]:
+    """Таблицы, которые план читает последовательным сканированием."""
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name", "?"))
+    for child in plan.get("Plans", []):
+        found.extend(_seq_scans(child))
+    return found
+
+
+def test_hot_queries_use_indexes():
+    """На маленькой БД планировщик честно выбирает Seq Scan, поэтому он
+    штрафуется (enable_seqscan = off): Seq Scan в плане остаётся, только
+    если подходящего индекса нет вовсе. Транзакция откатывается.
+    """
+
+    async def explain_all() -> dict[str, list[str]]:
+        engine = create_async_engine(DATABASE_URL)
+        try:
+            async with engine.connect() as conn:
+                await conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+                scans = {}
+                for name, stmt in _hot_queries().items():
+                    # EXPLAIN компилируется отдельно от запроса: параметры
+                    # подставлены литералами, так что UPDATE и text() проходят одинаково
+                    sql = stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+                    raw = (await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}")).scalar_one()
+                    plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+                    scans[name] = sorted(set(_seq_scans(plan)))
+                await conn.rollback()
+            return scans
+        finally:
+            await engine.dispose()
+
+    scans = asyncio.run(explain_all())
+
+    assert {name: seq for name, seq in scans.items() if seq} == {}